@@ -12,6 +12,7 @@ from nox.sessions import Session
 python_code_path_list: List[str] = [
     "src",
     "scripts",
+    "tests",
     "main.py",
     "noxfile.py",
 ]
@@ -0,0 +1,528 @@
+"""Micro-benchmarks of the lib3d geometry kernels
+
+Synthetic depth maps, templates and molds are generated at several sizes and every kernel is timed
+(``--repeat`` runs, after one warm-up run) and measured for its peak traced memory (``tracemalloc``, one extra run).
+
+$ poetry run python ./scripts/benchmark/main.py --output ./output/benchmark/numpy.json
+$ .local/blender/blender --background --python ./scripts/benchmark/main.py -- --output ./output/benchmark/bpy.json
+
+Kernels needing Blender (``impl`` "bpy") are reported as skipped outside Blender; their NumPy equivalents
+are always measured.
+"""
+
+# Standard Library
+import argparse
+import importlib.util
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing as t
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+import PIL
+import PIL.Image
+
+# First Party Library
+from lib3d.geometry import MeshArrays
+from lib3d.geometry import close_vertex_pairs
+from lib3d.geometry import inside_polygon_angle_sum
+from lib3d.geometry import inside_polygon_edge_function
+from lib3d.geometry import sample_points_on_plane
+from lib3d.heightfield import HeightField
+from lib3d.intersection import FarthestHits
+from lib3d.intersection import MaskFrame
+from lib3d.intersection import build_polygon_bvh
+from lib3d.intersection import find_farthest_intersections
+from lib3d.intersection import find_farthest_intersections_bvh
+from lib3d.intersection import find_farthest_intersections_near
+from lib3d.mask import MaskIndex
+from lib3d.mask import create_mask
+from lib3d.mold import mold_matrix_world
+from lib3d.mold import plane_grid_mesh
+from lib3d.multires import TemplateHierarchy
+from lib3d.multires import deform_coarse_to_fine
+from lib3d.processing import build_mold_mesh
+from lib3d.processing import move_vertices
+from lib3d.types import MoldConfig
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+HAS_BPY: bool = importlib.util.find_spec("bpy") is not None
+
+DEPTH_SIZES: t.List[int] = [128, 256, 512, 1024]
+TEMPLATE_LEVELS: t.List[int] = [0, 1, 2, 3, 4]  # UV sphere with 8 * 2^level segments and 4 * 2^level rings
+GRID_RESOLUTIONS: t.List[int] = [15, 45, 135]  # mold faces: (grid_resolution + 1)^2
+NUM_POINTS: t.List[int] = [1000, 10000, 100000]
+
+
+@dataclass
+class Case:
+    kernel: str
+    impl: str  # "bpy" (needs Blender) or "numpy", "numpy-bvh", ... (the array equivalents)
+    size: t.Dict[str, int]
+    run: t.Callable[[t.Any], t.Any]
+    setup: t.Optional[t.Callable[[], t.Any]] = None  # called before every run (not timed)
+    skip: t.Optional[str] = None
+
+
+@dataclass
+class CaseResult:
+    kernel: str
+    impl: str
+    size: t.Dict[str, int]
+    seconds: t.List[float] = field(default_factory=list)
+    median: t.Optional[float] = None
+    min: t.Optional[float] = None
+    peak_memory_bytes: t.Optional[int] = None  # memory allocated through Python/NumPy (not by Blender)
+    skipped: t.Optional[str] = None
+
+
+def synthetic_depth(size: int) -> npt.NDArray[npt.Shape["*, *"], npt.UInt8]:
+    """a rendered-like depth image: an ellipsoid-ish object (0-254, near is dark) on the background 255"""
+    yy, xx = np.mgrid[-1.0 : 1.0 : size * 1j, -1.0 : 1.0 : size * 1j]
+    r2 = (xx / 0.6) ** 2 + (yy / 0.8) ** 2
+    depth = np.full((size, size), 255, dtype=np.uint8)
+    inside = r2 < 1.0
+    depth[inside] = (64 + 128 * r2[inside] + 16 * np.sin(8 * xx[inside])).astype(np.uint8)
+    return depth
+
+
+def synthetic_template(level: int) -> MeshArrays:
+    """a unit UV sphere in world coordinates (the template is only used through the rays through its vertices)"""
+    num_segments: int = 8 * 2**level
+    num_rings: int = 4 * 2**level
+    theta = np.linspace(0.0, np.pi, num_rings + 1)[1:-1]
+    phi = np.linspace(0.0, 2 * np.pi, num_segments, endpoint=False)
+    theta_grid, phi_grid = np.meshgrid(theta, phi, indexing="ij")
+    ring_vertices = np.stack(
+        [np.sin(theta_grid) * np.cos(phi_grid), np.sin(theta_grid) * np.sin(phi_grid), np.cos(theta_grid)], axis=-1
+    ).reshape(-1, 3)
+    vertices = np.concatenate([[[0.0, 0.0, 1.0]], ring_vertices, [[0.0, 0.0, -1.0]]])
+
+    faces: t.List[t.List[int]] = []
+    idx = 1 + np.arange((num_rings - 1) * num_segments).reshape(num_rings - 1, num_segments)
+    nxt = np.roll(idx, -1, axis=1)
+    faces += [[0, int(a), int(b)] for a, b in zip(idx[0], nxt[0])]
+    faces += [
+        [int(a), int(b), int(c), int(d)]
+        for a, b, c, d in zip(idx[:-1].ravel(), idx[1:].ravel(), nxt[1:].ravel(), nxt[:-1].ravel())
+    ]
+    faces += [[int(b), int(a), len(vertices) - 1] for a, b in zip(idx[-1], nxt[-1])]
+    return MeshArrays.from_faces(vertices, faces)
+
+
+def mold_mask_frame(mesh: MeshArrays, depth: npt.NDArray[npt.Shape["*, *"], npt.UInt8]) -> MaskFrame:
+    """the mask frame of ``processing.deform_template`` for a mold in world coordinates"""
+    mask_array = create_mask(depth, background=255)[:, ::-1]  # horizontal flip
+    y_min, z_min = mesh.vertices[:, 1:].min(axis=0)
+    y_max, z_max = mesh.vertices[:, 1:].max(axis=0)
+    return MaskFrame(mask_array, y_min=y_min, z_min=z_min, y_max=y_max, z_max=z_max)
+
+
+def bounding_box_yz(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float], matrix_world: npt.NDArray[npt.Shape["4, 4"], npt.Float]
+) -> t.Tuple[float, float, float, float]:
+    """the array version of ``get_bounding_box_yz`` of ``scripts/processing-template/main.py``"""
+    world_vertices = vertices @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+    y_min, z_min = world_vertices[:, 1:].min(axis=0)
+    y_max, z_max = world_vertices[:, 1:].max(axis=0)
+    return (y_min, z_min, y_max, z_max)
+
+
+def polygon_points(num_points: int, seed: int = 0) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """unit squares on the z = 0 plane and one random point around each (about half of them inside)"""
+    rng = np.random.default_rng(seed)
+    offsets = rng.uniform(-10.0, 10.0, size=(num_points, 1, 3)) * np.array([1.0, 1.0, 0.0])
+    square = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [1.0, 1.0, 0.0], [0.0, 1.0, 0.0]])
+    polygons = offsets + square
+    points = offsets[:, 0, :] + rng.uniform(-0.2, 1.2, size=(num_points, 3)) * np.array([1.0, 1.0, 0.0])
+    normals = np.tile([0.0, 0.0, 1.0], (num_points, 1))
+    return polygons, points, normals
+
+
+#########
+# cases #
+#########
+
+
+def numpy_cases(args: argparse.Namespace) -> t.Iterator[Case]:
+    for size in args.depth_sizes:
+        depth = synthetic_depth(size)
+        yield Case("create_mask", "numpy", {"depth_size": size}, run=lambda _, d=depth: create_mask(d, background=255))
+        yield Case(
+            "create_mask",
+            "mask_index",
+            {"depth_size": size},
+            run=lambda _, d=depth: MaskIndex.build(d, background=255).mask(size=5),
+        )
+
+    for resolution in args.grid_resolutions:
+        depth = synthetic_depth(max(args.depth_sizes))
+        flat = np.zeros_like(depth)
+        size = {"grid_resolution": resolution}
+        yield Case(
+            "depth_map2plane",
+            "numpy",
+            size,
+            run=lambda _, d=depth, r=resolution: plane_grid_mesh(depth_arr=255 - d, grid_resolution=r),
+        )
+        # subdividing the plane is what plane_grid_mesh replaces
+        yield Case(
+            "subdivide_obj", "numpy", size, run=lambda _, d=flat, r=resolution: plane_grid_mesh(d, grid_resolution=r)
+        )
+        mesh = plane_grid_mesh(depth_arr=255 - depth, grid_resolution=resolution)
+        matrix = mold_matrix_world()
+        yield Case(
+            "get_bounding_box_yz",
+            "numpy",
+            size,
+            run=lambda _, m=mesh, mat=matrix: bounding_box_yz(m.vertices, mat),
+        )
+        # create_mesh_object: the duplicate check of the mold vertices
+        yield Case(
+            "create_mesh_object",
+            "numpy",
+            {**size, "vertices": len(mesh.vertices)},
+            run=lambda _, m=mesh: close_vertex_pairs(m.vertices, tolerance=0.001),
+        )
+
+    for num_points in args.num_points:
+        polygons, points, normals = polygon_points(num_points)
+        yield Case(
+            "whether_intersection_is_inside_polygon",
+            "numpy",
+            {"num_points": num_points},
+            run=lambda _, p=polygons, q=points, n=normals: inside_polygon_angle_sum(p, q, n),
+        )
+        yield Case(
+            "whether_intersection_is_inside_polygon",
+            "numpy-edge",
+            {"num_points": num_points},
+            run=lambda _, p=polygons, q=points, n=normals: inside_polygon_edge_function(p, q, n),
+        )
+        yield Case(
+            "sampling_on_plane",
+            "numpy",
+            {"num_points": num_points},
+            run=lambda _, k=num_points: sample_points_on_plane(np.zeros(3), np.array([0.0, 0.0, 1.0]), k, rng=0),
+        )
+
+    depth = synthetic_depth(args.mold_depth_size)
+    for resolution in args.grid_resolutions:
+        mold = build_mold_mesh(255 - depth, MoldConfig(builder="array", grid_resolution=resolution, decimate_ratio=1.0))
+        mask_frame = mold_mask_frame(mold, depth)
+        height_field = HeightField.from_depth_arr(depth_arr=255 - depth, grid_resolution=resolution)
+        height_field_frame = MaskFrame(mask_frame.mask_array, *height_field.bounding_box_yz())
+        bvh = build_polygon_bvh(mold)
+        for level in args.template_levels:
+            vertices = synthetic_template(level).vertices
+            size = {"template_vertices": len(vertices), "mold_faces": mold.num_polygons}
+            for impl, find in [("numpy", find_farthest_intersections), ("numpy-bvh", find_farthest_intersections_bvh)]:
+                yield Case(
+                    "move_mesh_vertices_with_mask",
+                    impl,
+                    size,
+                    run=lambda _, v=vertices, f=find, m=mold, mf=mask_frame: move_vertices(
+                        v, lambda x: f(x, m, mf, chunk_size=args.chunk_size)
+                    ),
+                )
+            yield Case(
+                "move_mesh_vertices_with_mask",
+                "numpy-heightfield",
+                size,
+                run=lambda _, v=vertices, h=height_field, mf=height_field_frame: move_vertices(
+                    v, lambda x: h.find_farthest_intersections(x, mf, chunk_size=args.chunk_size)
+                ),
+            )
+            # the level 0 sphere subdivided (a different template of a similar size), base mold only
+            coarse = synthetic_template(0)
+            hierarchy = TemplateHierarchy.build(coarse.vertices, coarse.loop_vertices, coarse.loop_total, level + 1)
+            yield Case(
+                "move_mesh_vertices_with_mask",
+                "numpy-multires",
+                {"template_vertices": len(hierarchy.vertices[-1]), "mold_faces": mold.num_polygons},
+                run=lambda _, h=hierarchy, m=mold, mf=mask_frame, b=bvh: deform_coarse_to_fine(
+                    h,
+                    np.eye(4),
+                    find_base=lambda x: find_farthest_intersections_bvh(x, m, mf, bvh=b, chunk_size=args.chunk_size),
+                    find_sub=lambda x: FarthestHits.empty(len(x)),
+                    find_base_near=lambda x, lo, hi: find_farthest_intersections_near(
+                        x, m, mf, lo, hi, bvh=b, chunk_size=args.chunk_size
+                    ),
+                ),
+            )
+
+
+def bpy_cases(args: argparse.Namespace, work_dir: Path) -> t.Iterator[Case]:
+    if not HAS_BPY:
+        reason: str = "bpy is not available (run the benchmark inside Blender)"
+        for size in args.grid_resolutions:
+            for kernel in ("depth_map2plane", "subdivide_obj", "get_bounding_box_yz"):
+                yield Case(kernel, "bpy", {"grid_resolution": size}, run=lambda _: None, skip=reason)
+        for num_points in args.num_points:
+            yield Case(
+                "whether_intersection_is_inside_polygon",
+                "bpy",
+                {"num_points": num_points},
+                run=lambda _: None,
+                skip=reason,
+            )
+        yield Case("move_mesh_vertices_with_mask", "bpy", {}, run=lambda _: None, skip=reason)
+        return
+
+    # Third Party Library
+    import bpy
+    import mathutils
+
+    # First Party Library
+    from lib3d import utils
+    from lib3d.load_obj import create_molds
+    from lib3d.load_obj import depth_map2plane
+    from lib3d.load_obj import depth_map2plane_array
+
+    # get_bounding_box_yz and move_mesh_vertices_with_mask live in the processing script
+    spec = importlib.util.spec_from_file_location(
+        "processing_template_main", Path(__file__).parents[1] / "processing-template" / "main.py"
+    )
+    assert spec is not None and spec.loader is not None
+    processing_main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(processing_main)
+
+    def new_plane(_: t.Any = None) -> bpy.types.Object:
+        bpy.ops.mesh.primitive_plane_add(size=2.0)
+        return bpy.context.active_object
+
+    depth = synthetic_depth(max(args.depth_sizes))
+    for resolution in args.grid_resolutions:
+        size = {"grid_resolution": resolution}
+        yield Case(
+            "depth_map2plane",
+            "bpy",
+            size,
+            run=lambda _, d=depth, r=resolution: depth_map2plane(depth_arr=255 - d, grid_resolution=r),
+        )
+        yield Case(
+            "subdivide_obj",
+            "bpy",
+            size,
+            setup=new_plane,
+            run=lambda obj, r=resolution: utils.subdivide_obj(obj, num_cuts=r),
+        )
+        plane_obj = depth_map2plane_array(depth_arr=255 - depth, grid_resolution=resolution)
+        yield Case(
+            "get_bounding_box_yz", "bpy", size, run=lambda _, o=plane_obj: processing_main.get_bounding_box_yz(o)
+        )
+
+    for num_points in args.num_points:
+        polygons, points, normals = polygon_points(num_points)
+        vertex_lists = [[mathutils.Vector(v) for v in polygon] for polygon in polygons]
+        intersections = [mathutils.Vector(p) for p in points]
+        normal = mathutils.Vector((0.0, 0.0, 1.0))
+        yield Case(
+            "whether_intersection_is_inside_polygon",
+            "bpy",
+            {"num_points": num_points},
+            run=lambda _, vl=vertex_lists, ps=intersections: [
+                utils.whether_intersection_is_inside_polygon(vertices=v, intersection=p, normal=normal)
+                for v, p in zip(vl, ps)
+            ],
+        )
+
+    depth_image_path: Path = work_dir / "depth.png"
+    PIL.Image.fromarray(synthetic_depth(args.mold_depth_size)).save(depth_image_path)
+    mask_array = create_mask(synthetic_depth(args.mold_depth_size), background=255)[:, ::-1]
+    for resolution in args.grid_resolutions:
+        mold_obj_base, _ = create_molds(
+            depth_image_path, MoldConfig(builder="array", grid_resolution=resolution, decimate_ratio=1.0)
+        )
+        bounding_box = processing_main.get_bounding_box_yz(mold_obj_base)
+        for level in args.template_levels:
+            template = synthetic_template(level)
+            size = {"template_vertices": len(template.vertices), "mold_faces": len(mold_obj_base.data.polygons)}
+            skip: t.Optional[str] = None
+            if size["template_vertices"] * size["mold_faces"] > args.max_python_pairs:
+                skip = f"more than --max_python_pairs={args.max_python_pairs} (vertex, polygon) pairs"
+            yield Case(
+                "move_mesh_vertices_with_mask",
+                "bpy",
+                size,
+                setup=lambda m=template: utils.new_mesh_object("Template", m),
+                run=lambda template_obj, mold=mold_obj_base: processing_main.move_mesh_vertices_with_mask(
+                    template_obj=template_obj,
+                    mold_obj=mold,
+                    mask_array=mask_array,
+                    y_min=bounding_box[0],
+                    z_min=bounding_box[1],
+                    y_max=bounding_box[2],
+                    z_max=bounding_box[3],
+                    engine="python",
+                ),
+                skip=skip,
+            )
+
+
+###########
+# measure #
+###########
+
+
+def object_names() -> t.Set[str]:
+    if not HAS_BPY:
+        return set()
+    # Third Party Library
+    import bpy
+
+    return {obj.name for obj in bpy.data.objects}
+
+
+def remove_new_objects(before: t.Set[str]) -> None:
+    """remove the objects (and their meshes) created since ``object_names()`` returned ``before``"""
+    if not HAS_BPY:
+        return
+    # Third Party Library
+    import bpy
+
+    for obj in [obj for obj in bpy.data.objects if obj.name not in before]:
+        mesh = obj.data
+        bpy.data.objects.remove(obj, do_unlink=True)
+        if mesh is not None and mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
+
+def measure(case: Case, repeat: int) -> CaseResult:
+    result = CaseResult(kernel=case.kernel, impl=case.impl, size=case.size, skipped=case.skip)
+    if case.skip is not None:
+        return result
+
+    def prepare() -> t.Any:
+        return case.setup() if case.setup is not None else None
+
+    case.run(prepare())  # warm-up
+    for _ in range(repeat):
+        arg = prepare()
+        start: float = time.perf_counter()
+        case.run(arg)
+        result.seconds.append(time.perf_counter() - start)
+
+    arg = prepare()
+    tracemalloc.start()
+    try:
+        case.run(arg)
+        _, result.peak_memory_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result.median = statistics.median(result.seconds)
+    result.min = min(result.seconds)
+    return result
+
+
+def result_key(result: t.Dict[str, t.Any]) -> str:
+    return f"{result['kernel']}[{result['impl']}]" + "".join(f" {k}={v}" for k, v in sorted(result["size"].items()))
+
+
+def git_commit() -> t.Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: t.List[t.Dict[str, t.Any]], baseline: t.List[t.Dict[str, t.Any]]) -> str:
+    """median time ratio (current / baseline) of the cases measured in both runs"""
+    baseline_medians = {result_key(r): r["median"] for r in baseline if r["median"] is not None}
+    lines: t.List[str] = []
+    for r in results:
+        key = result_key(r)
+        if r["median"] is None or not baseline_medians.get(key):
+            continue
+        ratio: float = r["median"] / baseline_medians[key]
+        mark: str = "  <- slower" if ratio > 1.1 else ""
+        lines.append(f"{key:<90} {baseline_medians[key]:>10.5f}s -> {r['median']:>10.5f}s  x{ratio:.2f}{mark}")
+    return "\n".join(lines)
+
+
+def get_args(argv: t.List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", type=lambda x: Path(x).expanduser(), default=None, help="JSON results")
+    parser.add_argument("--baseline", type=lambda x: Path(x).expanduser(), default=None, help="JSON of another run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", type=str, default=None, help="only the kernels containing this string")
+    parser.add_argument("--depth_sizes", type=int, nargs="+", default=DEPTH_SIZES)
+    parser.add_argument("--template_levels", type=int, nargs="+", default=TEMPLATE_LEVELS)
+    parser.add_argument("--grid_resolutions", type=int, nargs="+", default=GRID_RESOLUTIONS)
+    parser.add_argument("--num_points", type=int, nargs="+", default=NUM_POINTS)
+    parser.add_argument("--mold_depth_size", type=int, default=137, help="depth image size of the mold benchmarks")
+    parser.add_argument("--chunk_size", type=int, default=262144)
+    parser.add_argument(
+        "--max_python_pairs",
+        type=int,
+        default=2_000_000,
+        help="skip the per-vertex Python loop above this many (vertex, polygon) pairs",
+    )
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    # the arguments after "--" inside Blender
+    argv: t.List[str] = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else sys.argv[1:]
+    args = get_args(argv)
+
+    results: t.List[CaseResult] = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for cases in (numpy_cases(args), bpy_cases(args, Path(work_dir))):
+            for case in cases:
+                if args.filter is not None and args.filter not in case.kernel:
+                    continue
+                before: t.Set[str] = object_names()
+                result = measure(case, repeat=args.repeat)
+                remove_new_objects(before)  # keep the objects of the scene the generator still uses
+                results.append(result)
+                if result.skipped is not None:
+                    print(f"{result_key(asdict(result)):<90} skipped: {result.skipped}", flush=True)
+                else:
+                    print(
+                        f"{result_key(asdict(result)):<90} {result.median:>10.5f}s"
+                        f" {(result.peak_memory_bytes or 0) / 2**20:>9.1f}MiB",
+                        flush=True,
+                    )
+
+    report: t.Dict[str, t.Any] = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.time(),
+            "python": sys.version,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "bpy": HAS_BPY,
+            "repeat": args.repeat,
+        },
+        "results": [asdict(result) for result in results],
+    }
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, mode="wt") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline, mode="rt") as f:
+            print(compare(report["results"], json.load(f)["results"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,28 +12,49 @@ import cv2
 import mathutils
 import nptyping as npt
 import numpy as np
-import PIL
-import PIL.Image
 from omegaconf import OmegaConf
 
 # First Party Library
+from lib3d import profiling
 from lib3d import utils
+from lib3d import worker_pool
+from lib3d.depth import DEPTH_PACK_NAME
+from lib3d.depth import DepthView
+from lib3d.depth import model_depth_views
+from lib3d.depth import read_depth_image
+from lib3d.heightfield import HeightField
+from lib3d.intersection import FarthestHits
+from lib3d.intersection import MaskFrame
+from lib3d.intersection import find_farthest_intersections
+from lib3d.intersection import find_farthest_intersections_bvh
+from lib3d.load_obj import create_molds
 from lib3d.load_obj import load_obj
+from lib3d.mask import create_mask
+from lib3d.mold import sub_plane_mesh
+from lib3d.types import BatchConfig
 from lib3d.types import BlenderMainReturn
 from lib3d.types import ConfigModel
+from lib3d.vertex_store import VertexStoreWriter
+from lib3d.vertex_store import key_from_depth_image_path
+from lib3d.wavefront import ObjWriter
 
 logger = getLogger(__name__)
 logger.addHandler(NullHandler())
 
 
-def get_args() -> ConfigModel:
+def get_args(custom_args: t.Optional[t.List[str]] = None) -> ConfigModel:
+    """
+    Args:
+        custom_args (t.List[str], optional): the arguments after "--". Read from ``sys.argv`` if not given.
+    """
 
-    args: t.List[str] = sys.argv[1:]
-    custom_args: t.List[str] = []
-    for i, arg in enumerate(args):
-        if arg == "--":
-            custom_args = args[i + 1 :]
-            break
+    if custom_args is None:
+        args: t.List[str] = sys.argv[1:]
+        custom_args = []
+        for i, arg in enumerate(args):
+            if arg == "--":
+                custom_args = args[i + 1 :]
+                break
 
     conf = OmegaConf.from_dotlist(custom_args)
 
@@ -75,32 +96,6 @@ def move_mesh_vertices(
         mesh_vertex.co = obj.matrix_world.inverted() @ global_target_location
 
 
-def create_mask(
-    im: npt.NDArray[npt.Shape["*, ..."], npt.Int],
-    background: int,
-) -> npt.NDArray[npt.Shape["*, ..."], npt.Int]:
-    """0,1のマスクを作成する
-
-    Args:
-        im (np.ndarray): _description_
-        background (int): _description_
-
-    Returns:
-        np.ndarray: _description_
-    """
-
-    new_im = im.copy()
-
-    new_im[im == background] = 0
-    new_im[im != background] = 1
-
-    size: int = 5
-    kernel = np.ones((size, size), np.uint8)
-    new_im = cv2.dilate(new_im, kernel, iterations=1)
-
-    return new_im
-
-
 def get_bounding_box_yz(obj3d: bpy.types.Object) -> t.Tuple[float, float, float, float]:
     y_max = -float("inf")
     y_min = +float("inf")
@@ -125,8 +120,33 @@ def move_mesh_vertices_with_mask(
     y_max: float,
     z_max: float,
     debug: bool = False,
+    engine: str = "python",
+    chunk_size: int = 262144,
+    ray_directions: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None,
+    inside_test: str = "angle_sum",
 ) -> None:
+    """
+    Args:
+        ray_directions (np.ndarray, optional): precomputed (``lib3d.template_cache``) unit directions of the rays
+            through the template vertices. Not used by the "python" engine.
+        inside_test (str): point-in-polygon test of the batched engines. The "python" engine uses "angle_sum".
+    """
+    if engine in ("numpy", "bvh"):
+        move_mesh_vertices_with_mask_numpy(
+            template_obj=template_obj,
+            mold_obj=mold_obj,
+            mask_frame=MaskFrame(mask_array=mask_array, y_min=y_min, z_min=z_min, y_max=y_max, z_max=z_max),
+            chunk_size=chunk_size,
+            use_bvh=(engine == "bvh"),
+            ray_directions=ray_directions,
+            inside_test=inside_test,
+        )
+        return
+    elif engine != "python":
+        raise ValueError(f"{engine=} not supported!")
+
     im_height, im_width = mask_array.shape[:2]
+    num_hits: int = 0
 
     for t_v_idx, t_v in enumerate(template_obj.data.vertices):
         t_v_global: mathutils.Vector = template_obj.matrix_world @ t_v.co
@@ -192,6 +212,87 @@ def move_mesh_vertices_with_mask(
         # 条件に適合する交点がなかったらスキップ
         if best_intersection.length > 0.0:
             t_v.co = template_obj.matrix_world.inverted() @ best_intersection
+            num_hits += 1
+
+    profiling.count("rays", len(template_obj.data.vertices))
+    profiling.count("polygons_tested", len(template_obj.data.vertices) * len(mold_obj.data.polygons))
+    profiling.count("hits", num_hits)
+
+
+def move_template_vertices(
+    template_obj: bpy.types.Object,
+    find_hits: t.Callable[[npt.NDArray[npt.Shape["*, 3"], npt.Float]], FarthestHits],
+    ray_directions: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None,
+) -> None:
+    """move template vertices to the hits found for their world coordinates
+
+    The hits only depend on the directions of the rays from the origin, so the precomputed ``ray_directions``
+    are used instead of the world coordinates if given.
+    """
+    template_matrix = utils.get_matrix_world_array(template_obj)
+    local_vertices = utils.get_vertices_array(template_obj)
+    if ray_directions is None:
+        hits = find_hits(local_vertices @ template_matrix[:3, :3].T + template_matrix[:3, 3])
+    else:
+        hits = find_hits(ray_directions)
+
+    # 条件に適合する交点がなかったらスキップ
+    found = hits.found
+    inverted = np.linalg.inv(template_matrix)
+    local_vertices[found] = hits.points[found] @ inverted[:3, :3].T + inverted[:3, 3]
+    utils.set_vertices_array(template_obj, local_vertices)
+
+
+def move_mesh_vertices_with_mask_numpy(
+    template_obj: bpy.types.Object,
+    mold_obj: bpy.types.Object,
+    mask_frame: MaskFrame,
+    chunk_size: int = 262144,
+    use_bvh: bool = False,
+    ray_directions: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None,
+    inside_test: str = "angle_sum",
+) -> None:
+    """same as ``move_mesh_vertices_with_mask`` but with the batched intersection engine
+
+    If ``use_bvh`` is True, each ray is tested only against the mold polygons found with a BVH.
+    """
+    mesh = utils.get_mesh_arrays(mold_obj)
+    find = find_farthest_intersections_bvh if use_bvh else find_farthest_intersections
+    move_template_vertices(
+        template_obj,
+        lambda targets: find(
+            targets=targets, mesh=mesh, mask_frame=mask_frame, chunk_size=chunk_size, inside_test=inside_test
+        ),
+        ray_directions=ray_directions,
+    )
+
+
+def move_mesh_vertices_with_heightfield(
+    template_obj: bpy.types.Object,
+    height_field: HeightField,
+    mask_array: npt.NDArray[npt.Shape["*, *"], npt.Int],
+    chunk_size: int = 262144,
+    ray_directions: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None,
+    inside_test: str = "angle_sum",
+) -> None:
+    """``move_mesh_vertices_with_mask`` with mold_obj_base and then mold_obj_sub, without the mold objects
+
+    The base mold is the depth image itself (``height_field``) and the sub mold is the flat plane behind it.
+    """
+    mask_frame = MaskFrame(mask_array, *height_field.bounding_box_yz())
+    move_template_vertices(
+        template_obj,
+        lambda targets: height_field.find_farthest_intersections(targets, mask_frame, chunk_size=chunk_size),
+        ray_directions=ray_directions,
+    )
+    sub_mesh = sub_plane_mesh()
+    move_template_vertices(
+        template_obj,
+        lambda targets: find_farthest_intersections(
+            targets, sub_mesh, mask_frame, chunk_size=chunk_size, inside_test=inside_test
+        ),
+        ray_directions=ray_directions,
+    )
 
 
 def main() -> None:
@@ -205,12 +306,173 @@ def main() -> None:
 
     logger.info(f"\n{pprint.pformat(sys.path)}")
 
-    config: ConfigModel = get_args()
+    profiling.start_job()
+    with profiling.stage("parse_config"):
+        config: ConfigModel = get_args()
     logger.info(f"{OmegaConf.to_yaml(config)=}")
 
-    blender_main_val: BlenderMainReturn = load_obj(config)
-    logger.info(f"{blender_main_val=}")
+    process(config)
+
+
+def process(config: ConfigModel) -> None:
+    """deform the template with the depth image and export it (one job)"""
+    if config.deformation.multires_levels > 0:
+        # the template object would have to be subdivided in Blender; lib3d.processing supports it
+        raise ValueError(f"{config.deformation.multires_levels=} not supported in Blender!")
+    if any(path is not None for path in (config.batch.list_filepath, config.batch.root_dir, config.batch.model_dir)):
+        process_batch(config)
+        return
+
+    with profiling.job(config.profile.output_path, name=str(config.input.depth_image_path)):
+        with profiling.stage("load_obj"):
+            blender_main_val: BlenderMainReturn = load_obj(config)
+        logger.info(f"{blender_main_val=}")
+        deform_template_obj(blender_main_val, depth_image_path=Path(config.input.depth_image_path), config=config)
+
+        if config.debug_mode:  # For debugging the workflow
+            logger.info("create files")
+            bpy.ops.wm.save_mainfile(filepath=f"{Path(config.debug.blend_filepath).expanduser()}")
+            bpy.ops.file.pack_all()
+
+        template_obj: bpy.types.Object = blender_main_val.template_obj
+        if config.vertex_store.store_dir is not None:
+            with profiling.stage("append_vertex_store"):
+                with utils.new_vertex_store_writer(template_obj, config.vertex_store) as store_writer:
+                    store_writer.append(
+                        key_from_depth_image_path(config.input.depth_image_path),
+                        utils.get_obj_file_vertices(template_obj),
+                    )
+            return
+
+        # save as obj file (only the template; "*.obj.gz" is gzip compressed)
+        with profiling.stage("export_obj"):
+            utils.new_obj_writer(template_obj).write(
+                config.output_filepath_obj, utils.get_obj_file_vertices(template_obj)
+            )
+
 
+def batch_items(batch_config: BatchConfig) -> t.Iterator[t.Tuple[Path, Path, t.Optional[t.List[float]]]]:
+    """(depth image path, output obj path, viewport or None) of the batch mode"""
+    if batch_config.list_filepath is not None:
+        list_filepath: Path = Path(batch_config.list_filepath).expanduser()
+        with open(list_filepath, mode="rt") as f:
+            line: str
+            for i, line in enumerate(f):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                # "<depth>\t<obj>" keeps spaces in both paths; otherwise the output path is the last field
+                fields: t.List[str] = line.split("\t") if "\t" in line else line.rsplit(maxsplit=1)
+                if len(fields) != 2 or not all(part.strip() for part in fields):
+                    raise ValueError(f"{list_filepath}:{i + 1}: {line=} not supported! (<depth> <output obj> expected)")
+                depth_image_path, output_filepath_obj = (part.strip() for part in fields)
+                yield Path(depth_image_path).expanduser(), Path(output_filepath_obj).expanduser(), None
+        return
+
+    if batch_config.model_dir is not None:
+        if batch_config.output_dir is None:
+            raise ValueError(f"{batch_config.output_dir=} is required!")
+        output_dir = Path(batch_config.output_dir).expanduser()
+        depth_view: DepthView
+        for depth_view in model_depth_views(
+            Path(batch_config.model_dir).expanduser(),
+            depth_format=batch_config.depth_format,
+            metadata_filepath=batch_config.metadata_filepath,
+        ):
+            if batch_config.views and depth_view.view not in batch_config.views:
+                continue
+            yield depth_view.depth_image_path, output_dir / f"{depth_view.view}_depth0001.obj", depth_view.viewport
+        return
+
+    if batch_config.root_dir is None or batch_config.output_dir is None:
+        raise ValueError(f"{batch_config.root_dir=} and {batch_config.output_dir=} are required!")
+    root_dir: Path = Path(batch_config.root_dir).expanduser()
+    output_dir = Path(batch_config.output_dir).expanduser()
+    for filepath in sorted(root_dir.glob(batch_config.glob)):
+        if filepath.name.startswith("."):
+            continue
+        if filepath.name == DEPTH_PACK_NAME:  # every view of the pack
+            for depth_view in model_depth_views(filepath.parent, depth_format="pack"):
+                yield (
+                    depth_view.depth_image_path,
+                    output_dir / filepath.parent.relative_to(root_dir) / f"{depth_view.view}_depth0001.obj",
+                    depth_view.viewport,
+                )
+            continue
+        yield filepath, output_dir / filepath.parent.relative_to(root_dir) / f"{filepath.stem}.obj", None
+
+
+def remove_object(obj: bpy.types.Object) -> None:
+    """remove the object and its mesh data"""
+    mesh = obj.data
+    bpy.data.objects.remove(obj, do_unlink=True)
+    if mesh is not None and mesh.users == 0:
+        bpy.data.meshes.remove(mesh)
+
+
+def process_batch(config: ConfigModel) -> None:
+    """deform the template with every depth image of ``config.batch``
+
+    The scene and the template (and its cache) are loaded once. The molds are created and removed per image and
+    the template vertices are restored before each image. ``batch.model_dir`` makes every view of a model one job.
+    Every image is a profiling job of its own (the scene setup is the job "batch_setup"). A failed image does not
+    stop the batch, but the batch raises ``RuntimeError`` at the end (non-zero exit code).
+    """
+    with profiling.job(config.profile.output_path, name="batch_setup"):
+        with profiling.stage("load_obj"):
+            blender_main_val: BlenderMainReturn = load_obj(config, create_mold=False)
+    template_obj: bpy.types.Object = blender_main_val.template_obj
+    template_vertices = utils.get_vertices_array(template_obj)
+    # the topology never changes
+    obj_writer: ObjWriter = utils.new_obj_writer(template_obj)
+    store_writer: t.Optional[VertexStoreWriter] = None
+    if config.vertex_store.store_dir is not None:
+        store_writer = utils.new_vertex_store_writer(template_obj, config.vertex_store)
+
+    failed: t.List[str] = []
+    for i, (depth_image_path, output_filepath_obj, viewport) in enumerate(batch_items(config.batch)):
+        logger.info(f"{i:>5}: {depth_image_path} -> {output_filepath_obj}")
+        utils.set_vertices_array(template_obj, template_vertices)
+        molds = BlenderMainReturn(
+            template_obj=template_obj,
+            mold_obj_base=None,
+            mold_obj_sub=None,
+            template_cache=blender_main_val.template_cache,
+        )
+        try:
+            meta: t.Dict[str, t.Any] = {} if viewport is None else {"viewport": viewport}
+            with profiling.job(config.profile.output_path, name=str(depth_image_path), **meta):
+                if config.deformation.engine != "heightfield":
+                    with profiling.stage("create_molds"):
+                        molds.mold_obj_base, molds.mold_obj_sub = create_molds(
+                            depth_image_path, mold_config=config.mold
+                        )
+                deform_template_obj(molds, depth_image_path=depth_image_path, config=config)
+
+                if store_writer is not None:
+                    with profiling.stage("append_vertex_store"):
+                        store_writer.append(
+                            key_from_depth_image_path(depth_image_path), utils.get_obj_file_vertices(template_obj)
+                        )
+                else:
+                    with profiling.stage("export_obj"):
+                        obj_writer.write(output_filepath_obj, utils.get_obj_file_vertices(template_obj))
+        except Exception:
+            logger.exception(f"Failed to process {depth_image_path}")
+            failed.append(str(depth_image_path))
+        finally:
+            for mold_obj in (molds.mold_obj_base, molds.mold_obj_sub):
+                if mold_obj is not None:
+                    remove_object(mold_obj)
+
+    if store_writer is not None:
+        store_writer.close()
+    if failed:  # the job fails (the other views are done; main_parallel.py checks them one by one)
+        raise RuntimeError(f"Failed to process {len(failed)} depth image(s): {failed}")
+
+
+def deform_template_obj(blender_main_val: BlenderMainReturn, depth_image_path: Path, config: ConfigModel) -> None:
+    """move the template vertices onto the molds of the depth image"""
     # init template_obj's vertices
 
     # # get max length
@@ -227,10 +489,12 @@ def main() -> None:
     # 1: foreground
     # 0: background
     # TODO: クラス化して内部か外部かを判定するコードにしてしまったほうが良い. (画像と座標の向きが一致している必要があるため.)
-    mask_image: npt.NDArray[npt.Shape["*, *"], npt.Int] = create_mask(
-        np.array(PIL.Image.open(Path(config.input.depth_image_path))),
-        background=255,
-    )
+    with profiling.stage("read_depth_image"):
+        depth_image = read_depth_image(depth_image_path)
+    with profiling.stage("create_mask"):
+        mask_image: npt.NDArray[npt.Shape["*, *"], npt.Int] = create_mask(
+            depth_image, background=255, size=config.deformation.mask_size
+        )
 
     if config.debug_mode:
         filepath: Path = Path(config.debug.mask_image_path)
@@ -238,45 +502,76 @@ def main() -> None:
         cv2.imwrite(str(filepath), mask_image * 255)
 
     mask_image = mask_image[:, ::-1]  # horizontal flip
-    (y_min, z_min, y_max, z_max) = get_bounding_box_yz(blender_main_val.mold_obj_base)
-
-    # calculate template and mold intersection and move vertices with a mask filter
-    move_mesh_vertices_with_mask(
-        template_obj=blender_main_val.template_obj,
-        mold_obj=blender_main_val.mold_obj_base,
-        mask_array=mask_image,
-        y_min=y_min,
-        z_min=z_min,
-        y_max=y_max,
-        z_max=z_max,
-    )
-    move_mesh_vertices_with_mask(
-        template_obj=blender_main_val.template_obj,
-        mold_obj=blender_main_val.mold_obj_sub,
-        mask_array=mask_image,
-        y_min=y_min,
-        z_min=z_min,
-        y_max=y_max,
-        z_max=z_max,
-    )
+    ray_directions: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None
+    if blender_main_val.template_cache is not None:
+        ray_directions = blender_main_val.template_cache.ray_directions
+    if config.deformation.engine == "heightfield":
+        with profiling.stage("move_mesh_vertices_with_heightfield"):
+            move_mesh_vertices_with_heightfield(
+                template_obj=blender_main_val.template_obj,
+                height_field=HeightField.from_depth_arr(
+                    depth_arr=255 - depth_image,
+                    grid_resolution=config.deformation.heightfield_resolution,
+                ),
+                mask_array=mask_image,
+                chunk_size=config.deformation.chunk_size,
+                ray_directions=ray_directions,
+                inside_test=config.deformation.inside_test,
+            )
+    else:
+        (y_min, z_min, y_max, z_max) = get_bounding_box_yz(blender_main_val.mold_obj_base)
+
+        # calculate template and mold intersection and move vertices with a mask filter
+        with profiling.stage("move_mesh_vertices_with_mask[base]"):
+            move_mesh_vertices_with_mask(
+                template_obj=blender_main_val.template_obj,
+                mold_obj=blender_main_val.mold_obj_base,
+                mask_array=mask_image,
+                y_min=y_min,
+                z_min=z_min,
+                y_max=y_max,
+                z_max=z_max,
+                engine=config.deformation.engine,
+                chunk_size=config.deformation.chunk_size,
+                ray_directions=ray_directions,
+                inside_test=config.deformation.inside_test,
+            )
+        with profiling.stage("move_mesh_vertices_with_mask[sub]"):
+            move_mesh_vertices_with_mask(
+                template_obj=blender_main_val.template_obj,
+                mold_obj=blender_main_val.mold_obj_sub,
+                mask_array=mask_image,
+                y_min=y_min,
+                z_min=z_min,
+                y_max=y_max,
+                z_max=z_max,
+                engine=config.deformation.engine,
+                chunk_size=config.deformation.chunk_size,
+                ray_directions=ray_directions,
+                inside_test=config.deformation.inside_test,
+            )
 
     # move_vertices_main(template_obj=blender_main_val.template_obj, mold_objs=blender_main_val.mold_objs, config=config)
 
-    if config.debug_mode:  # For debugging the workflow
-        logger.info("create files")
-        bpy.ops.wm.save_mainfile(filepath=f"{Path(config.debug.blend_filepath).expanduser()}")
-        bpy.ops.file.pack_all()
 
-    # remove others
-    bpy.ops.object.select_all(action="SELECT")
-    blender_main_val.template_obj.select_set(False)
-    bpy.ops.object.delete()
+def serve() -> None:
+    """worker mode of ``lib3d.worker_pool.BlenderWorkerPool``"""
+    logging.basicConfig(
+        format="[%(asctime)s][%(levelname)s][%(filename)s:%(lineno)d] - %(message)s",
+        level=logging.WARNING,
+    )
 
-    # save as obj file
+    def handle_job(custom_args: t.List[str]) -> None:
+        profiling.start_job()
+        with profiling.stage("parse_config"):
+            config: ConfigModel = get_args(custom_args)
+        process(config)
 
-    bpy.context.view_layer.objects.active = blender_main_val.template_obj
-    bpy.ops.export_scene.obj(filepath=config.output_filepath_obj)
+    worker_pool.serve(handle_job, reset=utils.reset_scene)
 
 
 if __name__ == "__main__":
-    main()
+    if worker_pool.is_worker():
+        serve()
+    else:
+        main()
@@ -4,16 +4,39 @@ $ python3 ./scripts/run.py --data_dir "data"
 
 # Standard Library
 import argparse
-import concurrent.futures
+import functools
 import os
 import re
-import subprocess
+import time
 import typing as t
 from dataclasses import dataclass
+from dataclasses import field
 from logging import NullHandler
 from logging import getLogger
 from pathlib import Path
 
+# Third Party Library
+from omegaconf import OmegaConf
+
+# First Party Library
+import lib3d
+from lib3d import profiling
+from lib3d.depth import DEPTH_PACK_NAME
+from lib3d.depth import depth_image_file
+from lib3d.depth import split_depth_pack_path
+from lib3d.manifest import JobManifest
+from lib3d.manifest import hash_code
+from lib3d.manifest import hash_file
+from lib3d.manifest import hash_strings
+from lib3d.scheduler import ScheduledJob
+from lib3d.scheduler import ScheduledResult
+from lib3d.scheduler import Scheduler
+from lib3d.vertex_store import Key
+from lib3d.vertex_store import key_from_depth_image_path
+from lib3d.vertex_store import written_keys
+from lib3d.worker_pool import BlenderWorkerPool
+from lib3d.worker_pool import Job
+
 logger = getLogger(__name__)
 logger.addHandler(NullHandler())
 
@@ -27,15 +50,64 @@ def get_args() -> argparse.Namespace:
         type=lambda x: Path(x).expanduser().absolute(),
         help="'train_tf.txt' or 'test_tf.txt'",
     )
+    parser.add_argument(
+        "--depth_format",
+        choices=["png", "npy", "pack"],
+        default="png",
+        help='the depth images to read ("npy", "pack": raw float depth of the renderer, depth_output.formats)',
+    )
     parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--worker_pool",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="run the jobs on long-lived Blender workers instead of one Blender process per job",
+    )
+    parser.add_argument("--max_jobs_per_worker", type=int, default=100, help="recycle a worker after N jobs")
+    parser.add_argument(
+        "--max_worker_memory_mb", type=float, default=None, help="recycle a worker when its RSS exceeds this"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None, help="kill a job (a worker with --worker_pool) after N seconds"
+    )
+    parser.add_argument("--retries", type=int, default=2, help="retries of a failed job (without --worker_pool)")
+    parser.add_argument(
+        "--log_dir",
+        type=lambda x: Path(x).expanduser().absolute(),
+        default=None,
+        help="per-job log files without --worker_pool (default: <out_dir>/logs)",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=lambda x: Path(x).expanduser().absolute(),
+        default=None,
+        help="JSONL job journal. Completed jobs are skipped on a rerun unless their input or config has changed",
+    )
+    parser.add_argument(
+        "--profile",
+        type=lambda x: Path(x).expanduser().absolute(),
+        default=None,
+        help="JSONL file of per-stage timings of every job (summarized at the end)",
+    )
+    parser.add_argument(
+        "--vertex_store",
+        type=lambda x: Path(x).expanduser().absolute(),
+        default=None,
+        help="append the deformed vertices to this sharded store (lib3d.vertex_store) instead of OBJ files",
+    )
+    parser.add_argument(
+        "--per_model",
+        action="store_true",
+        help="one job per model: every view of the model is deformed in one process (batch.model_dir)",
+    )
     args = parser.parse_args()
     return args
 
 
-def search_file_iter(dir: Path) -> t.Iterator[Path]:
+def search_file_iter(dir: Path, suffix: str = ".png") -> t.Iterator[Path]:
     pattern = re.compile(
         # ignore files started from period (.)
-        pattern=r"^(?!.*^\.).*depth0001.png",
+        pattern=rf"^(?!.*^\.).*depth0001{re.escape(suffix)}",
     )
     for _dirpath, _dirnames, _filenames in os.walk(dir):
         for _filename in _filenames:
@@ -43,7 +115,8 @@ def search_file_iter(dir: Path) -> t.Iterator[Path]:
                 yield Path(_dirpath) / _filename
 
 
-def data_file_iter(dir: Path, data_filepath: Path) -> t.Iterator[Path]:
+def data_file_iter(dir: Path, data_filepath: Path, suffix: str = ".png") -> t.Iterator[Path]:
+    """depth image paths of the data file (``suffix=".pack"``: "<dir>/depth_pack.npy#<view>", see lib3d.depth)"""
     with open(data_filepath, mode="rt") as f:
         line: str
         for line in f:
@@ -51,7 +124,10 @@ def data_file_iter(dir: Path, data_filepath: Path) -> t.Iterator[Path]:
             if not line:
                 continue
             fpath = Path(line[17:])
-            yield dir / fpath.parent / f"{fpath.stem}_depth0001.png"
+            if suffix == ".pack":
+                yield dir / fpath.parent / f"{DEPTH_PACK_NAME}#{fpath.stem}"
+            else:
+                yield dir / fpath.parent / f"{fpath.stem}_depth0001{suffix}"
 
 
 @dataclass
@@ -59,12 +135,115 @@ class Cmd:
     cmd: t.List[str]
     category_id: str
     object_id: str
-    stdout: t.Optional[t.TextIO] = None
-    stderr: t.Optional[t.TextIO] = None
+    # for the job manifest
+    key: str = ""
+    outputs: t.List[Path] = field(default_factory=list)
+    input_hash: str = ""
+    config_hash: str = ""
+    # --vertex_store: the row of the view instead of an output file
+    store_dir: t.Optional[Path] = None
+    store_key: t.Optional[Key] = None
+    # the per-view commands merged into this one (--per_model); recorded one by one
+    members: t.List["Cmd"] = field(default_factory=list)
+
+
+def record_result(
+    manifest: t.Optional[JobManifest],
+    cmd: Cmd,
+    ok: bool,
+    duration: float,
+    error: t.Optional[str] = None,
+) -> None:
+    """record every view of the command as done only if the job has written its output
+
+    A job with several views (--per_model) fails if one of them fails, so each view is checked on its own: its OBJ
+    file must have been written by this job (an older file is left over from an earlier run) or the vertex store
+    must have a row of it appended by this job.
+    """
+    if manifest is None:
+        return
+    started: float = time.time() - duration  # the results are recorded as they arrive
+    views: t.List[Cmd] = cmd.members if cmd.members else [cmd]
+    stored: t.Set[Key] = set()
+    store_dirs: t.Set[Path] = {view.store_dir for view in views if view.store_dir is not None}
+    for store_dir in store_dirs:
+        stored |= written_keys(store_dir, since=started)
+    for view in views:
+        view_ok: bool = ok or bool(cmd.members)
+        view_error: t.Optional[str] = error
+        if view_ok:
+            missing: t.List[str] = [
+                str(output) for output in view.outputs if not output.exists() or output.stat().st_mtime < started
+            ]
+            if view.store_key is not None and view.store_key not in stored:
+                missing.append(f"{view.store_dir}/{'/'.join(view.store_key)}")
+            if missing:
+                view_ok, view_error = False, f"missing outputs: {missing}" + ("" if error is None else f" ({error})")
+        manifest.record(
+            key=view.key,
+            input_hash=view.input_hash,
+            config_hash=view.config_hash,
+            outputs=view.outputs,
+            ok=view_ok,
+            duration=duration / len(views),
+            error=None if view_ok else view_error,
+        )
+
+
+def run_cmds_with_scheduler(
+    cmds: t.List[Cmd],
+    num_workers: int,
+    timeout: t.Optional[float] = None,
+    retries: int = 0,
+    log_dir: t.Optional[Path] = None,
+    manifest: t.Optional[JobManifest] = None,
+) -> None:
+    """run one Blender process per command with ``lib3d.scheduler.Scheduler``"""
+    job_to_cmd: t.Dict[int, Cmd] = {}
+    jobs: t.List[ScheduledJob] = []
+    for cmd in cmds:
+        job = ScheduledJob(name=f"{cmd.category_id}/{cmd.object_id}/{Path(cmd.key).stem}", cmd=cmd.cmd)
+        job_to_cmd[id(job)] = cmd
+        jobs.append(job)
+
+    def on_result(result: ScheduledResult) -> None:
+        if result.ok:
+            logger.info(f"Completed: {result.job.name} ({result.duration:.2f}s, {result.attempts=})")
+        else:
+            logger.error(f"{result.error}: Failed to process {result.job.name} (log: {result.log_path})")
+        record_result(manifest, job_to_cmd[id(result.job)], ok=result.ok, duration=result.duration, error=result.error)
 
+    scheduler = Scheduler(concurrency=num_workers, timeout=timeout, retries=retries, log_dir=log_dir)
+    scheduler.run(jobs, on_result=on_result)
 
-def run_cmd(cmd: Cmd) -> None:
-    subprocess.run(cmd.cmd, stdout=cmd.stdout, stderr=cmd.stderr)
+
+def run_cmds_with_worker_pool(
+    cmds: t.List[Cmd],
+    num_workers: int,
+    max_jobs_per_worker: int = 100,
+    max_rss_mb: t.Optional[float] = None,
+    timeout: t.Optional[float] = None,
+    manifest: t.Optional[JobManifest] = None,
+) -> None:
+    """run the commands on long-lived Blender workers (the part of ``Cmd.cmd`` before "--" must be the same)"""
+    if not cmds:
+        return
+    sep: int = cmds[0].cmd.index("--")
+    pool = BlenderWorkerPool(
+        cmd=cmds[0].cmd[:sep],
+        num_workers=num_workers,
+        max_jobs_per_worker=max_jobs_per_worker,
+        max_rss_mb=max_rss_mb,
+        timeout=timeout,
+    )
+    jobs = [Job(args=cmd.cmd[sep + 1 :], name=f"{cmd.category_id}/{cmd.object_id}") for cmd in cmds]
+    job_to_cmd: t.Dict[int, Cmd] = {id(job): cmd for job, cmd in zip(jobs, cmds)}
+    for result in pool.run(jobs):
+        if result.ok:
+            logger.info(f"Completed: {result.job.name} ({result.duration:.2f}s)")
+        else:
+            logger.error(f"{result.error}: Failed to process {result.job.name}")
+        record_result(manifest, job_to_cmd[id(result.job)], ok=result.ok, duration=result.duration, error=result.error)
 
 
 def main() -> None:
@@ -79,53 +258,124 @@ def main() -> None:
     output_base_dir: Path = args.out_dir
     output_base_dir.mkdir(parents=True, exist_ok=True)
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=args.num_workers) as executor:
-        future_to_fpath: t.Dict[concurrent.futures.Future[None], Cmd] = {}
-        cmd: Cmd
-        # for i, filepath in enumerate(search_file_iter(args.data_dir)):
-        for i, filepath in enumerate(
-            data_file_iter(
-                args.data_dir,
-                data_filepath=args.data_filepath,
-            )
-        ):
-            logger.info(f"{i:>5}: {filepath}")
-            if not filepath.exists():
-                logger.error(f"{filepath} is not exists")
-                continue
+    manifest: t.Optional[JobManifest] = None if args.manifest is None else JobManifest(args.manifest)
+    config_filepath: Path = Path.cwd() / "config" / "main.yml"
+    # a changed template or deformation code must rerun the jobs as well as a changed config
+    template_hashes: t.List[str] = [
+        hash_file(Path.cwd() / obj.obj_filepath) for obj in OmegaConf.load(config_filepath).input.objects
+    ]
+    code_hash: str = hash_code([Path(lib3d.__file__).parent, py_file])
+    config_hash: str = hash_strings([hash_file(config_filepath), *template_hashes, code_hash, "debug_mode=False"])
+    hash_input = functools.lru_cache(maxsize=64)(hash_file)  # the views of a depth pack share the file
 
-            output_filepath_obj: Path = (
-                output_base_dir / filepath.parent.relative_to(args.data_dir) / f"{filepath.stem}.obj"
-            )
+    blender_args: t.List[str] = [str(blender_cmd), "--background", "--python-exit-code", "1", "--python", f"{py_file}"]
+    profile_args: t.List[str] = [] if args.profile is None else [f"profile.output_path={args.profile}"]
+    cmds: t.List[Cmd] = []
+    models: t.Dict[Path, t.List[t.Tuple[Path, Cmd]]] = {}  # --per_model: rendering dir -> views
+    # for i, filepath in enumerate(search_file_iter(args.data_dir)):
+    for i, filepath in enumerate(
+        data_file_iter(
+            args.data_dir,
+            data_filepath=args.data_filepath,
+            suffix=f".{args.depth_format}",
+        )
+    ):
+        logger.info(f"{i:>5}: {filepath}")
+        if not depth_image_file(filepath).exists():
+            logger.error(f"{filepath} is not exists")
+            continue
+
+        pack_view = split_depth_pack_path(filepath)
+        stem: str = filepath.stem if pack_view is None else f"{pack_view[1]}_depth0001"
+        output_filepath_obj: Path = output_base_dir / filepath.parent.relative_to(args.data_dir) / f"{stem}.obj"
+        output_args: t.List[str] = [f"output_filepath_obj={output_filepath_obj}"]
+        key: str = str(output_filepath_obj)
+        outputs: t.List[Path] = [output_filepath_obj]
+        store_key: t.Optional[Key] = None
+        if args.vertex_store is not None:  # one row of the store instead of the OBJ file
+            output_args = [f"vertex_store.store_dir={args.vertex_store}"]
+            store_key = key_from_depth_image_path(filepath)
+            key = f"{args.vertex_store}/{'/'.join(store_key)}"
+            outputs = []
+        input_hash: str = hash_input(depth_image_file(filepath)) if manifest is not None else ""
+        if manifest is not None and not manifest.should_run(key, input_hash=input_hash, config_hash=config_hash):
+            logger.info(f"Skip (done): {filepath}")
+            continue
+        if args.vertex_store is None:
             output_filepath_obj.parent.mkdir(parents=True, exist_ok=True)
-            cmd = Cmd(
+        cmd = Cmd(
+            cmd=[
+                *blender_args,
+                "--",
+                "config=config/main.yml",
+                f"input.depth_image_path={filepath.resolve()}",
+                *output_args,
+                "debug_mode=False",
+                *profile_args,
+            ],
+            category_id=filepath.parents[3].name,
+            object_id=filepath.parents[2].name,
+            key=key,
+            outputs=outputs,
+            input_hash=input_hash,
+            config_hash=config_hash,
+            store_dir=args.vertex_store,
+            store_key=store_key,
+        )
+        if args.per_model:
+            models.setdefault(filepath.parent, []).append((filepath, cmd))
+        else:
+            cmds.append(cmd)
+
+    # one job per model: the template is loaded once and the views that are not done yet are deformed in turn
+    model_dir: Path
+    views: t.List[t.Tuple[Path, Cmd]]
+    for model_dir, views in models.items():
+        output_dir: Path = output_base_dir / model_dir.relative_to(args.data_dir)
+        view_ids: str = ",".join(f"'{key_from_depth_image_path(filepath)[2]}'" for filepath, _ in views)
+        cmds.append(
+            Cmd(
                 cmd=[
-                    str(blender_cmd),
-                    "--background",
-                    "--python",
-                    f"{py_file}",
+                    *blender_args,
                     "--",
                     "config=config/main.yml",
-                    f"input.depth_image_path={filepath.resolve()}",
-                    f"output_filepath_obj={output_filepath_obj}",
+                    f"batch.model_dir={model_dir.resolve()}",
+                    f"batch.depth_format={args.depth_format}",
+                    f"batch.views=[{view_ids}]",
+                    f"batch.output_dir={output_dir}",
+                    *([] if args.vertex_store is None else [f"vertex_store.store_dir={args.vertex_store}"]),
                     "debug_mode=False",
+                    *profile_args,
                 ],
-                category_id=filepath.parents[3].name,
-                object_id=filepath.parents[2].name,
-                stdout=None,
-                stderr=None,
+                category_id=views[0][1].category_id,
+                object_id=views[0][1].object_id,
+                key=str(output_dir),
+                outputs=[output for _, cmd in views for output in cmd.outputs],
+                members=[cmd for _, cmd in views],
             )
-            future_to_fpath[executor.submit(run_cmd, cmd)] = cmd
-
-        future: concurrent.futures.Future[None]
-        for future in concurrent.futures.as_completed(future_to_fpath):
-            cmd = future_to_fpath[future]
-            try:
-                future.result()
-            except Exception as exc:
-                logger.error(f"{exc}: Failed to process {cmd.category_id}/{cmd.object_id}")
-            else:
-                logger.info(f"Completed: {cmd.category_id}/{cmd.object_id}")
+        )
+
+    if args.worker_pool:
+        run_cmds_with_worker_pool(
+            cmds,
+            num_workers=args.num_workers,
+            max_jobs_per_worker=args.max_jobs_per_worker,
+            max_rss_mb=args.max_worker_memory_mb,
+            timeout=args.timeout,
+            manifest=manifest,
+        )
+    else:
+        run_cmds_with_scheduler(
+            cmds,
+            num_workers=args.num_workers,
+            timeout=args.timeout,
+            retries=args.retries,
+            log_dir=args.log_dir if args.log_dir is not None else output_base_dir / "logs",
+            manifest=manifest,
+        )
+
+    if args.profile is not None and args.profile.exists():
+        logger.warning(f"profile ({args.profile}):\n{profiling.summarize(profiling.load_records(args.profile))}")
 
 
 if __name__ == "__main__":
@@ -11,12 +11,30 @@ from pathlib import Path
 # Third Party Library
 import bpy
 import mathutils
+import nptyping as npt
+import numpy as np
 from omegaconf import OmegaConf
 
 # First Party Library
+from lib3d import profiling
+from lib3d import worker_pool
+from lib3d.depth import DEPTH_IMAGE_TOLERANCE
+from lib3d.depth import DEPTH_MAP_OFFSET
+from lib3d.depth import DEPTH_MAP_SIZE
+from lib3d.depth import DEPTH_PACK_NAME
+from lib3d.depth import DepthPack
+from lib3d.depth import depth_image_error
+from lib3d.depth import read_depth_image
+from lib3d.model_cache import ModelCache
+from lib3d.model_cache import load_model_cache
+from lib3d.model_cache import source_signature
 from lib3d.types import BpyConfig
+from lib3d.types import DepthOutputConfig
 from lib3d.types import RenderRGBDConfig
 from lib3d.types import SceneObjectsConfig
+from lib3d.utils import model_cache_from_objects
+from lib3d.utils import new_objects_from_model_cache
+from lib3d.utils import reset_scene
 
 logger = getLogger(__name__)
 logger.addHandler(NullHandler())
@@ -25,14 +43,19 @@ logger.addHandler(NullHandler())
 _PathLike = t.TypeVar("_PathLike", Path, str)
 
 
-def parse_config() -> RenderRGBDConfig:
+def parse_config(custom_args: t.Optional[t.List[str]] = None) -> RenderRGBDConfig:
+    """
+    Args:
+        custom_args (t.List[str], optional): the arguments after "--". Read from ``sys.argv`` if not given.
+    """
 
-    args: t.List[str] = sys.argv[1:]
-    custom_args: t.List[str] = []
-    for i, arg in enumerate(args):
-        if arg == "--":
-            custom_args = args[i + 1 :]
-            break
+    if custom_args is None:
+        args: t.List[str] = sys.argv[1:]
+        custom_args = []
+        for i, arg in enumerate(args):
+            if arg == "--":
+                custom_args = args[i + 1 :]
+                break
 
     if (path := os.environ.get("APP_CONFIG_PATH")) is None:
         raise ValueError("APP_CONFIG_PATH is not set!")
@@ -60,9 +83,19 @@ def convert_to_location_vector(location: t.Union[t.List[int], t.Tuple[float, flo
 
 
 class ShapeNetRender:
-    def __init__(self, config_bpy: BpyConfig, config_scene_objects: SceneObjectsConfig):
+    def __init__(
+        self,
+        config_bpy: BpyConfig,
+        config_scene_objects: SceneObjectsConfig,
+        config_depth_output: DepthOutputConfig = DepthOutputConfig(),
+    ):
         self.config_bpy = config_bpy
         self.config_scene_objects = config_scene_objects
+        self.config_depth_output = config_depth_output
+        for depth_format in config_depth_output.formats:
+            if depth_format not in ("png", "npy", "pack"):
+                raise ValueError(f"{depth_format=} not supported!")
+        self.model_objects: t.List[bpy.types.Object] = []  # objects added by load_object
 
         # Set up rendering
         self.context = bpy.context
@@ -77,6 +110,8 @@ class ShapeNetRender:
         bpy_cntx_scene_render.resolution_y = config_bpy.context.scene.render.resolution_y
         bpy_cntx_scene_render.resolution_percentage = 100
         bpy_cntx_scene_render.film_transparent = True
+        # Blender's default "Filmic" would bend the depth PNG (see lib3d.depth)
+        self.scene.view_settings.view_transform = config_bpy.context.scene.view_settings.view_transform
 
         self.scene.use_nodes = True
         self.scene.view_layers["View Layer"].use_pass_normal = True
@@ -95,27 +130,39 @@ class ShapeNetRender:
         # Create input render layer node
         self.render_layers = self.nodes.new("CompositorNodeRLayers")
 
+        links = bpy.context.scene.node_tree.links
+
         # depth
         # Create depth output nodes
-        self.depth_file_output = self.nodes.new(type="CompositorNodeOutputFile")
-        self.depth_file_output.label = "Depth Output"
-        self.depth_file_output.base_path = ""
-        self.depth_file_output.file_slots[0].use_node_format = True
-        self.depth_file_output.format.file_format = "PNG"
-        self.depth_file_output.format.color_depth = "8"  # 8 bit per channel
-        self.depth_file_output.format.color_mode = "BW"
-
-        # Remap as other types can not represent the full range of depth.
-        depth_map = self.nodes.new(type="CompositorNodeMapValue")
-        # Size is chosen kind of arbitrarily, try out until you're satisfied with resulting depth map.
-        depth_map.offset = [-0.7]
-        depth_map.size = [1.4]
-        depth_map.use_min = True
-        depth_map.min = [0]
-
-        links = bpy.context.scene.node_tree.links
-        links.new(self.render_layers.outputs["Depth"], depth_map.inputs[0])
-        links.new(depth_map.outputs[0], self.depth_file_output.inputs[0])
+        self.depth_file_output: t.Optional[bpy.types.CompositorNodeOutputFile] = None
+        if "png" in config_depth_output.formats:
+            self.depth_file_output = self.nodes.new(type="CompositorNodeOutputFile")
+            self.depth_file_output.label = "Depth Output"
+            self.depth_file_output.base_path = ""
+            self.depth_file_output.file_slots[0].use_node_format = True
+            self.depth_file_output.format.file_format = "PNG"
+            self.depth_file_output.format.color_depth = "8"  # 8 bit per channel
+            self.depth_file_output.format.color_mode = "BW"
+
+            # Remap as other types can not represent the full range of depth.
+            depth_map = self.nodes.new(type="CompositorNodeMapValue")
+            # Size is chosen kind of arbitrarily, try out until you're satisfied with resulting depth map.
+            depth_map.offset = [DEPTH_MAP_OFFSET]
+            depth_map.size = [DEPTH_MAP_SIZE]
+            depth_map.use_min = True
+            depth_map.min = [0]
+
+            links.new(self.render_layers.outputs["Depth"], depth_map.inputs[0])
+            links.new(depth_map.outputs[0], self.depth_file_output.inputs[0])
+
+        # the raw linear depth is read back from the viewer node image after rendering
+        raw_depth: bool = "npy" in config_depth_output.formats or "pack" in config_depth_output.formats
+        # the PNG of the first render is checked against it once
+        self.depth_png_checked: bool = self.depth_file_output is None or not raw_depth
+        if raw_depth:
+            depth_viewer = self.nodes.new(type="CompositorNodeViewer")
+            depth_viewer.use_alpha = False
+            links.new(self.render_layers.outputs["Depth"], depth_viewer.inputs[0])
 
         # Delete default cube
         self.context.active_object.select_set(True)
@@ -202,16 +249,56 @@ class ShapeNetRender:
             math.radians(-azimuth),
         )
 
-    def load_object(self, object_filepath: _PathLike, object_name: str = "Model") -> bpy.types.Object:
+    def load_object(
+        self,
+        object_filepath: _PathLike,
+        object_name: str = "Model",
+        cache_path: t.Optional[_PathLike] = None,
+    ) -> bpy.types.Object:
+        """
+        Args:
+            cache_path (_PathLike, optional): binary cache of the OBJ file (``lib3d.model_cache``).
+                The OBJ file is only imported if the cache is missing or stale.
+        """
         model_filepath: Path = Path(object_filepath)
         if model_filepath.suffix == ".obj":
-            obj = self.load_wavefront_obj(obj_path=str(model_filepath), obj_name=object_name)
+            cache: t.Optional[ModelCache] = None
+            if cache_path is not None:
+                cache = load_model_cache(model_filepath, cache_path)
+            if cache is not None and cache.meshes:
+                objects: t.List[bpy.types.Object] = new_objects_from_model_cache(cache)
+                obj = objects[0]
+                obj.name = object_name
+            else:
+                obj = self.load_wavefront_obj(obj_path=str(model_filepath), obj_name=object_name)
+                # an OBJ file with several groups is imported as several objects
+                objects = list(bpy.context.selected_objects)
+                if cache_path is not None:
+                    model_cache_from_objects(objects, source_signature=source_signature(model_filepath)).save(
+                        cache_path
+                    )
+            self.model_objects += objects
             obj.location = convert_to_location_vector((0, 0, 0))
             logger.info(f"{obj.name=}, {obj.location=}, {obj.data.name=}")
             return obj
         else:
             raise ValueError(f"{model_filepath=} not supported format!")
 
+    def unload_objects(self) -> None:
+        """remove the loaded models and purge the data blocks left without users (meshes, materials, images)
+
+        The scene setup (compositor nodes, lights, camera rig and render settings) is kept.
+        """
+        for obj in self.model_objects:
+            bpy.data.objects.remove(obj, do_unlink=True)
+        self.model_objects = []
+
+        data_collections: t.List[t.Any] = [bpy.data.meshes, bpy.data.materials, bpy.data.textures, bpy.data.images]
+        for data_collection in data_collections:
+            for block in list(data_collection):
+                if block.users == 0:
+                    data_collection.remove(block)
+
     def render(self, filepath: _PathLike) -> None:
         """save to f"{filepath}.<ext>". (<ext> is the file format)
 
@@ -220,10 +307,39 @@ class ShapeNetRender:
         """
         self.scene.render.filepath = str(filepath)
 
-        self.depth_file_output.file_slots[0].path = f"{filepath}_depth"
+        if self.depth_file_output is not None:
+            self.depth_file_output.file_slots[0].path = f"{filepath}_depth"
 
         bpy.ops.render.render(write_still=True)  # render still
 
+        if "npy" in self.config_depth_output.formats:
+            # same name as the PNG written by the file output node (with the frame number)
+            np.save(f"{filepath}_depth{self.scene.frame_current:04d}.npy", self.get_viewer_depth())
+        if not self.depth_png_checked:
+            self.check_depth_png(f"{filepath}_depth{self.scene.frame_current:04d}.png")
+
+    def check_depth_png(self, png_filepath: str) -> None:
+        """the PNG depth and the raw depth of the last render must decode to the same depth"""
+        error: float = depth_image_error(read_depth_image(png_filepath), self.get_viewer_depth())
+        if error > DEPTH_IMAGE_TOLERANCE:
+            raise RuntimeError(
+                f"{png_filepath}: the PNG depth differs from the raw depth by up to {error:.1f} "
+                f"({self.scene.view_settings.view_transform=}, expected: 'Raw')"
+            )
+        self.depth_png_checked = True
+
+    def get_viewer_depth(self) -> npt.NDArray[npt.Shape["*, *"], npt.Float]:
+        """the linear depth of the last render (top row first, like the PNG)"""
+        image: bpy.types.Image = bpy.data.images["Viewer Node"]
+        width, height = image.size
+        pixels = np.empty(width * height * 4, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+        depth = pixels.reshape(height, width, 4)[::-1, :, 0]
+        return t.cast(
+            npt.NDArray[npt.Shape["*, *"], npt.Float],
+            np.ascontiguousarray(depth, dtype=np.dtype(self.config_depth_output.dtype)),
+        )
+
     @staticmethod
     def load_wavefront_obj(obj_path: _PathLike, obj_name: t.Optional[str] = None) -> bpy.types.Object:
         bpy.ops.object.select_all(action="DESELECT")  # deselect
@@ -234,13 +350,20 @@ class ShapeNetRender:
         return obj
 
 
-def blender_main(config: RenderRGBDConfig, debug_mode: bool = False) -> None:
+def get_metadata_filepaths(config: RenderRGBDConfig) -> t.List[Path]:
+    """``metadata_filepaths`` and the lines of ``metadata_list_filepath``, or ``[metadata_filepath]`` if both are empty"""
+    filepaths: t.List[str] = list(config.metadata_filepaths)
+    if config.metadata_list_filepath is not None:
+        with open(Path(config.metadata_list_filepath).expanduser(), mode="rt") as f:
+            filepaths += [line.strip() for line in f if line.strip()]
+    if not filepaths:
+        filepaths = [config.metadata_filepath]
+    return [Path(filepath).expanduser() for filepath in filepaths]
 
-    # load metadata file
-    metadata_filepath: Path = Path(
-        # "ShapeNetP2M/04530566/ffffe224db39febe288b05b36358465d/rendering/rendering_metadata.txt"
-        config.metadata_filepath
-    ).expanduser()
+
+def render_model(renderer: ShapeNetRender, config: RenderRGBDConfig, metadata_filepath: Path) -> None:
+    """render every view of ``metadata_filepath`` (one ShapeNet model)"""
+    # "ShapeNetP2M/04530566/ffffe224db39febe288b05b36358465d/rendering/rendering_metadata.txt"
     class_id: str = metadata_filepath.parents[2].name
     model_id: str = metadata_filepath.parents[1].name
     # /media/pollenjp/DATAHDD8TB/share/share01/dataset/ShapeNet/
@@ -249,8 +372,15 @@ def blender_main(config: RenderRGBDConfig, debug_mode: bool = False) -> None:
     model_path: Path = shapenet_v1_root_path / class_id / model_id / "model.obj"
     output_dir_path: Path = Path(config.output_root_dir).expanduser() / class_id / model_id / "rendering"
 
-    renderer = ShapeNetRender(config.bpy, config.scene_objects)
-    _ = renderer.load_object(model_path, object_name="TargetModel")
+    cache_path: t.Optional[Path] = None
+    if config.model_cache_dir is not None:
+        cache_path = Path(config.model_cache_dir).expanduser() / class_id / model_id / "model.cache.npz"
+    with profiling.stage("load_object"):
+        _ = renderer.load_object(model_path, object_name="TargetModel", cache_path=cache_path)
+    # the depth pack of the model ("pack" of depth_output.formats)
+    depth_maps: t.List[npt.NDArray[npt.Shape["*, *"], npt.Float]] = []
+    views: t.List[str] = []
+    viewports: t.List[t.List[float]] = []
     with open(metadata_filepath, mode="rt") as f:
         i: int
         line: str
@@ -260,15 +390,60 @@ def blender_main(config: RenderRGBDConfig, debug_mode: bool = False) -> None:
                 continue
             metadata: t.List[float] = list(map(float, line.split(" ")))
 
-            renderer.set_viewport(*metadata)
+            with profiling.stage("set_viewport"):
+                renderer.set_viewport(*metadata)
             output_filepath: Path = output_dir_path / f"{i:02d}"
             output_filepath.parent.mkdir(parents=True, exist_ok=True)
-            renderer.render(filepath=output_filepath)
+            with profiling.stage("render"):
+                renderer.render(filepath=output_filepath)
+            profiling.count("views")
+            if "pack" in config.depth_output.formats:
+                depth_maps.append(renderer.get_viewer_depth())
+                views.append(output_filepath.name)
+                viewports.append(metadata)
+
+    if depth_maps:
+        with profiling.stage("save_depth_pack"):
+            pack = DepthPack(depth=np.stack(depth_maps), views=views, viewports=viewports)
+            pack.save(output_dir_path / DEPTH_PACK_NAME)
+
+
+def blender_main(
+    config: RenderRGBDConfig,
+    debug_mode: bool = False,
+    renderer: t.Optional[ShapeNetRender] = None,
+) -> ShapeNetRender:
+    """render the models of ``config`` in one session
+
+    The scene is set up once (or ``renderer`` is reused). Before each model, only the previous model is unloaded.
+    Every model is a profiling job of its own (the scene setup is the job "scene_setup").
+
+    Returns:
+        ShapeNetRender: the renderer, to be reused for the next models
+    """
+    if renderer is None:
+        with profiling.job(config.profile.output_path, name="scene_setup"):
+            renderer = ShapeNetRender(config.bpy, config.scene_objects, config.depth_output)
+
+    failed: t.List[Path] = []
+    for metadata_filepath in get_metadata_filepaths(config):
+        try:
+            with profiling.job(config.profile.output_path, name=str(metadata_filepath)):
+                with profiling.stage("unload_objects"):
+                    renderer.unload_objects()
+                render_model(renderer, config, metadata_filepath)
+        except Exception:
+            logger.exception(f"Failed to render {metadata_filepath}")
+            failed.append(metadata_filepath)
 
     # For debugging the workflow
     if debug_mode is True and config.debug is not None:
         bpy.ops.wm.save_as_mainfile(filepath=f"{Path(config.debug.blend_filepath).expanduser()}")
 
+    if failed:
+        raise RuntimeError(f"Failed to render {len(failed)} model(s): {failed}")
+    return renderer
+
 
 def main() -> None:
     logging.basicConfig(
@@ -284,5 +459,34 @@ def main() -> None:
     blender_main(config, debug_mode=config.debug_mode)
 
 
+def serve() -> None:
+    """worker mode of ``lib3d.worker_pool.BlenderWorkerPool``"""
+    logging.basicConfig(
+        format="[%(asctime)s][%(levelname)s][%(filename)s:%(lineno)d] - %(message)s",
+        level=logging.WARNING,
+    )
+    logger.setLevel(logging.INFO)
+
+    # the renderer (scene setup) is kept across jobs with the same render settings
+    session: t.Dict[str, t.Any] = {"renderer": None, "scene_key": None, "used": False}
+
+    def handle_job(custom_args: t.List[str]) -> None:
+        config = parse_config(custom_args)
+        scene_key: str = "".join(OmegaConf.to_yaml(c) for c in (config.bpy, config.scene_objects, config.depth_output))
+        if session["renderer"] is None or session["scene_key"] != scene_key:
+            if session["used"]:  # back to the startup scene before a new setup
+                reset_scene()
+            session["used"] = True
+            with profiling.job(config.profile.output_path, name="scene_setup"):
+                session["renderer"] = ShapeNetRender(config.bpy, config.scene_objects, config.depth_output)
+            session["scene_key"] = scene_key
+        blender_main(config, debug_mode=config.debug_mode, renderer=session["renderer"])
+
+    worker_pool.serve(handle_job)
+
+
 if __name__ == "__main__":
-    main()
+    if worker_pool.is_worker():
+        serve()
+    else:
+        main()
@@ -4,16 +4,29 @@ $ python3 ./scripts/run.py --data_dir "data"
 
 # Standard Library
 import argparse
-import concurrent.futures
 import os
 import re
-import subprocess
 import typing as t
 from dataclasses import dataclass
+from dataclasses import field
 from logging import NullHandler
 from logging import getLogger
 from pathlib import Path
 
+# First Party Library
+import lib3d
+from lib3d import profiling
+from lib3d.depth import DEPTH_PACK_NAME
+from lib3d.manifest import JobManifest
+from lib3d.manifest import hash_code
+from lib3d.manifest import hash_file
+from lib3d.manifest import hash_strings
+from lib3d.scheduler import ScheduledJob
+from lib3d.scheduler import ScheduledResult
+from lib3d.scheduler import Scheduler
+from lib3d.worker_pool import BlenderWorkerPool
+from lib3d.worker_pool import Job
+
 logger = getLogger(__name__)
 logger.addHandler(NullHandler())
 
@@ -22,6 +35,46 @@ def get_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="")
     parser.add_argument("--data_dir", required=True, type=lambda x: Path(x).expanduser().absolute())
     parser.add_argument("--out_dir", required=True, type=lambda x: Path(x).expanduser().absolute())
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument(
+        "--worker_pool",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="run the jobs on long-lived Blender workers instead of one Blender process per job",
+    )
+    parser.add_argument("--max_jobs_per_worker", type=int, default=100, help="recycle a worker after N jobs")
+    parser.add_argument(
+        "--max_worker_memory_mb", type=float, default=None, help="recycle a worker when its RSS exceeds this"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None, help="kill a job (a worker with --worker_pool) after N seconds"
+    )
+    parser.add_argument("--retries", type=int, default=2, help="retries of a failed job (without --worker_pool)")
+    parser.add_argument(
+        "--log_dir",
+        type=lambda x: Path(x).expanduser().absolute(),
+        default=None,
+        help="per-job log files without --worker_pool (default: <out_dir>/logs)",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=lambda x: Path(x).expanduser().absolute(),
+        default=None,
+        help="JSONL job journal. Completed jobs are skipped on a rerun unless their input or config has changed",
+    )
+    parser.add_argument(
+        "--profile",
+        type=lambda x: Path(x).expanduser().absolute(),
+        default=None,
+        help="JSONL file of per-stage timings of every job (summarized at the end)",
+    )
+    parser.add_argument(
+        "--depth_formats",
+        nargs="+",
+        choices=["png", "npy", "pack"],
+        default=None,
+        help='depth_output.formats (default: the config file). "pack": one depth_pack.npy per model',
+    )
     args = parser.parse_args()
     return args
 
@@ -43,12 +96,89 @@ class Cmd:
     category_id: str
     object_id: str
     env: t.Optional[t.Dict[str, str]] = None
-    stdout: t.Optional[t.TextIO] = None
-    stderr: t.Optional[t.TextIO] = None
+    # for the job manifest
+    outputs: t.List[Path] = field(default_factory=list)
+    input_hash: str = ""
+    config_hash: str = ""
+
+
+def record_result(
+    manifest: t.Optional[JobManifest],
+    cmd: Cmd,
+    ok: bool,
+    duration: float,
+    error: t.Optional[str] = None,
+) -> None:
+    if manifest is None:
+        return
+    if ok and not all(output.exists() for output in cmd.outputs):
+        ok, error = False, f"missing outputs: {[str(output) for output in cmd.outputs if not output.exists()]}"
+    manifest.record(
+        key=str(cmd.outputs[0]),
+        input_hash=cmd.input_hash,
+        config_hash=cmd.config_hash,
+        outputs=cmd.outputs,
+        ok=ok,
+        duration=duration,
+        error=error,
+    )
 
 
-def run_cmd(cmd: Cmd) -> None:
-    subprocess.run(cmd.cmd, stdout=cmd.stdout, stderr=cmd.stderr, env=cmd.env)
+def run_cmds_with_scheduler(
+    cmds: t.List[Cmd],
+    num_workers: int,
+    timeout: t.Optional[float] = None,
+    retries: int = 0,
+    log_dir: t.Optional[Path] = None,
+    manifest: t.Optional[JobManifest] = None,
+) -> None:
+    """run one Blender process per command with ``lib3d.scheduler.Scheduler``"""
+    job_to_cmd: t.Dict[int, Cmd] = {}
+    jobs: t.List[ScheduledJob] = []
+    for cmd in cmds:
+        job = ScheduledJob(name=f"{cmd.category_id}/{cmd.object_id}", cmd=cmd.cmd, env=cmd.env)
+        job_to_cmd[id(job)] = cmd
+        jobs.append(job)
+
+    def on_result(result: ScheduledResult) -> None:
+        if result.ok:
+            logger.info(f"Completed: {result.job.name} ({result.duration:.2f}s, {result.attempts=})")
+        else:
+            logger.error(f"{result.error}: Failed to process {result.job.name} (log: {result.log_path})")
+        record_result(manifest, job_to_cmd[id(result.job)], ok=result.ok, duration=result.duration, error=result.error)
+
+    scheduler = Scheduler(concurrency=num_workers, timeout=timeout, retries=retries, log_dir=log_dir)
+    scheduler.run(jobs, on_result=on_result)
+
+
+def run_cmds_with_worker_pool(
+    cmds: t.List[Cmd],
+    num_workers: int,
+    max_jobs_per_worker: int = 100,
+    max_rss_mb: t.Optional[float] = None,
+    timeout: t.Optional[float] = None,
+    manifest: t.Optional[JobManifest] = None,
+) -> None:
+    """run the commands on long-lived Blender workers (the part of ``Cmd.cmd`` before "--" must be the same)"""
+    if not cmds:
+        return
+    sep: int = cmds[0].cmd.index("--")
+    pool = BlenderWorkerPool(
+        cmd=cmds[0].cmd[:sep],
+        num_workers=num_workers,
+        max_jobs_per_worker=max_jobs_per_worker,
+        max_rss_mb=max_rss_mb,
+        timeout=timeout,
+        env=None if cmds[0].env is None else {**os.environ, **cmds[0].env},
+    )
+    jobs = [Job(args=cmd.cmd[sep + 1 :], name=f"{cmd.category_id}/{cmd.object_id}") for cmd in cmds]
+    job_to_cmd: t.Dict[int, Cmd] = {id(job): cmd for job, cmd in zip(jobs, cmds)}
+    for result in pool.run(jobs):
+        if result.ok:
+            logger.info(f"Completed: {result.job.name} ({result.duration:.2f}s)")
+        else:
+            logger.error(f"{result.error}: Failed to process {result.job.name}")
+        record_result(manifest, job_to_cmd[id(result.job)], ok=result.ok, duration=result.duration, error=result.error)
 
 
 def main() -> None:
@@ -65,49 +195,85 @@ def main() -> None:
 
     default_config: Path = Path.cwd() / "config" / "create_3dr2n2_with_depth.yml"
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
-        future_to_fpath: t.Dict[concurrent.futures.Future[None], Cmd] = {}
-        cmd: Cmd
-        for i, filepath in enumerate(search_file_iter(args.data_dir)):
-            # if i > 2:
-            #     break
-            logger.info(f"{i:>5}: {filepath}")
-            if not filepath.exists():
-                logger.error(f"{filepath} is not exists")
-                continue
-
-            output_filepath_obj: Path = (
-                output_base_dir / filepath.parent.relative_to(args.data_dir) / f"{filepath.stem}.obj"
-            )
-            output_filepath_obj.parent.mkdir(parents=True, exist_ok=True)
-            cmd = Cmd(
+    manifest: t.Optional[JobManifest] = None if args.manifest is None else JobManifest(args.manifest)
+    depth_args: t.List[str] = (
+        [] if args.depth_formats is None else [f"depth_output.formats=[{','.join(args.depth_formats)}]"]
+    )
+    code_hash: str = hash_code([Path(lib3d.__file__).parent, py_file])  # a changed renderer reruns the jobs
+    config_hash: str = hash_strings([hash_file(default_config), code_hash, "debug_mode=False", *depth_args])
+
+    cmds: t.List[Cmd] = []
+    for i, filepath in enumerate(search_file_iter(args.data_dir)):
+        # if i > 2:
+        #     break
+        logger.info(f"{i:>5}: {filepath}")
+        if not filepath.exists():
+            logger.error(f"{filepath} is not exists")
+            continue
+
+        output_filepath_obj: Path = (
+            output_base_dir / filepath.parent.relative_to(args.data_dir) / f"{filepath.stem}.obj"
+        )
+        # create_3dr2n2_with_depth.py renders one image per line of the metadata file
+        output_dir: Path = output_base_dir / filepath.parents[2].name / filepath.parents[1].name / "rendering"
+        with open(filepath, mode="rt") as f:
+            num_views: int = sum(1 for line in f if line.strip())
+        outputs: t.List[Path] = [output_dir / f"{j:02d}.png" for j in range(num_views)]
+        if args.depth_formats is not None and "pack" in args.depth_formats:
+            outputs.append(output_dir / DEPTH_PACK_NAME)
+        input_hash: str = hash_file(filepath) if manifest is not None else ""
+        if manifest is not None and not manifest.should_run(
+            str(output_dir), input_hash=input_hash, config_hash=config_hash
+        ):
+            logger.info(f"Skip (done): {filepath}")
+            continue
+        output_filepath_obj.parent.mkdir(parents=True, exist_ok=True)
+        cmds.append(
+            Cmd(
                 cmd=[
                     str(blender_cmd),
                     "--background",
+                    "--python-exit-code",
+                    "1",
                     "--python",
                     f"{py_file}",
                     "--",
                     f"output_root_dir={output_base_dir}",
                     f"metadata_filepath={filepath}",
                     "debug_mode=False",
-                ],
+                    *depth_args,
+                ]
+                + ([] if args.profile is None else [f"profile.output_path={args.profile}"]),
                 category_id=filepath.parents[3].name,
                 object_id=filepath.parents[2].name,
                 env={"APP_CONFIG_PATH": f"{default_config}"},
-                stdout=None,
-                stderr=None,
+                outputs=[output_dir, *outputs],
+                input_hash=input_hash,
+                config_hash=config_hash,
             )
-            future_to_fpath[executor.submit(run_cmd, cmd)] = cmd
-
-        future: concurrent.futures.Future[None]
-        for future in concurrent.futures.as_completed(future_to_fpath):
-            cmd = future_to_fpath[future]
-            try:
-                future.result()
-            except Exception as exc:
-                logger.error(f"{exc}: Failed to process {cmd.category_id}/{cmd.object_id}")
-            else:
-                logger.info(f"Completed: {cmd.category_id}/{cmd.object_id}")
+        )
+
+    if args.worker_pool:
+        run_cmds_with_worker_pool(
+            cmds,
+            num_workers=args.num_workers,
+            max_jobs_per_worker=args.max_jobs_per_worker,
+            max_rss_mb=args.max_worker_memory_mb,
+            timeout=args.timeout,
+            manifest=manifest,
+        )
+    else:
+        run_cmds_with_scheduler(
+            cmds,
+            num_workers=args.num_workers,
+            timeout=args.timeout,
+            retries=args.retries,
+            log_dir=args.log_dir if args.log_dir is not None else output_base_dir / "logs",
+            manifest=manifest,
+        )
+
+    if args.profile is not None and args.profile.exists():
+        logger.warning(f"profile ({args.profile}):\n{profiling.summarize(profiling.load_records(args.profile))}")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,28 @@
+# Standard Library
+import importlib.util
+
+# Local Library
+from . import geometry
+from . import mask
+from . import mold
 from . import types
-from . import load_obj
-from . import utils
+from . import wavefront
 
 __all__ = [
-    "load_obj",
-    "utils",
+    "geometry",
+    "mask",
+    "mold",
+    "wavefront",
     "types",
 ]
+
+# modules which need Blender (bpy, mathutils) are only available inside Blender
+if importlib.util.find_spec("bpy") is not None:
+    # Local Library
+    from . import load_obj
+    from . import utils
+
+    __all__ += [
+        "load_obj",
+        "utils",
+    ]
@@ -0,0 +1,198 @@
+# Standard Library
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+
+@dataclass
+class BVH:
+    """Bounding volume hierarchy over axis aligned boxes
+
+    Nodes are stored in flat arrays. ``left[i] == -1`` means that node ``i`` is a leaf which owns
+    ``primitive_ids[start[i] : start[i] + count[i]]``.
+    """
+
+    node_min: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+    node_max: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+    left: npt.NDArray[npt.Shape["*"], npt.Int]
+    right: npt.NDArray[npt.Shape["*"], npt.Int]
+    start: npt.NDArray[npt.Shape["*"], npt.Int]
+    count: npt.NDArray[npt.Shape["*"], npt.Int]
+    primitive_ids: npt.NDArray[npt.Shape["*"], npt.Int]
+
+    @classmethod
+    def build(
+        cls,
+        box_min: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        box_max: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        leaf_size: int = 8,
+    ) -> "BVH":
+        """median split on the longest axis of the box centers"""
+        box_min = np.asarray(box_min, dtype=np.float64)
+        box_max = np.asarray(box_max, dtype=np.float64)
+        centers = (box_min + box_max) / 2
+        primitive_ids = np.arange(len(box_min), dtype=np.int64)
+
+        node_min: t.List[npt.NDArray[npt.Shape["3"], npt.Float]] = []
+        node_max: t.List[npt.NDArray[npt.Shape["3"], npt.Float]] = []
+        left: t.List[int] = []
+        right: t.List[int] = []
+        start: t.List[int] = []
+        count: t.List[int] = []
+
+        def new_node(begin: int, end: int) -> int:
+            ids = primitive_ids[begin:end]
+            node_min.append(box_min[ids].min(axis=0) if end > begin else np.zeros(3))
+            node_max.append(box_max[ids].max(axis=0) if end > begin else np.zeros(3))
+            left.append(-1)
+            right.append(-1)
+            start.append(begin)
+            count.append(end - begin)
+            return len(left) - 1
+
+        stack: t.List[int] = [new_node(0, len(primitive_ids))]
+        while stack:
+            node = stack.pop()
+            begin, end = start[node], start[node] + count[node]
+            if end - begin <= leaf_size:
+                continue
+            ids = primitive_ids[begin:end]
+            extent = centers[ids].max(axis=0) - centers[ids].min(axis=0)
+            axis = int(np.argmax(extent))
+            mid = (end - begin) // 2
+            order = np.argpartition(centers[ids, axis], mid)
+            primitive_ids[begin:end] = ids[order]
+
+            left[node] = new_node(begin, begin + mid)
+            right[node] = new_node(begin + mid, end)
+            stack += [left[node], right[node]]
+
+        return cls(
+            node_min=np.array(node_min, dtype=np.float64).reshape(-1, 3),
+            node_max=np.array(node_max, dtype=np.float64).reshape(-1, 3),
+            left=np.array(left, dtype=np.int64),
+            right=np.array(right, dtype=np.int64),
+            start=np.array(start, dtype=np.int64),
+            count=np.array(count, dtype=np.int64),
+            primitive_ids=primitive_ids,
+        )
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.left)
+
+    def intersect_rays(
+        self,
+        origins: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        directions: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        node_ids: npt.NDArray[npt.Shape["*"], npt.Int],
+        t_min: float = 0.0,
+        clip_min: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None,
+        clip_max: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None,
+    ) -> npt.NDArray[npt.Shape["*"], npt.Bool]:
+        """slab test of ``origin + t * direction`` (``t >= t_min``) against the boxes of ``node_ids``
+
+        The boxes are intersected with ``[clip_min, clip_max]`` (one box per ray) first if they are given.
+        """
+        box_min = self.node_min[node_ids]
+        box_max = self.node_max[node_ids]
+        if clip_min is not None and clip_max is not None:
+            box_min = np.maximum(box_min, clip_min)
+            box_max = np.minimum(box_max, clip_max)
+        # avoid 0 * inf
+        directions = np.where(np.abs(directions) < 1e-30, np.copysign(1e-30, directions), directions)
+        inv = 1.0 / directions
+        t1 = (box_min - origins) * inv
+        t2 = (box_max - origins) * inv
+        t_near = np.minimum(t1, t2).max(axis=1)
+        t_far = np.maximum(t1, t2).min(axis=1)
+        return t.cast(
+            npt.NDArray[npt.Shape["*"], npt.Bool],
+            (t_near <= t_far) & (t_far >= t_min) & np.all(box_min <= box_max, axis=1),
+        )
+
+    def query_rays(
+        self,
+        origins: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        directions: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        t_min: float = 0.0,
+    ) -> t.Tuple[npt.NDArray[npt.Shape["*"], npt.Int], npt.NDArray[npt.Shape["*"], npt.Int]]:
+        """(ray, primitive) pairs whose box is crossed by the ray
+
+        All rays are traversed together, one tree level per iteration.
+
+        Returns:
+            (np.ndarray, np.ndarray): ray ids and primitive ids of the candidate pairs
+        """
+        origins = np.broadcast_to(np.asarray(origins, dtype=np.float64), np.shape(directions))
+        directions = np.asarray(directions, dtype=np.float64)
+        return self._traverse(
+            len(directions),
+            lambda ray_ids, node_ids: self.intersect_rays(origins[ray_ids], directions[ray_ids], node_ids, t_min=t_min),
+        )
+
+    def query_rays_in_boxes(
+        self,
+        origins: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        directions: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        box_min: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        box_max: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        t_min: float = 0.0,
+    ) -> t.Tuple[npt.NDArray[npt.Shape["*"], npt.Int], npt.NDArray[npt.Shape["*"], npt.Int]]:
+        """``query_rays`` with the part of each ray inside its own box ``[box_min[i], box_max[i]]``"""
+        origins = np.broadcast_to(np.asarray(origins, dtype=np.float64), np.shape(directions))
+        directions = np.asarray(directions, dtype=np.float64)
+        box_min = np.asarray(box_min, dtype=np.float64)
+        box_max = np.asarray(box_max, dtype=np.float64)
+        return self._traverse(
+            len(directions),
+            lambda ray_ids, node_ids: self.intersect_rays(
+                origins[ray_ids],
+                directions[ray_ids],
+                node_ids,
+                t_min=t_min,
+                clip_min=box_min[ray_ids],
+                clip_max=box_max[ray_ids],
+            ),
+        )
+
+    def _traverse(
+        self,
+        num_queries: int,
+        overlaps: t.Callable[
+            [npt.NDArray[npt.Shape["*"], npt.Int], npt.NDArray[npt.Shape["*"], npt.Int]],
+            npt.NDArray[npt.Shape["*"], npt.Bool],
+        ],
+    ) -> t.Tuple[npt.NDArray[npt.Shape["*"], npt.Int], npt.NDArray[npt.Shape["*"], npt.Int]]:
+        """(query, primitive) pairs of the leaves reached through nodes ``overlaps(query_ids, node_ids)`` is True for"""
+        query_ids = np.arange(num_queries, dtype=np.int64)
+        node_ids = np.zeros(num_queries, dtype=np.int64)
+
+        result_queries: t.List[npt.NDArray[npt.Shape["*"], npt.Int]] = []
+        result_primitives: t.List[npt.NDArray[npt.Shape["*"], npt.Int]] = []
+        while len(query_ids) > 0:
+            hit = overlaps(query_ids, node_ids)
+            query_ids, node_ids = query_ids[hit], node_ids[hit]
+
+            is_leaf = self.left[node_ids] < 0
+            leaf_queries, leaf_nodes = query_ids[is_leaf], node_ids[is_leaf]
+            counts = self.count[leaf_nodes]
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            result_queries.append(np.repeat(leaf_queries, counts))
+            result_primitives.append(self.primitive_ids[np.repeat(self.start[leaf_nodes], counts) + offsets])
+
+            query_ids, node_ids = query_ids[~is_leaf], node_ids[~is_leaf]
+            query_ids = np.concatenate([query_ids, query_ids])
+            node_ids = np.concatenate([self.left[node_ids], self.right[node_ids]])
+
+        if not result_queries:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(result_queries), np.concatenate(result_primitives)
@@ -0,0 +1,186 @@
+"""Depth images of the renderer (``scripts/rendering/create_3dr2n2_with_depth.py``)
+
+The renderer maps the linear depth ``d`` of the camera with ``clip((d + DEPTH_MAP_OFFSET) * DEPTH_MAP_SIZE, 0, 1)``
+and writes it as an 8-bit PNG: 0 is near, 255 is far and the background.
+The float output (``*.npy``) holds ``d`` itself. ``read_depth_image`` maps it in the same way but without the
+8-bit quantization, so the processing code sees the same 0-255 scale for both. This holds only if the PNG is saved
+without a view transform (``scene.view_settings.view_transform = "Raw"``); ``depth_image_error`` checks it.
+
+A depth pack (``<model>/rendering/depth_pack.npy`` and ``depth_pack.json``) holds the float depth of every view of
+a model as one ``(V, H, W)`` array with the view IDs and viewports. One view is addressed as
+``.../depth_pack.npy#<view>`` and read by slicing the memory-mapped array (the last packs stay open).
+"""
+
+# Standard Library
+import functools
+import json
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+import PIL
+import PIL.Image
+
+# Local Library
+from .fileio import atomic_write
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_PathLike = t.Union[str, Path]
+
+# CompositorNodeMapValue of the depth branch (chosen kind of arbitrarily for the ShapeNet cameras)
+DEPTH_MAP_OFFSET: float = -0.7
+DEPTH_MAP_SIZE: float = 1.4
+DEPTH_IMAGE_BACKGROUND: int = 255
+# the 8-bit quantization (0.5) and a float16 raw depth; a view transform bends the PNG far more
+DEPTH_IMAGE_TOLERANCE: float = 1.0
+
+DEPTH_PACK_NAME: str = "depth_pack.npy"  # the index is "depth_pack.json"
+
+
+def depth_to_image(depth: npt.NDArray[npt.Shape["*, *"], npt.Float]) -> npt.NDArray[npt.Shape["*, *"], npt.Float]:
+    """linear depth -> the 0-255 scale of the PNG depth images (float, not quantized)"""
+    depth = np.asarray(depth, dtype=np.float64)
+    depth = np.where(np.isnan(depth), np.inf, depth)  # no hit is background
+    value = np.clip((depth + DEPTH_MAP_OFFSET) * DEPTH_MAP_SIZE, 0.0, 1.0)
+    return t.cast(npt.NDArray[npt.Shape["*, *"], npt.Float], DEPTH_IMAGE_BACKGROUND * value)
+
+
+def depth_image_error(
+    image: npt.NDArray[npt.Shape["*, *"], npt.Number],
+    depth: npt.NDArray[npt.Shape["*, *"], npt.Float],
+) -> float:
+    """the largest difference between a PNG depth image and ``depth_to_image`` of the raw depth of the same render
+
+    At most ``DEPTH_IMAGE_TOLERANCE`` if both decode to the same depth.
+    """
+    if np.shape(image) != np.shape(depth):
+        raise ValueError(f"{np.shape(image)=} {np.shape(depth)=} not supported!")
+    return float(np.abs(np.asarray(image, dtype=np.float64) - depth_to_image(depth)).max(initial=0.0))
+
+
+@dataclass
+class DepthPack:
+    depth: npt.NDArray[npt.Shape["*, *, *"], npt.Float]  # (V, H, W) linear depth (memory-mapped when loaded)
+    views: t.List[str]  # "00", "01", ...
+    viewports: t.List[t.List[float]]  # azimuth, elevation, yaw, distance_ratio, fov (rendering_metadata.txt)
+
+    def __getitem__(self, view: str) -> npt.NDArray[npt.Shape["*, *"], npt.Float]:
+        return t.cast(npt.NDArray[npt.Shape["*, *"], npt.Float], self.depth[self.views.index(view)])
+
+    @staticmethod
+    def index_path(filepath: _PathLike) -> Path:
+        return Path(filepath).with_suffix(".json")
+
+    def save(self, filepath: _PathLike) -> None:
+        """write the index and then the array, each atomically"""
+        filepath = Path(filepath)
+        if len(self.views) != len(self.depth) or len(self.viewports) != len(self.depth):
+            raise ValueError(f"{len(self.depth)=} {len(self.views)=} {len(self.viewports)=} not supported!")
+        index: t.Dict[str, t.Any] = {"views": self.views, "viewports": self.viewports}
+        with atomic_write(self.index_path(filepath)) as f:
+            f.write(json.dumps(index).encode("utf-8"))
+        with atomic_write(filepath) as f:
+            np.save(f, np.ascontiguousarray(self.depth))
+
+    @classmethod
+    def load(cls, filepath: _PathLike) -> "DepthPack":
+        index: t.Dict[str, t.Any] = json.loads(cls.index_path(filepath).read_text())
+        depth = np.load(filepath, mmap_mode="r")
+        if len(index["views"]) != len(depth):
+            raise ValueError(f"{filepath}: {len(depth)=} {len(index['views'])=} not supported!")
+        return cls(depth=depth, views=index["views"], viewports=index["viewports"])
+
+
+@dataclass
+class DepthView:
+    view: str  # "00", "01", ...
+    depth_image_path: Path
+    viewport: t.Optional[t.List[float]] = None  # azimuth, elevation, yaw, distance_ratio, fov
+
+
+def model_depth_views(
+    model_dir: _PathLike,
+    depth_format: str = "png",
+    metadata_filepath: t.Optional[_PathLike] = None,
+) -> t.List[DepthView]:
+    """the depth images of every view of a model (``<category>/<model>/rendering``)
+
+    The viewports are read from the depth pack, or from ``metadata_filepath``
+    (default: ``rendering_metadata.txt`` in ``model_dir`` if it exists) whose line ``i`` is the view ``f"{i:02d}"``.
+
+    Args:
+        depth_format (str): "png", "npy" (``<view>_depth0001.<ext>``) or "pack" (``depth_pack.npy``)
+    """
+    model_dir = Path(model_dir)
+    if depth_format == "pack":
+        pack_path: Path = model_dir / DEPTH_PACK_NAME
+        index: t.Dict[str, t.Any] = json.loads(DepthPack.index_path(pack_path).read_text())
+        return [
+            DepthView(view, pack_path.with_name(f"{pack_path.name}#{view}"), viewport)
+            for view, viewport in zip(index["views"], index["viewports"])
+        ]
+    if depth_format not in ("png", "npy"):
+        raise ValueError(f"{depth_format=} not supported!")
+
+    metadata_filepath = (
+        Path(metadata_filepath) if metadata_filepath is not None else model_dir / "rendering_metadata.txt"
+    )
+    viewports: t.Dict[str, t.List[float]] = {}
+    if metadata_filepath.exists():
+        with open(metadata_filepath, mode="rt") as f:
+            i: int
+            line: str
+            for i, line in enumerate(f):  # same numbering as the renderer
+                line = line.rstrip()
+                if line:
+                    viewports[f"{i:02d}"] = list(map(float, line.split(" ")))
+    views: t.List[DepthView] = []
+    for filepath in sorted(model_dir.glob(f"*_depth0001.{depth_format}")):
+        if filepath.name.startswith("."):
+            continue
+        view: str = filepath.name.split("_depth", 1)[0]
+        views.append(DepthView(view, filepath, viewports.get(view)))
+    return views
+
+
+def split_depth_pack_path(filepath: _PathLike) -> t.Optional[t.Tuple[Path, str]]:
+    """ ".../depth_pack.npy#00" -> (".../depth_pack.npy", "00"), None for other paths"""
+    name: str = Path(filepath).name
+    if "#" not in name:
+        return None
+    pack_name, view = name.split("#", 1)
+    return Path(filepath).with_name(pack_name), view
+
+
+def depth_image_file(filepath: _PathLike) -> Path:
+    """the file that holds the depth image (the pack of a ``#<view>`` path)"""
+    pack_view = split_depth_pack_path(filepath)
+    return Path(filepath) if pack_view is None else pack_view[0]
+
+
+@functools.lru_cache(maxsize=8)
+def _load_depth_pack(filepath: str, mtime_ns: int) -> DepthPack:
+    return DepthPack.load(filepath)
+
+
+def read_depth_image(filepath: _PathLike) -> npt.NDArray[npt.Shape["*, *"], npt.Number]:
+    """the depth image on the 0-255 scale (background is 255)
+
+    Returns:
+        np.ndarray: uint8 for a PNG file, float64 for a raw depth ``.npy`` file or a view of a depth pack
+    """
+    pack_view = split_depth_pack_path(filepath)
+    if pack_view is not None:
+        pack_path, view = pack_view
+        return depth_to_image(_load_depth_pack(str(pack_path), pack_path.stat().st_mtime_ns)[view])
+    filepath = Path(filepath)
+    if filepath.suffix == ".npy":
+        return depth_to_image(np.load(filepath))
+    return np.array(PIL.Image.open(filepath))
@@ -0,0 +1,40 @@
+# Standard Library
+import contextlib
+import os
+import tempfile
+import typing as t
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_PathLike = t.Union[str, Path]
+
+
+@contextlib.contextmanager
+def atomic_write(filepath: _PathLike, overwrite: bool = True) -> t.Iterator[t.BinaryIO]:
+    """write ``filepath`` through a temporary file in the same directory, moved into place if the block succeeds
+
+    The file is made readable by everyone (0644; ``mkstemp`` creates 0600), since the outputs and the caches are
+    shared with other accounts.
+
+    Args:
+        overwrite (bool): replace an existing file. If False, an existing file is kept (the first writer wins).
+    """
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode="wb") as f:
+            yield f
+        os.chmod(tmp_path, 0o644)
+        if overwrite:
+            os.replace(tmp_path, filepath)
+        else:
+            with contextlib.suppress(FileExistsError):  # another writer was faster
+                os.link(tmp_path, filepath)
+    finally:
+        with contextlib.suppress(FileNotFoundError):  # moved into place
+            os.unlink(tmp_path)
@@ -0,0 +1,375 @@
+# Standard Library
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+# mathutils.geometry.intersect_line_plane rejects lines with |dot(u, n)| <= FLT_EPSILON
+FLT_EPSILON: float = float(np.finfo(np.float32).eps)
+
+
+def intersect_lines_planes(
+    line_a: npt.NDArray[npt.Shape["*, ..."], npt.Float],
+    line_b: npt.NDArray[npt.Shape["*, ..."], npt.Float],
+    plane_co: npt.NDArray[npt.Shape["*, ..."], npt.Float],
+    plane_no: npt.NDArray[npt.Shape["*, ..."], npt.Float],
+) -> t.Tuple[npt.NDArray[npt.Shape["*, ..."], npt.Float], npt.NDArray[npt.Shape["*, ..."], npt.Bool]]:
+    """Batched version of ``mathutils.geometry.intersect_line_plane``
+
+    All inputs are ``(..., 3)`` arrays and are broadcast against each other.
+
+    Returns:
+        (np.ndarray, np.ndarray):
+            intersection points ``(..., 3)`` and a validity mask ``(...)``.
+            Invalid entries (the line is parallel to the plane) contain ``nan``.
+    """
+    u = line_b - line_a
+    dot = np.einsum("...i,...i->...", plane_no, u)
+    valid = np.abs(dot) > FLT_EPSILON
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lam = -np.einsum("...i,...i->...", plane_no, line_a - plane_co) / np.where(valid, dot, np.nan)
+    return line_a + u * lam[..., np.newaxis], valid
+
+
+def plane_basis(
+    normal: npt.NDArray[npt.Shape["3"], npt.Float],
+) -> t.Tuple[npt.NDArray[npt.Shape["3"], npt.Float], npt.NDArray[npt.Shape["3"], npt.Float]]:
+    """two unit vectors ``(u, v)`` which make a right-handed orthonormal basis ``(u, v, n)`` with the normal"""
+    normal = np.asarray(normal, dtype=np.float64)
+    length = float(np.linalg.norm(normal))
+    if not length > 0.0:
+        raise ValueError(f"{normal=} not supported!")
+    normal = normal / length
+    # the coordinate axis most perpendicular to the normal
+    u = np.cross(normal, np.eye(3)[int(np.argmin(np.abs(normal)))])
+    u /= np.linalg.norm(u)
+    return u, np.cross(normal, u)
+
+
+def sample_points_on_plane(
+    point: npt.NDArray[npt.Shape["3"], npt.Float],
+    normal: npt.NDArray[npt.Shape["3"], npt.Float],
+    num_samples: int,
+    half_size: t.Optional[float] = None,
+    rng: t.Union[None, int, np.random.Generator] = None,
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """Random points on the plane through ``point`` with ``normal``
+
+    Args:
+        half_size (float, optional): sample uniformly in the square of ``2 * half_size`` around ``point`` on the plane.
+            If None, points in the unit cube ``[0, 1)^3`` are projected onto the plane (``utils.sampling_on_plane``).
+        rng (int or np.random.Generator, optional): seed or generator (``np.random.default_rng``)
+
+    Returns:
+        np.ndarray: ``(num_samples, 3)``
+    """
+    point = np.asarray(point, dtype=np.float64)
+    normal = np.asarray(normal, dtype=np.float64)
+    u, v = plane_basis(normal)  # also rejects a zero normal
+    rng = np.random.default_rng(rng)
+    if half_size is not None:
+        uv = rng.uniform(-half_size, half_size, size=(num_samples, 2))
+        return point + uv[:, :1] * u + uv[:, 1:] * v
+    return project_points_on_plane(rng.random((num_samples, 3)), point, normal)
+
+
+def project_points_on_plane(
+    points: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    point: npt.NDArray[npt.Shape["3"], npt.Float],
+    normal: npt.NDArray[npt.Shape["3"], npt.Float],
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """orthogonal projection of ``points`` onto the plane through ``point`` with ``normal``"""
+    points = np.asarray(points, dtype=np.float64)
+    normal = np.asarray(normal, dtype=np.float64)
+    length = float(np.linalg.norm(normal))
+    if not length > 0.0:
+        raise ValueError(f"{normal=} not supported!")
+    unit = normal / length
+    distance = (points - np.asarray(point, dtype=np.float64)) @ unit
+    return t.cast(npt.NDArray[npt.Shape["*, 3"], npt.Float], points - distance[..., np.newaxis] * unit)
+
+
+def inside_polygon_angle_sum(
+    polygons: npt.NDArray[npt.Shape["*, *, 3"], npt.Float],
+    points: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    normals: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    edge_tolerance: float = 0.01,
+    angle_sum_threshold: float = 0.1,
+) -> npt.NDArray[npt.Shape["*"], npt.Bool]:
+    """Batched version of ``utils.whether_intersection_is_inside_polygon``
+
+    Args:
+        polygons (np.ndarray): ``(N, K, 3)`` vertices of N polygons with K vertices each.
+        points (np.ndarray): ``(N, 3)`` points to test, one per polygon.
+        normals (np.ndarray): ``(N, 3)`` normals deciding the sign of each angle.
+
+    Returns:
+        np.ndarray: ``(N,)`` True if the point is on an edge or inside the polygon.
+    """
+    tmp1 = polygons - points[:, np.newaxis, :]
+    tmp2 = np.roll(tmp1, shift=-1, axis=1)
+    len1 = np.linalg.norm(tmp1, axis=2)
+    len2 = np.linalg.norm(tmp2, axis=2)
+    len12 = np.linalg.norm(tmp2 - tmp1, axis=2)
+
+    # detect whether the intersection is on the edge
+    # (this also covers points lying on a vertex, where the angle is undefined)
+    on_edge = np.any(np.abs(len1 + len2 - len12) < edge_tolerance, axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos = np.einsum("nki,nki->nk", tmp1, tmp2) / (len1 * len2)
+    angle_degree = np.degrees(np.arccos(np.clip(np.nan_to_num(cos, nan=1.0), -1.0, 1.0)))
+    cross = np.cross(tmp1, tmp2)
+    sign = np.where(np.einsum("nki,ni->nk", cross, normals) < 0, -1.0, 1.0)
+    angle_sum = np.sum(sign * angle_degree, axis=1) / 360
+
+    return on_edge | (np.abs(angle_sum) >= angle_sum_threshold)
+
+
+def inside_polygon_edge_function(
+    polygons: npt.NDArray[npt.Shape["*, *, 3"], npt.Float],
+    points: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    normals: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    edge_tolerance: float = 1e-6,
+) -> t.Tuple[npt.NDArray[npt.Shape["*"], npt.Bool], npt.NDArray[npt.Shape["*"], npt.Bool]]:
+    """Point-in-polygon test with edge functions (no angles, no ``mathutils``)
+
+    The points and the polygons are projected onto the coordinate plane most perpendicular to the normal and
+    the winding number is counted with the sign of the edge function of every crossing edge, so non-convex
+    polygons work too. Unlike the angle-sum test, points outside the polygon are never inside.
+
+    Args:
+        polygons (np.ndarray): ``(N, K, 3)`` vertices of N polygons with K vertices each.
+        points (np.ndarray): ``(N, 3)`` points on the polygon planes, one per polygon.
+        normals (np.ndarray): ``(N, 3)`` polygon normals (only the dominant axis is used).
+        edge_tolerance (float): points closer to an edge (in 3D) are on the edge.
+
+    Returns:
+        (np.ndarray, np.ndarray): ``(N,)`` inside (including on the edge) and on the edge
+    """
+    edges = np.roll(polygons, shift=-1, axis=1) - polygons
+    offsets = points[:, np.newaxis, :] - polygons
+    squared_lengths = np.einsum("nki,nki->nk", edges, edges)
+    s = np.einsum("nki,nki->nk", offsets, edges) / np.where(squared_lengths > 0.0, squared_lengths, 1.0)
+    closest = offsets - np.clip(s, 0.0, 1.0)[..., np.newaxis] * edges  # from the nearest point of the edge
+    on_edge = np.any(np.einsum("nki,nki->nk", closest, closest) <= edge_tolerance**2, axis=1)
+
+    # (u, v): the two axes left after dropping the dominant axis of the normal
+    axis = np.argmax(np.abs(normals), axis=1)
+    u_axis, v_axis = ((axis + 1) % 3)[:, np.newaxis], ((axis + 2) % 3)[:, np.newaxis]
+    a_u, a_v = (np.take_along_axis(polygons, i[..., np.newaxis], axis=2)[..., 0] for i in (u_axis, v_axis))
+    e_u, e_v = (np.take_along_axis(edges, i[..., np.newaxis], axis=2)[..., 0] for i in (u_axis, v_axis))
+    p_u, p_v = np.take_along_axis(points, u_axis, axis=1), np.take_along_axis(points, v_axis, axis=1)
+    edge_function = e_u * (p_v - a_v) - e_v * (p_u - a_u)  # > 0: the point is left of the edge
+    upward = (a_v <= p_v) & (a_v + e_v > p_v)
+    downward = (a_v > p_v) & (a_v + e_v <= p_v)
+    winding = np.sum(upward & (edge_function > 0), axis=1) - np.sum(downward & (edge_function < 0), axis=1)
+    return (winding != 0) | on_edge, on_edge
+
+
+def polygon_normals(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    loop_vertices: npt.NDArray[npt.Shape["*"], npt.Int],
+    loop_start: npt.NDArray[npt.Shape["*"], npt.Int],
+    loop_total: npt.NDArray[npt.Shape["*"], npt.Int],
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """Unit polygon normals with Newell's method (same direction as ``bpy.types.MeshPolygon.normal``)"""
+    num_polygons: int = len(loop_start)
+    polygon_ids = np.repeat(np.arange(num_polygons), loop_total)
+    loop_offset = np.arange(len(loop_vertices)) - np.repeat(loop_start, loop_total)
+    next_loop = np.repeat(loop_start, loop_total) + (loop_offset + 1) % np.repeat(loop_total, loop_total)
+    v1 = vertices[loop_vertices]
+    v2 = vertices[loop_vertices[next_loop]]
+    terms = np.stack(
+        [
+            (v1[:, 1] - v2[:, 1]) * (v1[:, 2] + v2[:, 2]),
+            (v1[:, 2] - v2[:, 2]) * (v1[:, 0] + v2[:, 0]),
+            (v1[:, 0] - v2[:, 0]) * (v1[:, 1] + v2[:, 1]),
+        ],
+        axis=1,
+    )
+    normals = np.zeros((num_polygons, 3), dtype=np.float64)
+    np.add.at(normals, polygon_ids, terms)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return t.cast(npt.NDArray[npt.Shape["*, 3"], npt.Float], normals / np.where(lengths > 0.0, lengths, 1.0))
+
+
+@dataclass
+class MeshArrays:
+    """Polygon mesh flattened into arrays
+
+    Polygons are stored like ``bpy.types.Mesh``: the vertex indices of every polygon are concatenated
+    in ``loop_vertices`` and polygon ``i`` uses ``loop_vertices[loop_start[i] : loop_start[i] + loop_total[i]]``.
+
+    ``world_normals`` are the normals in the coordinates of ``vertices``.
+    ``local_normals`` are the normals before the object transform was applied. The angle-sum inside test
+    of the original intersection loop uses them, so they are kept to reproduce its results.
+    """
+
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+    loop_vertices: npt.NDArray[npt.Shape["*"], npt.Int]
+    loop_start: npt.NDArray[npt.Shape["*"], npt.Int]
+    loop_total: npt.NDArray[npt.Shape["*"], npt.Int]
+    world_normals: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+    local_normals: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+
+    @classmethod
+    def from_faces(
+        cls,
+        vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        faces: t.Union[npt.NDArray[npt.Shape["*, *"], npt.Int], t.Sequence[t.Sequence[int]]],
+    ) -> "MeshArrays":
+        """
+        Args:
+            vertices (np.ndarray): ``(N, 3)``
+            faces: ``(F, K)`` array of faces with the same size or a list of vertex index lists.
+        """
+        if isinstance(faces, np.ndarray) and faces.ndim == 2:
+            loop_total = np.full(len(faces), faces.shape[1], dtype=np.int64)
+            loop_vertices = faces.reshape(-1).astype(np.int64)
+        else:
+            loop_total = np.array([len(face) for face in faces], dtype=np.int64)
+            loop_vertices = np.fromiter(
+                (v for face in faces for v in face), dtype=np.int64, count=int(loop_total.sum())
+            )
+        loop_start = np.cumsum(loop_total) - loop_total
+        vertices = np.asarray(vertices, dtype=np.float64)
+        normals = polygon_normals(vertices, loop_vertices, loop_start, loop_total)
+        return cls(
+            vertices=vertices,
+            loop_vertices=loop_vertices,
+            loop_start=loop_start,
+            loop_total=loop_total,
+            world_normals=normals,
+            local_normals=normals.copy(),
+        )
+
+    @property
+    def num_polygons(self) -> int:
+        return len(self.loop_start)
+
+    def transformed(self, matrix: npt.NDArray[npt.Shape["4, 4"], npt.Float]) -> "MeshArrays":
+        """apply an object transform (``matrix_world``) to the vertices and the world normals"""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        return MeshArrays(
+            vertices=self.vertices @ matrix[:3, :3].T + matrix[:3, 3],
+            loop_vertices=self.loop_vertices,
+            loop_start=self.loop_start,
+            loop_total=self.loop_total,
+            world_normals=self.world_normals @ matrix[:3, :3].T,
+            local_normals=self.local_normals,
+        )
+
+
+# the neighbor cells after (0, 0, 0) in lexicographic order: every pair of adjacent cells is visited once
+_FORWARD_NEIGHBORS: t.List[t.Tuple[int, int, int]] = [
+    (dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1) if (dx, dy, dz) > (0, 0, 0)
+]
+
+
+def close_vertex_pairs(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    tolerance: float = 0.001,
+) -> npt.NDArray[npt.Shape["*, 2"], npt.Int]:
+    """Pairs ``(i, j)``, ``i < j``, of vertices closer than ``tolerance``
+
+    The vertices are hashed into a grid of ``tolerance`` cells and sorted by cell, so only the vertices of the same
+    cell and of the 13 forward neighbor cells are compared (roughly linear instead of all pairs).
+
+    Returns:
+        np.ndarray: ``(P, 2)`` sorted lexicographically
+    """
+    if tolerance <= 0.0:
+        raise ValueError(f"{tolerance=} not supported!")
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    if len(vertices) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+
+    cells = np.floor(vertices / tolerance).astype(np.int64)
+    cells -= cells.min(axis=0) - 1  # a margin of one cell, so that no neighbor key wraps around
+    dims = cells.max(axis=0) + 2
+    if float(np.prod(dims.astype(np.float64))) >= 2.0**62:
+        raise ValueError(f"{tolerance=} not supported for vertices spanning {np.ptp(vertices, axis=0)}!")
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    order = np.argsort(keys, kind="stable")
+    cell_keys, cell_start, cell_count = np.unique(keys[order], return_index=True, return_counts=True)
+
+    pairs: t.List[npt.NDArray[npt.Shape["*, 2"], npt.Int]] = []
+    for dx, dy, dz in [(0, 0, 0), *_FORWARD_NEIGHBORS]:
+        neighbor_keys = cell_keys + (dx * dims[1] + dy) * dims[2] + dz
+        pos = np.minimum(np.searchsorted(cell_keys, neighbor_keys), len(cell_keys) - 1)
+        cell_a = np.flatnonzero(cell_keys[pos] == neighbor_keys)
+        cell_b = pos[cell_a]
+        # every (vertex of cell a, vertex of cell b) pair
+        count_a, count_b = cell_count[cell_a], cell_count[cell_b]
+        num_pairs = count_a * count_b
+        pair_cell = np.repeat(np.arange(len(cell_a)), num_pairs)
+        k = np.arange(int(num_pairs.sum())) - np.repeat(np.cumsum(num_pairs) - num_pairs, num_pairs)
+        i = order[cell_start[cell_a][pair_cell] + k // count_b[pair_cell]]
+        j = order[cell_start[cell_b][pair_cell] + k % count_b[pair_cell]]
+        ok = np.linalg.norm(vertices[i] - vertices[j], axis=1) < tolerance
+        if (dx, dy, dz) == (0, 0, 0):
+            ok &= i < j
+        pairs.append(np.stack([np.minimum(i[ok], j[ok]), np.maximum(i[ok], j[ok])], axis=1))
+    result = np.concatenate(pairs)
+    return t.cast(npt.NDArray[npt.Shape["*, 2"], npt.Int], result[np.lexsort((result[:, 1], result[:, 0]))])
+
+
+def duplicate_vertex_map(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    tolerance: float = 0.001,
+) -> npt.NDArray[npt.Shape["*"], npt.Int]:
+    """the vertex every vertex is welded to: the smallest index of the vertices chained to it by ``close_vertex_pairs``"""
+    labels = np.arange(len(np.asarray(vertices).reshape(-1, 3)))
+    pairs = close_vertex_pairs(vertices, tolerance=tolerance)
+    i, j = pairs[:, 0], pairs[:, 1]
+    while len(pairs) > 0:  # propagate the minimum label over the pairs with pointer jumping
+        new_labels = labels.copy()
+        smaller = np.minimum(labels[i], labels[j])
+        np.minimum.at(new_labels, i, smaller)
+        np.minimum.at(new_labels, j, smaller)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return t.cast(npt.NDArray[npt.Shape["*"], npt.Int], labels)
+
+
+def weld_vertices(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    edges: t.Sequence[t.Sequence[int]] = (),
+    faces: t.Sequence[t.Sequence[int]] = (),
+    tolerance: float = 0.001,
+) -> t.Tuple[npt.NDArray[npt.Shape["*, 3"], npt.Float], t.List[t.Tuple[int, int]], t.List[t.List[int]]]:
+    """merge the vertices closer than ``tolerance`` (``duplicate_vertex_map``) and remap the edges and faces
+
+    Collapsed edges, repeated edges and faces left with fewer than 3 vertices are removed.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    targets = duplicate_vertex_map(vertices, tolerance=tolerance)
+    keep = targets == np.arange(len(vertices))
+    remap = (np.cumsum(keep) - 1)[targets].tolist()
+
+    new_edges: t.List[t.Tuple[int, int]] = []
+    seen: t.Set[t.Tuple[int, int]] = set()
+    for a, b in edges:
+        edge = (remap[a], remap[b])
+        key = (min(edge), max(edge))
+        if edge[0] != edge[1] and key not in seen:
+            seen.add(key)
+            new_edges.append(edge)
+
+    new_faces: t.List[t.List[int]] = []
+    for face in faces:
+        new_face: t.List[int] = [remap[v] for v in face]
+        new_face = [v for k, v in enumerate(new_face) if v != new_face[k - 1]]  # k - 1 wraps to the last vertex
+        if len(set(new_face)) >= 3:
+            new_faces.append(new_face)
+    return vertices[keep], new_edges, new_faces
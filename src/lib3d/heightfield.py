@@ -0,0 +1,230 @@
+# Standard Library
+import typing as t
+from dataclasses import dataclass
+from dataclasses import field
+from logging import NullHandler
+from logging import getLogger
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+# Local Library
+from . import profiling
+from .intersection import FarthestHits
+from .intersection import MaskFrame
+from .intersection import count_hits
+from .mold import MOLD_Z_MAX
+from .mold import mold_matrix_world
+from .mold import plane_lattice_heights
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+
+def build_min_max_pyramid(
+    heights: npt.NDArray[npt.Shape["*, *"], npt.Float],
+) -> t.List[t.Tuple[npt.NDArray[npt.Shape["*, *"], npt.Float], npt.NDArray[npt.Shape["*, *"], npt.Float]]]:
+    """min/max mip pyramid of the lattice cells
+
+    Level 0 holds the min/max height of every cell (2x2 lattice vertices) and level ``k`` the
+    min/max of ``2^k x 2^k`` cells. The last level is a single tile. Tiles outside the lattice
+    have ``min = +inf`` and ``max = -inf``.
+    """
+    corners = np.stack([heights[:-1, :-1], heights[1:, :-1], heights[:-1, 1:], heights[1:, 1:]])
+    z_min, z_max = corners.min(axis=0), corners.max(axis=0)
+    levels = [(z_min, z_max)]
+    while z_min.shape[0] > 1 or z_min.shape[1] > 1:
+        pad = ((0, z_min.shape[0] % 2), (0, z_min.shape[1] % 2))
+        z_min = np.pad(z_min, pad, constant_values=np.inf)
+        z_max = np.pad(z_max, pad, constant_values=-np.inf)
+        h, w = z_min.shape[0] // 2, z_min.shape[1] // 2
+        z_min = z_min.reshape(h, 2, w, 2).min(axis=(1, 3))
+        z_max = z_max.reshape(h, 2, w, 2).max(axis=(1, 3))
+        levels.append((z_min, z_max))
+    return levels
+
+
+@dataclass
+class HeightField:
+    """Mold surface ``z = heights[i, j]`` over the lattice ``(xs[i], ys[j])``, placed with ``matrix_world``
+
+    Each lattice cell is split into the triangles ``(i, j), (i+1, j), (i+1, j+1)`` and
+    ``(i, j), (i+1, j+1), (i, j+1)``.
+    """
+
+    xs: npt.NDArray[npt.Shape["*"], npt.Float]
+    ys: npt.NDArray[npt.Shape["*"], npt.Float]
+    heights: npt.NDArray[npt.Shape["*, *"], npt.Float]
+    matrix_world: npt.NDArray[npt.Shape["4, 4"], npt.Float]
+    pyramid: t.List[
+        t.Tuple[npt.NDArray[npt.Shape["*, *"], npt.Float], npt.NDArray[npt.Shape["*, *"], npt.Float]]
+    ] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.pyramid = build_min_max_pyramid(self.heights)
+
+    @classmethod
+    def from_depth_arr(
+        cls,
+        depth_arr: npt.NDArray[npt.Shape["*, *"], npt.Number],
+        z_max: float = MOLD_Z_MAX,
+        grid_resolution: t.Optional[int] = None,
+        matrix_world: t.Optional[npt.NDArray[npt.Shape["4, 4"], npt.Float]] = None,
+    ) -> "HeightField":
+        """
+        Args:
+            depth_arr (np.ndarray): same as ``load_obj.depth_map2plane``
+            grid_resolution (int, optional):
+                the number of cuts of ``load_obj.depth_map2plane``.
+                By default one lattice cell per pixel (the native image resolution).
+        """
+        im_h, im_w = depth_arr.shape[:2]
+        num_x, num_y = (im_h + 1, im_w + 1) if grid_resolution is None else (grid_resolution + 2,) * 2
+        xs, ys, heights = plane_lattice_heights(depth_arr, num_x=num_x, num_y=num_y, z_max=z_max)
+        return cls(
+            xs=xs,
+            ys=ys,
+            heights=heights,
+            matrix_world=mold_matrix_world() if matrix_world is None else np.asarray(matrix_world),
+        )
+
+    def world_vertices(self) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+        x, y = np.meshgrid(self.xs, self.ys, indexing="ij")
+        local = np.stack([x, y, self.heights], axis=-1).reshape(-1, 3)
+        return t.cast(
+            npt.NDArray[npt.Shape["*, 3"], npt.Float],
+            local @ self.matrix_world[:3, :3].T + self.matrix_world[:3, 3],
+        )
+
+    def bounding_box_yz(self) -> t.Tuple[float, float, float, float]:
+        """same as ``get_bounding_box_yz`` of the mold object: (y_min, z_min, y_max, z_max)"""
+        vertices = self.world_vertices()
+        y_min, z_min = vertices[:, 1:].min(axis=0)
+        y_max, z_max = vertices[:, 1:].max(axis=0)
+        return (float(y_min), float(z_min), float(y_max), float(z_max))
+
+    def _tile_boxes(
+        self, level: int, ti: npt.NDArray[npt.Shape["*"], npt.Int], tj: npt.NDArray[npt.Shape["*"], npt.Int]
+    ) -> t.Tuple[npt.NDArray[npt.Shape["*, 3"], npt.Float], npt.NDArray[npt.Shape["*, 3"], npt.Float]]:
+        num_cells_x, num_cells_y = len(self.xs) - 1, len(self.ys) - 1
+        size = 1 << level
+        z_min, z_max = self.pyramid[level]
+        box_min = np.stack([self.xs[ti * size], self.ys[tj * size], z_min[ti, tj]], axis=1)
+        box_max = np.stack(
+            [
+                self.xs[np.minimum((ti + 1) * size, num_cells_x)],
+                self.ys[np.minimum((tj + 1) * size, num_cells_y)],
+                z_max[ti, tj],
+            ],
+            axis=1,
+        )
+        return box_min, box_max
+
+    def _candidate_cells(
+        self,
+        origin: npt.NDArray[npt.Shape["3"], npt.Float],
+        directions: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    ) -> t.Tuple[
+        npt.NDArray[npt.Shape["*"], npt.Int], npt.NDArray[npt.Shape["*"], npt.Int], npt.NDArray[npt.Shape["*"], npt.Int]
+    ]:
+        """(ray, i, j) of the cells whose min/max box is crossed by the ray (local coordinates)
+
+        The pyramid is traversed from the top; a tile whose box is missed is skipped with all its cells.
+        """
+        directions = np.where(np.abs(directions) < 1e-30, np.copysign(1e-30, directions), directions)
+        inv = 1.0 / directions
+        top = len(self.pyramid) - 1
+        ray_ids = np.arange(len(directions), dtype=np.int64)
+        ti = np.zeros(len(directions), dtype=np.int64)
+        tj = np.zeros(len(directions), dtype=np.int64)
+        for level in range(top, -1, -1):
+            z_min, _ = self.pyramid[level]
+            # drop the padding tiles
+            inside = (ti < z_min.shape[0]) & (tj < z_min.shape[1])
+            ray_ids, ti, tj = ray_ids[inside], ti[inside], tj[inside]
+
+            box_min, box_max = self._tile_boxes(level, ti, tj)
+            with np.errstate(invalid="ignore"):
+                t1 = (box_min - origin) * inv[ray_ids]
+                t2 = (box_max - origin) * inv[ray_ids]
+                t_near = np.minimum(t1, t2).max(axis=1)
+                t_far = np.maximum(t1, t2).min(axis=1)
+                hit = (t_near <= t_far) & (t_far >= 0.0)
+            ray_ids, ti, tj = ray_ids[hit], ti[hit], tj[hit]
+            if level == 0:
+                break
+            # 4 children
+            ray_ids = np.tile(ray_ids, 4)
+            ti = np.concatenate([2 * ti, 2 * ti + 1, 2 * ti, 2 * ti + 1])
+            tj = np.concatenate([2 * tj, 2 * tj, 2 * tj + 1, 2 * tj + 1])
+        return ray_ids, ti, tj
+
+    def find_farthest_intersections(
+        self,
+        targets: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        mask_frame: MaskFrame,
+        chunk_size: int = 1 << 18,
+        eps: float = 1e-9,
+    ) -> FarthestHits:
+        """Farthest intersection of the rays from the origin through ``targets`` (world coordinates)
+
+        Same filters as ``intersection.find_farthest_intersections``; the inside test is an exact
+        ray/triangle test (``eps`` is the tolerance of the barycentric coordinates).
+        ``FarthestHits.polygon_ids`` is ``2 * (i * (len(ys) - 1) + j) + k`` for the k-th triangle of cell (i, j).
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        num_rays: int = len(targets)
+        hits = FarthestHits.empty(num_rays)
+        inverted = np.linalg.inv(self.matrix_world)
+        origin = inverted[:3, 3]
+        num_cells_y = len(self.ys) - 1
+
+        rays_per_chunk: int = max(1, chunk_size // 64)
+        for ray_start in range(0, num_rays, rays_per_chunk):
+            chunk_rays = np.arange(ray_start, min(ray_start + rays_per_chunk, num_rays))
+            directions = targets[chunk_rays] @ inverted[:3, :3].T
+            ray_ids, ci, cj = self._candidate_cells(origin, directions)
+
+            p00 = np.stack([self.xs[ci], self.ys[cj], self.heights[ci, cj]], axis=1)
+            p10 = np.stack([self.xs[ci + 1], self.ys[cj], self.heights[ci + 1, cj]], axis=1)
+            p11 = np.stack([self.xs[ci + 1], self.ys[cj + 1], self.heights[ci + 1, cj + 1]], axis=1)
+            p01 = np.stack([self.xs[ci], self.ys[cj + 1], self.heights[ci, cj + 1]], axis=1)
+            cell_ids = ci * num_cells_y + cj
+            profiling.count("polygons_tested", 2 * len(ray_ids))
+            for k, (v0, v1, v2) in enumerate(((p00, p10, p11), (p00, p11, p01))):
+                ray_t, ok = intersect_rays_triangles(origin, directions[ray_ids], v0, v1, v2, eps=eps)
+                ok &= ray_t >= 0.0
+                points = targets[chunk_rays[ray_ids[ok]]] * ray_t[ok, np.newaxis]
+                passed = mask_frame.lookup(points)
+                hits.update(chunk_rays[ray_ids[ok]][passed], 2 * cell_ids[ok][passed] + k, points[passed])
+        count_hits(hits)
+        return hits
+
+
+def intersect_rays_triangles(
+    origins: npt.NDArray[npt.Shape["*, ..."], npt.Float],
+    directions: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    v0: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    v1: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    v2: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    eps: float = 1e-9,
+) -> t.Tuple[npt.NDArray[npt.Shape["*"], npt.Float], npt.NDArray[npt.Shape["*"], npt.Bool]]:
+    """Möller–Trumbore line/triangle intersection, one triangle per ray
+
+    Returns:
+        (np.ndarray, np.ndarray): the line parameter ``t`` and whether the line crosses the triangle
+    """
+    edge1 = v1 - v0
+    edge2 = v2 - v0
+    p = np.cross(directions, edge2)
+    det = np.einsum("ni,ni->n", edge1, p)
+    valid = np.abs(det) > 1e-15
+    inv_det = 1.0 / np.where(valid, det, 1.0)
+    s = origins - v0
+    u = np.einsum("ni,ni->n", s, p) * inv_det
+    q = np.cross(s, edge1)
+    v = np.einsum("ni,ni->n", directions, q) * inv_det
+    ray_t = np.einsum("ni,ni->n", edge2, q) * inv_det
+    inside = valid & (u >= -eps) & (v >= -eps) & (u + v <= 1.0 + eps)
+    return ray_t, inside
@@ -0,0 +1,371 @@
+# Standard Library
+import functools
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+# Local Library
+from . import profiling
+from .bvh import BVH
+from .geometry import MeshArrays
+from .geometry import inside_polygon_angle_sum
+from .geometry import inside_polygon_edge_function
+from .geometry import intersect_lines_planes
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+
+@dataclass
+class MaskFrame:
+    """0/1 mask image placed on the y-z plane
+
+    The image covers ``[y_min - 1, y_max] x [z_min - 1, z_max]`` and only points inside
+    ``[y_min, y_max] x [z_min, z_max]`` are looked up (see ``move_mesh_vertices_with_mask``).
+    """
+
+    mask_array: npt.NDArray[npt.Shape["*, *"], npt.Int]
+    y_min: float
+    z_min: float
+    y_max: float
+    z_max: float
+
+    def pixel_coords(
+        self, points: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+    ) -> t.Tuple[npt.NDArray[npt.Shape["*"], npt.Int], npt.NDArray[npt.Shape["*"], npt.Int]]:
+        """(h, w) pixel indices of points inside the bounding box"""
+        im_height, im_width = self.mask_array.shape[:2]
+        w_rate = 1 - (points[:, 1] - (self.y_min - 1)) / (self.y_max - (self.y_min - 1))
+        h_rate = 1 - (points[:, 2] - (self.z_min - 1)) / (self.z_max - (self.z_min - 1))
+        w = np.clip((im_width * w_rate).astype(np.int64), 0, im_width - 1)
+        h = np.clip((im_height * h_rate).astype(np.int64), 0, im_height - 1)
+        return h, w
+
+    def in_bounding_box(
+        self, points: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+    ) -> npt.NDArray[npt.Shape["*"], npt.Bool]:
+        y = points[:, 1]
+        z = points[:, 2]
+        # comparisons with nan are False, so invalid intersections are rejected here
+        return t.cast(
+            npt.NDArray[npt.Shape["*"], npt.Bool],
+            (y >= self.y_min) & (y <= self.y_max) & (z >= self.z_min) & (z <= self.z_max),
+        )
+
+    def lookup(self, points: npt.NDArray[npt.Shape["*, 3"], npt.Float]) -> npt.NDArray[npt.Shape["*"], npt.Bool]:
+        """True if the point is inside the bounding box and on the foreground"""
+        result = self.in_bounding_box(points)
+        idx = np.flatnonzero(result)
+        h, w = self.pixel_coords(points[idx])
+        result[idx] = self.mask_array[h, w] != 0
+        return result
+
+    @functools.cached_property
+    def _summed_area(self) -> npt.NDArray[npt.Shape["*, *"], npt.Int]:
+        """``[h, w]``: the number of foreground pixels in ``mask_array[:h, :w]``"""
+        table = np.zeros((self.mask_array.shape[0] + 1, self.mask_array.shape[1] + 1), dtype=np.int64)
+        table[1:, 1:] = np.cumsum(np.cumsum(self.mask_array != 0, axis=0), axis=1)
+        return table
+
+    def boxes_on_foreground(
+        self,
+        box_min: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        box_max: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    ) -> npt.NDArray[npt.Shape["*"], npt.Bool]:
+        """False if ``lookup`` is False for every point of the box (tested in bulk, before any intersection)
+
+        The box is clipped to the bounding box and the foreground pixels of the pixel rectangle it covers are
+        counted with a summed-area table. ``pixel_coords`` is monotonic, so the corners give the rectangle.
+        """
+        lower = np.maximum(box_min, [-np.inf, self.y_min, self.z_min])
+        upper = np.minimum(box_max, [np.inf, self.y_max, self.z_max])
+        result = (lower[:, 1] <= upper[:, 1]) & (lower[:, 2] <= upper[:, 2])
+        idx = np.flatnonzero(result)
+        h_first, w_first = self.pixel_coords(upper[idx])  # pixel coordinates decrease with y and z
+        h_last, w_last = self.pixel_coords(lower[idx])
+        table = self._summed_area
+        count = (
+            table[h_last + 1, w_last + 1]
+            - table[h_first, w_last + 1]
+            - table[h_last + 1, w_first]
+            + table[h_first, w_first]
+        )
+        result[idx] = count > 0
+        return result
+
+
+@dataclass
+class FarthestHits:
+    points: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+    lengths: npt.NDArray[npt.Shape["*"], npt.Float]
+    polygon_ids: npt.NDArray[npt.Shape["*"], npt.Int]
+
+    @classmethod
+    def empty(cls, num_rays: int) -> "FarthestHits":
+        return cls(
+            points=np.zeros((num_rays, 3), dtype=np.float64),
+            lengths=np.zeros(num_rays, dtype=np.float64),
+            polygon_ids=np.full(num_rays, np.iinfo(np.int64).max, dtype=np.int64),
+        )
+
+    @property
+    def found(self) -> npt.NDArray[npt.Shape["*"], npt.Bool]:
+        return t.cast(npt.NDArray[npt.Shape["*"], npt.Bool], self.lengths > 0.0)
+
+    def update(
+        self,
+        ray_ids: npt.NDArray[npt.Shape["*"], npt.Int],
+        polygon_ids: npt.NDArray[npt.Shape["*"], npt.Int],
+        points: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    ) -> None:
+        """keep the farthest point per ray (the smallest polygon id wins a tie, like the original loop)"""
+        if len(ray_ids) == 0:
+            return
+        lengths = np.linalg.norm(points, axis=1)
+        order = np.lexsort((polygon_ids, -lengths, ray_ids))
+        _, first = np.unique(ray_ids[order], return_index=True)
+        best = order[first]
+        ray_ids, polygon_ids, points, lengths = ray_ids[best], polygon_ids[best], points[best], lengths[best]
+
+        better = (lengths > self.lengths[ray_ids]) | (
+            (lengths == self.lengths[ray_ids]) & (polygon_ids < self.polygon_ids[ray_ids])
+        )
+        better &= lengths > 0.0
+        ray_ids = ray_ids[better]
+        self.points[ray_ids] = points[better]
+        self.lengths[ray_ids] = lengths[better]
+        self.polygon_ids[ray_ids] = polygon_ids[better]
+
+
+def count_hits(hits: FarthestHits) -> None:
+    """``profiling`` counters of one search: rays cast and rays with a hit"""
+    profiling.count("rays", len(hits.lengths))
+    profiling.count("hits", int(np.count_nonzero(hits.found)))
+
+
+def check_candidates(
+    targets: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    mesh: MeshArrays,
+    mask_frame: MaskFrame,
+    ray_ids: npt.NDArray[npt.Shape["*"], npt.Int],
+    polygon_ids: npt.NDArray[npt.Shape["*"], npt.Int],
+    hits: FarthestHits,
+    inside_test: str = "angle_sum",
+) -> int:
+    """run the exact test of ``move_mesh_vertices_with_mask`` on (ray, polygon) pairs and update ``hits``
+
+    Args:
+        inside_test (str): "angle_sum" (``inside_polygon_angle_sum``, the test of the original loop)
+            or "edge_function" (``inside_polygon_edge_function``)
+
+    Returns:
+        int: the number of pairs that passed every test
+    """
+    if inside_test not in ("angle_sum", "edge_function"):
+        raise ValueError(f"{inside_test=} not supported!")
+    if len(ray_ids) == 0:
+        return 0
+    profiling.count("polygons_tested", len(ray_ids))
+    first_vertex = mesh.vertices[mesh.loop_vertices[mesh.loop_start[polygon_ids]]]
+    ray_targets = targets[ray_ids]
+    points, valid = intersect_lines_planes(
+        np.zeros(3, dtype=np.float64), ray_targets, first_vertex, mesh.world_normals[polygon_ids]
+    )
+    ok = valid & mask_frame.lookup(points)
+    # 中心から見て同じ方向にあるかどうか
+    ok[ok] = np.einsum("ni,ni->n", ray_targets[ok], points[ok]) >= 0
+    ray_ids, polygon_ids, points = ray_ids[ok], polygon_ids[ok], points[ok]
+
+    num_passed: int = 0
+    for size in np.unique(mesh.loop_total[polygon_ids]):
+        group = np.flatnonzero(mesh.loop_total[polygon_ids] == size)
+        loops = mesh.loop_start[polygon_ids[group], np.newaxis] + np.arange(size)
+        polygons = mesh.vertices[mesh.loop_vertices[loops]]
+        if inside_test == "edge_function":
+            inside, _ = inside_polygon_edge_function(polygons, points[group], mesh.world_normals[polygon_ids[group]])
+        else:
+            inside = inside_polygon_angle_sum(polygons, points[group], mesh.local_normals[polygon_ids[group]])
+        group = group[inside]
+        hits.update(ray_ids[group], polygon_ids[group], points[group])
+        num_passed += len(group)
+    return num_passed
+
+
+def find_farthest_intersections(
+    targets: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    mesh: MeshArrays,
+    mask_frame: MaskFrame,
+    chunk_size: int = 1 << 18,
+    inside_test: str = "angle_sum",
+) -> FarthestHits:
+    """Vectorized ``move_mesh_vertices_with_mask``
+
+    A ray is cast from the origin through every target point. For every ray, the farthest intersection
+    with a polygon of ``mesh`` which passes the mask filter and is on the same side as the target is found.
+    Polygons whose bounds cover no foreground pixel are rejected before the rays are tested.
+
+    Args:
+        targets (np.ndarray): ``(V, 3)`` template vertices in world coordinates.
+        mesh (MeshArrays): mold mesh in world coordinates.
+        mask_frame (MaskFrame): mask filter.
+        chunk_size (int): the maximum number of (ray, polygon) pairs processed at once.
+        inside_test (str): point-in-polygon test (``check_candidates``).
+    """
+    targets = np.asarray(targets, dtype=np.float64)
+    num_rays: int = len(targets)
+    hits = FarthestHits.empty(num_rays)
+    num_polygons: int = mesh.num_polygons
+    if num_rays == 0 or num_polygons == 0:
+        return hits
+
+    candidates = polygons_on_foreground(mesh, mask_frame)
+    num_polygons = len(candidates)
+    if num_polygons == 0:
+        count_hits(hits)
+        return hits
+
+    rays_per_chunk: int = max(1, chunk_size // num_polygons)
+    polygons_per_chunk: int = min(num_polygons, chunk_size)
+    for ray_start in range(0, num_rays, rays_per_chunk):
+        chunk_rays = np.arange(ray_start, min(ray_start + rays_per_chunk, num_rays))
+        for polygon_start in range(0, num_polygons, polygons_per_chunk):
+            chunk_polygons = candidates[polygon_start : polygon_start + polygons_per_chunk]
+            ray_ids = np.repeat(chunk_rays, len(chunk_polygons))
+            polygon_ids = np.tile(chunk_polygons, len(chunk_rays))
+            check_candidates(targets, mesh, mask_frame, ray_ids, polygon_ids, hits, inside_test=inside_test)
+    count_hits(hits)
+    return hits
+
+
+def polygon_bounds(
+    mesh: MeshArrays,
+    edge_tolerance: float = 0.01,
+    angle_sum_threshold: float = 0.1,
+) -> t.Tuple[npt.NDArray[npt.Shape["*, 3"], npt.Float], npt.NDArray[npt.Shape["*, 3"], npt.Float]]:
+    """Boxes containing every point the inside test of ``check_candidates`` can accept
+
+    The boxes are made for the angle-sum test. The edge-function test accepts only points within its (much smaller)
+    edge tolerance of the polygon, so they hold for it too.
+
+    The box of a polygon is expanded by the larger of
+    - the semi-minor axis of the on-edge ellipse (``len1 + len2 < len12 + edge_tolerance``)
+    - the distance at which the polygon subtends half of the angle-sum threshold.
+      The sum of the absolute angles seen from a point outside a convex polygon is twice the angle
+      the polygon subtends, so farther points can not reach the threshold whatever the signs are.
+
+    Returns:
+        (np.ndarray, np.ndarray): ``(P, 3)`` box minimum and maximum
+    """
+    polygon_ids = np.repeat(np.arange(mesh.num_polygons), mesh.loop_total)
+    offsets = np.arange(len(polygon_ids)) - np.repeat(np.cumsum(mesh.loop_total) - mesh.loop_total, mesh.loop_total)
+    coords = mesh.vertices[mesh.loop_vertices[np.repeat(mesh.loop_start, mesh.loop_total) + offsets]]
+    segment_start = np.cumsum(mesh.loop_total) - mesh.loop_total
+    box_min = np.minimum.reduceat(coords, segment_start, axis=0)
+    box_max = np.maximum.reduceat(coords, segment_start, axis=0)
+
+    diameter = np.linalg.norm(box_max - box_min, axis=1)
+    edge_margin = np.sqrt(((diameter + edge_tolerance) / 2) ** 2 - (diameter / 2) ** 2)
+    half_angle = np.radians(angle_sum_threshold * 360 / 4)
+    angle_margin = diameter / (2 * np.sin(half_angle))
+    # a little extra room for rounding errors
+    margin = (np.maximum(edge_margin, angle_margin) * 1.01 + 1e-6)[:, np.newaxis]
+    return box_min - margin, box_max + margin
+
+
+def polygons_on_foreground(mesh: MeshArrays, mask_frame: MaskFrame) -> npt.NDArray[npt.Shape["*"], npt.Int]:
+    """ids of the polygons which can have a hit that passes the mask filter (``MaskFrame.boxes_on_foreground``)"""
+    keep = mask_frame.boxes_on_foreground(*polygon_bounds(mesh))
+    profiling.count("polygons_rejected", int(len(keep) - np.count_nonzero(keep)))
+    return np.flatnonzero(keep)
+
+
+def build_polygon_bvh(mesh: MeshArrays, leaf_size: int = 8) -> BVH:
+    box_min, box_max = polygon_bounds(mesh)
+    return BVH.build(box_min, box_max, leaf_size=leaf_size)
+
+
+def find_farthest_intersections_bvh(
+    targets: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    mesh: MeshArrays,
+    mask_frame: MaskFrame,
+    bvh: t.Optional[BVH] = None,
+    chunk_size: int = 1 << 18,
+    inside_test: str = "angle_sum",
+) -> FarthestHits:
+    """``find_farthest_intersections`` which tests only the polygons whose bounds the ray crosses
+
+    Args:
+        bvh (BVH, optional): ``build_polygon_bvh(mesh)``. Built here if it is not given.
+        chunk_size (int): the number of rays traversed at once is ``chunk_size // 64``.
+    """
+    targets = np.asarray(targets, dtype=np.float64)
+    num_rays: int = len(targets)
+    hits = FarthestHits.empty(num_rays)
+    if num_rays == 0 or mesh.num_polygons == 0:
+        return hits
+    if bvh is None:
+        bvh = build_polygon_bvh(mesh)
+    keep = np.zeros(mesh.num_polygons, dtype=bool)
+    keep[polygons_on_foreground(mesh, mask_frame)] = True
+
+    rays_per_chunk: int = max(1, chunk_size // 64)
+    for ray_start in range(0, num_rays, rays_per_chunk):
+        chunk_rays = np.arange(ray_start, min(ray_start + rays_per_chunk, num_rays))
+        ray_ids, polygon_ids = bvh.query_rays(np.zeros(3), targets[chunk_rays])
+        ok = keep[polygon_ids]
+        check_candidates(
+            targets, mesh, mask_frame, chunk_rays[ray_ids[ok]], polygon_ids[ok], hits, inside_test=inside_test
+        )
+    count_hits(hits)
+    return hits
+
+
+def find_farthest_intersections_near(
+    targets: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    mesh: MeshArrays,
+    mask_frame: MaskFrame,
+    box_min: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    box_max: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    bvh: t.Optional[BVH] = None,
+    chunk_size: int = 1 << 18,
+    inside_test: str = "angle_sum",
+) -> FarthestHits:
+    """``find_farthest_intersections`` which tests only the polygons whose bounds the ray crosses inside its box
+
+    The boxes are the neighborhoods of the coarse-to-fine search (``lib3d.multires``). Rays whose box covers
+    no foreground pixel are not tested at all.
+
+    Args:
+        box_min (np.ndarray): ``(V, 3)`` box of the ray through ``targets[i]``
+        bvh (BVH, optional): ``build_polygon_bvh(mesh)``. Built here if it is not given.
+        chunk_size (int): the number of rays queried at once is ``chunk_size // 64``.
+    """
+    targets = np.asarray(targets, dtype=np.float64)
+    num_rays: int = len(targets)
+    hits = FarthestHits.empty(num_rays)
+    if num_rays == 0 or mesh.num_polygons == 0:
+        return hits
+    if bvh is None:
+        bvh = build_polygon_bvh(mesh)
+    keep = np.zeros(mesh.num_polygons, dtype=bool)
+    keep[polygons_on_foreground(mesh, mask_frame)] = True
+    rays = np.flatnonzero(mask_frame.boxes_on_foreground(box_min, box_max))
+    profiling.count("rays_rejected", num_rays - len(rays))
+
+    rays_per_chunk: int = max(1, chunk_size // 64)
+    for ray_start in range(0, len(rays), rays_per_chunk):
+        chunk_rays = rays[ray_start : ray_start + rays_per_chunk]
+        ray_ids, polygon_ids = bvh.query_rays_in_boxes(
+            np.zeros(3), targets[chunk_rays], box_min[chunk_rays], box_max[chunk_rays]
+        )
+        ok = keep[polygon_ids]
+        check_candidates(
+            targets, mesh, mask_frame, chunk_rays[ray_ids[ok]], polygon_ids[ok], hits, inside_test=inside_test
+        )
+    count_hits(hits)
+    return hits
@@ -10,15 +10,23 @@ from pathlib import Path
 import bpy
 import mathutils
 import nptyping as npt
-import numpy as np
-import PIL
-import PIL.Image
 from mathutils import Euler
 
 # Local Library
+from . import profiling
+from .depth import read_depth_image
+from .mold import MOLD_CENTER
+from .mold import MOLD_ROTATION_EULER_DEGREES
+from .mold import plane_grid_mesh
+from .quadtree import adaptive_plane_mesh
+from .template_cache import TemplateCache
+from .template_cache import load_template_cache
+from .template_cache import template_matrix_world
 from .types import BlenderMainReturn
 from .types import ConfigModel
+from .types import MoldConfig
 from .utils import convert_to_location_vector
+from .utils import new_mesh_object
 from .utils import subdivide_obj
 
 logger = getLogger(__name__)
@@ -73,7 +81,7 @@ def depth_map2plane(
     subdivide_obj(obj=depth_obj, num_cuts=grid_resolution)
 
     # mapping depth array to plane
-    def get_depth_value_from_plane_coord(x: float, y: float) -> int:
+    def get_depth_value_from_plane_coord(x: float, y: float) -> float:
         # im_x <- calculated from 3d y value
         # im_y <- calculated from 3d x value
         x_length = plane_range.xmax - plane_range.xmin
@@ -84,7 +92,7 @@ def depth_map2plane(
         im_x = min(int(im_w * im_x_rate), im_w - 1)
         im_y = min(int(im_h * im_y_rate), im_h - 1)
 
-        return int(depth_arr[im_y, im_x])
+        return float(depth_arr[im_y, im_x])
 
     def depth2z(depth: float) -> float:
         return z_max * (depth / 255.0)
@@ -100,7 +108,104 @@ def depth_map2plane(
     return depth_obj
 
 
-def load_obj(config: ConfigModel) -> BlenderMainReturn:
+def depth_map2plane_array(
+    depth_arr: npt.NDArray[npt.Shape["*, *"], npt.Float],
+    z_max: float = 1.0,
+    grid_resolution: int = 135,
+) -> bpy.types.Object:
+    """``depth_map2plane`` without bmesh subdivision and per-vertex Python loops
+
+    The vertex grid and its heights are computed with NumPy and written to a new mesh in bulk.
+    """
+    return new_mesh_object(
+        name="DepthPlane",
+        mesh=plane_grid_mesh(depth_arr=depth_arr, z_max=z_max, grid_resolution=grid_resolution),
+    )
+
+
+def create_molds(
+    depth_image_path: Path,
+    mold_config: MoldConfig = MoldConfig(),
+) -> t.Tuple[bpy.types.Object, bpy.types.Object]:
+    """create the molds from a depth image
+
+    Returns:
+        (bpy.types.Object, bpy.types.Object): mold_obj_base (depth plane) and mold_obj_sub (flat plane)
+    """
+
+    #########################
+    # depth to plane object #
+    #########################
+
+    im = read_depth_image(depth_image_path)
+    assert im.ndim == 2, f"{im.ndim=}"
+    # TODO:
+    with profiling.stage("depth_map2plane"):
+        if mold_config.builder == "subdivide":
+            depth_obj = depth_map2plane(depth_arr=255 - im, grid_resolution=mold_config.grid_resolution)
+        elif mold_config.builder == "array":
+            depth_obj = depth_map2plane_array(depth_arr=255 - im, grid_resolution=mold_config.grid_resolution)
+        elif mold_config.builder == "quadtree":
+            depth_obj = new_mesh_object(
+                name="DepthPlane",
+                mesh=adaptive_plane_mesh(
+                    depth_arr=255 - im,
+                    error_tolerance=mold_config.error_tolerance,
+                    max_faces=mold_config.max_faces,
+                ),
+            )
+        else:
+            raise ValueError(f"{mold_config.builder=} not supported!")
+
+    # less vertex (the quadtree mesh is already adaptive)
+    if mold_config.builder != "quadtree" and mold_config.decimate_ratio < 1.0:
+        with profiling.stage("decimate"):
+            decimate_modifier = depth_obj.modifiers.new(name="decimate", type="DECIMATE")
+            decimate_modifier.ratio = mold_config.decimate_ratio
+            bpy.context.view_layer.objects.active = depth_obj
+            bpy.ops.object.modifier_apply(modifier=decimate_modifier.name)
+
+    # rotate
+    def rotate_obj(
+        obj: bpy.types.Object,
+        euler: Euler = Euler(map(math.radians, MOLD_ROTATION_EULER_DEGREES), "XYZ"),
+    ) -> bpy.types.Object:
+        """
+        https://blender.stackexchange.com/questions/36647/python-low-level-apply-rotation-to-an-object
+        """
+        mat = obj.matrix_world * euler.to_matrix().to_4x4()
+        obj.matrix_world = mat
+        return obj
+
+    euler: Euler = Euler(map(math.radians, MOLD_ROTATION_EULER_DEGREES), "XYZ")
+    depth_obj.rotation_euler = euler
+    # depth_obj.matrix_world = euler.to_matrix().to_4x4() * depth_obj.matrix_world
+    # bpy.context.view_layer.objects.active = depth_obj
+    # depth_obj = rotate_obj(obj=depth_obj, euler=euler)
+
+    obj = depth_obj
+    center_vec = mathutils.Vector(MOLD_CENTER)
+    if __debug__:
+        logger.info(f"{center_vec=}")
+    obj.location = obj.location - center_vec
+    del obj
+    # end scope
+
+    mold_obj_base = depth_obj
+
+    bpy.ops.mesh.primitive_plane_add(size=2.0, location=depth_obj.location, rotation=depth_obj.rotation_euler)
+    mold_obj_sub = bpy.context.active_object
+
+    return (mold_obj_base, mold_obj_sub)
+
+
+def load_obj(config: ConfigModel, create_mold: bool = True) -> BlenderMainReturn:
+    """set up the scene and load ``config.input.objects`` (the last one is the template)
+
+    Args:
+        create_mold (bool): create the molds from ``config.input.depth_image_path``.
+            The batch mode creates them per image with ``create_molds``.
+    """
     # Set up rendering
     context = bpy.context
     scene = bpy.context.scene
@@ -147,9 +252,20 @@ def load_obj(config: ConfigModel) -> BlenderMainReturn:
         # context.view_layer.objects.active = obj
         return obj
 
-    for obj_info in config.input.objects:
-        obj = load_wavefront_obj(obj_path=Path(obj_info.obj_filepath), obj_name=obj_info.obj_name)
-        obj.location = convert_to_location_vector(obj_info.location)
+    template_cache: t.Optional[TemplateCache] = None
+    for i, obj_info in enumerate(config.input.objects):
+        if config.input.use_template_cache and i == len(config.input.objects) - 1:
+            # the template: no OBJ import
+            template_cache = load_template_cache(
+                obj_info.obj_filepath,
+                matrix_world=template_matrix_world(obj_info.location),
+                cache_path=config.input.template_cache_path,
+            )
+            obj = new_mesh_object(name=obj_info.obj_name, mesh=template_cache.mesh_arrays())
+            obj.matrix_world = mathutils.Matrix(template_cache.matrix_world.tolist())
+        else:
+            obj = load_wavefront_obj(obj_path=Path(obj_info.obj_filepath), obj_name=obj_info.obj_name)
+            obj.location = convert_to_location_vector(obj_info.location)
         if __debug__:
             logger.info(f"{obj.name=}, {obj.location=}, {obj.data.name=}")
 
@@ -159,52 +275,11 @@ def load_obj(config: ConfigModel) -> BlenderMainReturn:
     # Mold #
     ########
 
-    #########################
-    # depth to plane object #
-    #########################
-
-    filepath = Path(config.input.depth_image_path)
-    im = np.array(PIL.Image.open(filepath))
-    assert im.ndim == 2, f"{im.ndim=}"
-    # TODO:
-    depth_obj = depth_map2plane(depth_arr=255 - im)
-
-    # less vertex
-    decimate_modifier = depth_obj.modifiers.new(name="decimate", type="DECIMATE")
-    decimate_modifier.ratio = 0.1
-    bpy.context.view_layer.objects.active = depth_obj
-    bpy.ops.object.modifier_apply(modifier=decimate_modifier.name)
-
-    # rotate
-    def rotate_obj(
-        obj: bpy.types.Object,
-        euler: Euler = Euler(map(math.radians, (0.0, 90.0, 180.0)), "XYZ"),
-    ) -> bpy.types.Object:
-        """
-        https://blender.stackexchange.com/questions/36647/python-low-level-apply-rotation-to-an-object
-        """
-        mat = obj.matrix_world * euler.to_matrix().to_4x4()
-        obj.matrix_world = mat
-        return obj
-
-    euler: Euler = Euler(map(math.radians, (0.0, 90.0, 180.0)), "XYZ")
-    depth_obj.rotation_euler = euler
-    # depth_obj.matrix_world = euler.to_matrix().to_4x4() * depth_obj.matrix_world
-    # bpy.context.view_layer.objects.active = depth_obj
-    # depth_obj = rotate_obj(obj=depth_obj, euler=euler)
-
-    obj = depth_obj
-    center_vec = mathutils.Vector((-0.3, 0.0, 0.0))
-    if __debug__:
-        logger.info(f"{center_vec=}")
-    obj.location = obj.location - center_vec
-    del obj
-    # end scope
-
-    mold_obj_base = depth_obj
-
-    bpy.ops.mesh.primitive_plane_add(size=2.0, location=depth_obj.location, rotation=depth_obj.rotation_euler)
-    mold_obj_sub = bpy.context.active_object
+    mold_obj_base: t.Optional[bpy.types.Object] = None
+    mold_obj_sub: t.Optional[bpy.types.Object] = None
+    # the heightfield engine uses the depth image directly
+    if create_mold and config.deformation.engine != "heightfield":
+        mold_obj_base, mold_obj_sub = create_molds(Path(config.input.depth_image_path), mold_config=config.mold)
 
     #########
     # Light #
@@ -251,4 +326,9 @@ def load_obj(config: ConfigModel) -> BlenderMainReturn:
     # scene.render.filepath = config.render_filepath
     # bpy.ops.render.render(write_still=True)  # render still
 
-    return BlenderMainReturn(template_obj=template_obj, mold_obj_base=mold_obj_base, mold_obj_sub=mold_obj_sub)
+    return BlenderMainReturn(
+        template_obj=template_obj,
+        mold_obj_base=mold_obj_base,
+        mold_obj_sub=mold_obj_sub,
+        template_cache=template_cache,
+    )
@@ -0,0 +1,145 @@
+"""Resumable job manifest
+
+An append-only JSONL journal of the jobs of a driver (``main_parallel.py``, ``rendering/main.py``).
+Every finished job appends one record::
+
+    {"key": ..., "input_hash": ..., "config_hash": ..., "outputs": [...], "status": "done" | "failed",
+     "duration": seconds, "error": ..., "time": unix time}
+
+The last record of a key wins. A rerun skips a job whose last record is "done" with the same input and config
+hashes and whose outputs still exist, and runs every other job again. The config hash of the drivers also covers the
+template files and the code of the jobs (``hash_code``), so a changed template or deformation code reruns them.
+"""
+
+# Standard Library
+import hashlib
+import json
+import os
+import time
+import typing as t
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_PathLike = t.Union[str, Path]
+
+
+def hash_file(filepath: _PathLike) -> str:
+    sha = hashlib.sha256()
+    with open(filepath, mode="rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def hash_strings(strings: t.Iterable[str]) -> str:
+    sha = hashlib.sha256()
+    for s in strings:
+        sha.update(s.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def hash_code(paths: t.Iterable[_PathLike]) -> str:
+    """the code version of a job: the hash of its ``*.py`` files (directories are searched recursively)"""
+    filepaths: t.List[Path] = []
+    for path in map(Path, paths):
+        filepaths += sorted(path.rglob("*.py")) if path.is_dir() else [path]
+    return hash_strings(f"{filepath.name}:{hash_file(filepath)}" for filepath in filepaths)
+
+
+@dataclass
+class JobRecord:
+    key: str
+    input_hash: str
+    config_hash: str
+    outputs: t.List[str] = field(default_factory=list)
+    status: str = "done"  # "done" or "failed"
+    duration: float = 0.0
+    error: t.Optional[str] = None
+    time: float = 0.0
+
+
+class JobManifest:
+    def __init__(self, filepath: _PathLike) -> None:
+        self.filepath = Path(filepath)
+        self.records: t.Dict[str, JobRecord] = {}
+        self._needs_newline: bool = False  # the last line was cut by a crash
+        if self.filepath.exists():
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.filepath, mode="rt") as f:
+            line: str
+            for i, line in enumerate(f):
+                self._needs_newline = not line.endswith("\n")
+                if not line.strip():
+                    continue
+                try:
+                    record = JobRecord(**json.loads(line))
+                except (ValueError, TypeError) as e:  # e.g. a line cut by a crash
+                    logger.warning(f"{self.filepath}:{i + 1}: skip broken record ({e})")
+                    continue
+                self.records[record.key] = record
+
+    def state(self, key: str, input_hash: str, config_hash: str) -> str:
+        """
+        Returns:
+            str:
+                "new" (no record), "failed", "stale" (the input or the config has changed),
+                "missing" (an output has been removed) or "done"
+        """
+        record = self.records.get(key)
+        if record is None:
+            return "new"
+        if record.status != "done":
+            return "failed"
+        if record.input_hash != input_hash or record.config_hash != config_hash:
+            return "stale"
+        if not all(Path(output).exists() for output in record.outputs):
+            return "missing"
+        return "done"
+
+    def should_run(self, key: str, input_hash: str, config_hash: str) -> bool:
+        state = self.state(key, input_hash=input_hash, config_hash=config_hash)
+        if state in ("stale", "missing", "failed"):
+            logger.info(f"rerun ({state}): {key}")
+        return state != "done"
+
+    def record(
+        self,
+        key: str,
+        input_hash: str,
+        config_hash: str,
+        outputs: t.Sequence[_PathLike],
+        ok: bool,
+        duration: float,
+        error: t.Optional[str] = None,
+    ) -> JobRecord:
+        """append a record (flushed and synced so that it survives a crash of the driver)"""
+        record = JobRecord(
+            key=key,
+            input_hash=input_hash,
+            config_hash=config_hash,
+            outputs=[str(output) for output in outputs],
+            status="done" if ok else "failed",
+            duration=duration,
+            error=error,
+            time=time.time(),
+        )
+        self.records[key] = record
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.filepath, mode="at") as f:
+            if self._needs_newline:
+                f.write("\n")
+                self._needs_newline = False
+            f.write(json.dumps(asdict(record)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return record
@@ -0,0 +1,128 @@
+# Standard Library
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+
+def dilate(
+    im: npt.NDArray[npt.Shape["*, *"], npt.Int],
+    size: int = 5,
+) -> npt.NDArray[npt.Shape["*, *"], npt.Int]:
+    """same as ``cv2.dilate(im, np.ones((size, size), np.uint8))`` (odd ``size``)
+
+    The square kernel is separable, so the maximum is taken along rows and then along columns.
+    Pixels outside the image do not contribute, as with the default border of ``cv2.dilate``.
+    """
+    if size % 2 == 0 or size < 1:
+        raise ValueError(f"{size=} not supported!")
+    r: int = size // 2
+    fill = np.iinfo(im.dtype).min if np.issubdtype(im.dtype, np.integer) else -np.inf
+    padded = np.pad(im, ((r, r), (r, r)), constant_values=fill)
+    rows = sliding_window_view(padded, size, axis=1).max(axis=-1)
+    return sliding_window_view(rows, size, axis=0).max(axis=-1)
+
+
+def create_mask(
+    im: npt.NDArray[npt.Shape["*, ..."], npt.Int],
+    background: int,
+    size: int = 5,
+) -> npt.NDArray[npt.Shape["*, ..."], npt.Int]:
+    """0,1のマスクを作成する
+
+    Args:
+        im (np.ndarray): depth image
+        background (int): pixel value of the background
+        size (int): kernel size of the dilation
+
+    Returns:
+        np.ndarray: 1 for (dilated) foreground, 0 for background. Same dtype as ``im``.
+    """
+
+    new_im = im.copy()
+
+    new_im[im == background] = 0
+    new_im[im != background] = 1
+
+    return dilate(new_im, size=size)
+
+
+def chebyshev_distance(
+    mask: npt.NDArray[npt.Shape["*, *"], npt.Int],
+    max_distance: t.Optional[int] = None,
+) -> npt.NDArray[npt.Shape["*, *"], npt.Int]:
+    """distance ``max(|dy|, |dx|)`` in pixels from every pixel to the nearest nonzero pixel of ``mask``
+
+    The distance along the rows is found with running maxima/minima of the nonzero column indices. The distance
+    ``min_y' max(|y - y'|, row(y'))`` is then found radius by radius with a running minimum along the columns.
+
+    Args:
+        max_distance (int, optional): larger distances (and every distance of an empty mask) are
+            ``max_distance + 1``. Default: no limit
+
+    Returns:
+        np.ndarray: int32, 0 on the nonzero pixels
+    """
+    mask = np.asarray(mask) != 0
+    height, width = mask.shape
+    limit: int = height + width if max_distance is None else max_distance + 1
+    if not mask.any():
+        return np.full(mask.shape, limit, dtype=np.int32)
+
+    x = np.arange(width)
+    left = np.maximum.accumulate(np.where(mask, x, -limit - width), axis=1)
+    right = np.minimum.accumulate(np.where(mask, x, limit + 2 * width)[:, ::-1], axis=1)[:, ::-1]
+    window = np.minimum(np.minimum(x - left, right - x), limit)  # min of the row distances over |y' - y| <= r
+    # window <= r stays true once it is true, so the distance is the number of radii with window > r
+    dist = np.zeros(mask.shape, dtype=np.int32)
+    for r in range(limit):
+        above = window > r
+        if not above.any():
+            break
+        dist += above
+        np.minimum(window[1:], window[:-1], out=window[1:])
+        np.minimum(window[:-1], window[1:], out=window[:-1])
+    return dist
+
+
+@dataclass
+class MaskIndex:
+    """signed Chebyshev distance transform of the foreground of a depth image
+
+    ``sdt`` is the distance to the nearest foreground pixel off the foreground and ``1 -`` the distance to the
+    nearest background pixel on it, so ``sdt <= r`` is the foreground dilated (``r > 0``) or eroded (``r < 0``)
+    with a ``(2|r| + 1)`` square kernel. The dilation is a threshold of the index instead of a new mask.
+
+    Building the index costs several ``create_mask`` calls, so it pays off only when one depth image is masked with
+    several sizes (e.g. tuning ``deformation.mask_size``); the processing of one size uses ``create_mask``.
+    """
+
+    sdt: npt.NDArray[npt.Shape["*, *"], npt.Int]
+    max_distance: int  # |sdt| is clamped to max_distance + 1
+
+    @classmethod
+    def build(
+        cls,
+        im: npt.NDArray[npt.Shape["*, *"], npt.Number],
+        background: float,
+        max_distance: int = 32,
+    ) -> "MaskIndex":
+        foreground = im != background
+        outside = chebyshev_distance(foreground, max_distance=max_distance)
+        inside = chebyshev_distance(~foreground, max_distance=max_distance)
+        return cls(sdt=np.where(foreground, 1 - inside, outside).astype(np.int32), max_distance=max_distance)
+
+    def mask(self, size: int = 5) -> npt.NDArray[npt.Shape["*, *"], npt.UInt8]:
+        """1 for the dilated foreground, 0 for background: ``create_mask(im, background, size)`` as uint8"""
+        radius: int = size // 2
+        if size % 2 == 0 or size < 1 or radius > self.max_distance:
+            raise ValueError(f"{size=} not supported!")
+        return (self.sdt <= radius).astype(np.uint8)
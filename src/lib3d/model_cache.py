@@ -0,0 +1,127 @@
+"""Binary cache of imported models (ShapeNet ``model.obj``)
+
+``bpy.ops.import_scene.obj`` of a large ShapeNet model parses tens of MB of text. The first import is converted
+into a ``.npz`` file with the arrays of every imported mesh (vertices, polygons, UVs, material indices, smooth
+flags and custom normals) and the settings of its materials; the next loads build the meshes from the arrays
+with bulk ``foreach_set`` (``utils.new_objects_from_model_cache``).
+
+The materials are approximated: they are rebuilt with ``PrincipledBSDFWrapper`` from its values and image
+textures (``utils.get_material_settings``), so other node setups of the imported materials are lost and the
+renders can differ from renders of the imported OBJ file. The cache is therefore off by default.
+
+The cache is stale when the size or the modification time of the OBJ file or of an MTL file next to it has changed.
+"""
+
+# Standard Library
+import json
+import typing as t
+from dataclasses import dataclass
+from dataclasses import field
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+# Local Library
+from .fileio import atomic_write
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_PathLike = t.Union[str, Path]
+
+CACHE_VERSION: int = 1
+
+_ARRAY_NAMES: t.Tuple[str, ...] = (
+    "matrix_world",
+    "vertices",
+    "loop_vertices",
+    "loop_start",
+    "loop_total",
+    "use_smooth",
+    "material_index",
+    "uvs",
+    "loop_normals",
+)
+
+
+@dataclass
+class CachedMesh:
+    name: str
+    matrix_world: npt.NDArray[npt.Shape["4, 4"], npt.Float]
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]  # object-local
+    loop_vertices: npt.NDArray[npt.Shape["*"], npt.Int]
+    loop_start: npt.NDArray[npt.Shape["*"], npt.Int]
+    loop_total: npt.NDArray[npt.Shape["*"], npt.Int]
+    use_smooth: npt.NDArray[npt.Shape["*"], npt.Bool]
+    material_index: npt.NDArray[npt.Shape["*"], npt.Int]
+    material_names: t.List[str]  # the material slots
+    uvs: t.Optional[npt.NDArray[npt.Shape["*, 2"], npt.Float]] = None  # per loop, the active UV map
+    loop_normals: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None  # custom split normals
+
+
+@dataclass
+class ModelCache:
+    source_signature: str
+    meshes: t.List[CachedMesh] = field(default_factory=list)
+    # material name -> settings of its Principled BSDF (see ``utils.model_cache_from_objects``)
+    materials: t.Dict[str, t.Dict[str, t.Any]] = field(default_factory=dict)
+
+    def save(self, filepath: _PathLike) -> None:
+        """write atomically (parallel workers may convert the same model)"""
+        filepath = Path(filepath)
+        arrays: t.Dict[str, np.ndarray] = {}
+        for i, mesh in enumerate(self.meshes):
+            for array_name in _ARRAY_NAMES:
+                value = getattr(mesh, array_name)
+                if value is not None:
+                    arrays[f"{i}/{array_name}"] = value
+        metadata: t.Dict[str, t.Any] = {
+            "version": CACHE_VERSION,
+            "source_signature": self.source_signature,
+            "meshes": [{"name": mesh.name, "material_names": mesh.material_names} for mesh in self.meshes],
+            "materials": self.materials,
+        }
+        with atomic_write(filepath) as f:
+            np.savez(f, metadata=np.array(json.dumps(metadata)), **arrays)
+
+    @classmethod
+    def load(cls, filepath: _PathLike) -> "ModelCache":
+        with np.load(filepath) as data:
+            metadata: t.Dict[str, t.Any] = json.loads(str(data["metadata"]))
+            if metadata["version"] != CACHE_VERSION:
+                raise ValueError(f"{metadata['version']=} not supported!")
+            meshes: t.List[CachedMesh] = []
+            for i, mesh_info in enumerate(metadata["meshes"]):
+                arrays = {
+                    array_name: data[f"{i}/{array_name}"] if f"{i}/{array_name}" in data.files else None
+                    for array_name in _ARRAY_NAMES
+                }
+                meshes.append(CachedMesh(name=mesh_info["name"], material_names=mesh_info["material_names"], **arrays))
+        return cls(source_signature=metadata["source_signature"], meshes=meshes, materials=metadata["materials"])
+
+
+def source_signature(obj_filepath: _PathLike) -> str:
+    """size and modification time of the OBJ file and of the MTL files in its directory"""
+    obj_filepath = Path(obj_filepath)
+    filepaths: t.List[Path] = [obj_filepath, *sorted(obj_filepath.parent.glob("*.mtl"))]
+    return ";".join(f"{p.name}:{p.stat().st_size}:{p.stat().st_mtime_ns}" for p in filepaths)
+
+
+def load_model_cache(obj_filepath: _PathLike, cache_path: _PathLike) -> t.Optional[ModelCache]:
+    """the cache of the OBJ file, or None if it is missing, broken or stale"""
+    cache_path = Path(cache_path)
+    if not cache_path.exists():
+        return None
+    try:
+        cache = ModelCache.load(cache_path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"rebuild {cache_path}: {e}")
+        return None
+    if cache.source_signature != source_signature(obj_filepath):
+        logger.info(f"rebuild {cache_path}: {obj_filepath} has changed")
+        return None
+    return cache
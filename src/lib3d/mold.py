@@ -0,0 +1,107 @@
+"""Mold geometry shared by the Blender and the array based code paths
+
+3D座標では (x,y,z) の方向はそれぞれ +x が奥, +y が右, +z が上.
+The mold is built on the plane ``-1 <= x <= 1, -1 <= y <= 1`` (object-local coordinates)
+and placed in the scene with ``mold_matrix_world``.
+"""
+
+# Standard Library
+import math
+import typing as t
+from logging import NullHandler
+from logging import getLogger
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+# Local Library
+from .geometry import MeshArrays
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+MOLD_ROTATION_EULER_DEGREES: t.Tuple[float, float, float] = (0.0, 90.0, 180.0)  # "XYZ"
+MOLD_CENTER: t.Tuple[float, float, float] = (-0.3, 0.0, 0.0)  # the mold is moved by -MOLD_CENTER
+MOLD_Z_MAX: float = 1.0
+
+
+def euler_xyz_to_matrix(degrees: t.Tuple[float, float, float]) -> npt.NDArray[npt.Shape["3, 3"], npt.Float]:
+    """same as ``mathutils.Euler(map(math.radians, degrees), "XYZ").to_matrix()``"""
+    x, y, z = map(math.radians, degrees)
+    rot_x = np.array([[1.0, 0.0, 0.0], [0.0, math.cos(x), -math.sin(x)], [0.0, math.sin(x), math.cos(x)]])
+    rot_y = np.array([[math.cos(y), 0.0, math.sin(y)], [0.0, 1.0, 0.0], [-math.sin(y), 0.0, math.cos(y)]])
+    rot_z = np.array([[math.cos(z), -math.sin(z), 0.0], [math.sin(z), math.cos(z), 0.0], [0.0, 0.0, 1.0]])
+    return t.cast(npt.NDArray[npt.Shape["3, 3"], npt.Float], rot_z @ rot_y @ rot_x)
+
+
+def mold_matrix_world() -> npt.NDArray[npt.Shape["4, 4"], npt.Float]:
+    """``matrix_world`` of the molds created by ``load_obj.load_obj``"""
+    matrix = np.eye(4)
+    matrix[:3, :3] = euler_xyz_to_matrix(MOLD_ROTATION_EULER_DEGREES)
+    matrix[:3, 3] = -np.array(MOLD_CENTER)
+    return matrix
+
+
+def depth_to_z(
+    depth: npt.NDArray[npt.Shape["*, ..."], npt.Number], z_max: float = MOLD_Z_MAX
+) -> npt.NDArray[npt.Shape["*, ..."], npt.Float]:
+    return t.cast(npt.NDArray[npt.Shape["*, ..."], npt.Float], z_max * (np.asarray(depth, dtype=np.float64) / 255.0))
+
+
+def plane_lattice_heights(
+    depth_arr: npt.NDArray[npt.Shape["*, *"], npt.Number],
+    num_x: int,
+    num_y: int,
+    z_max: float = MOLD_Z_MAX,
+) -> t.Tuple[
+    npt.NDArray[npt.Shape["*"], npt.Float],
+    npt.NDArray[npt.Shape["*"], npt.Float],
+    npt.NDArray[npt.Shape["*, *"], npt.Float],
+]:
+    """heights of a ``num_x x num_y`` vertex lattice over the plane
+
+    Each vertex takes the depth of the pixel under it, in the same way as ``load_obj.depth_map2plane``.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray):
+            xs ``(num_x,)``, ys ``(num_y,)`` and heights ``(num_x, num_y)``
+            (``heights[i, j]`` is the z value at ``(xs[i], ys[j])``).
+    """
+    im_h, im_w = depth_arr.shape[:2]
+    xs = np.linspace(-1.0, 1.0, num_x)
+    ys = np.linspace(-1.0, 1.0, num_y)
+    # im_x <- calculated from 3d y value
+    # im_y <- calculated from 3d x value
+    im_y = np.minimum((im_h * ((xs + 1.0) / 2.0)).astype(np.int64), im_h - 1)
+    im_x = np.minimum((im_w * (1 - (ys + 1.0) / 2.0)).astype(np.int64), im_w - 1)  # flip
+    heights = depth_to_z(depth_arr[im_y[:, np.newaxis], im_x[np.newaxis, :]], z_max=z_max)
+    return xs, ys, heights
+
+
+def sub_plane_mesh() -> MeshArrays:
+    """the flat mold (``mold_obj_sub``) in world coordinates"""
+    # same vertex order as bpy.ops.mesh.primitive_plane_add
+    vertices = np.array([[-1.0, -1.0, 0.0], [1.0, -1.0, 0.0], [-1.0, 1.0, 0.0], [1.0, 1.0, 0.0]])
+    return MeshArrays.from_faces(vertices, np.array([[0, 1, 3, 2]])).transformed(mold_matrix_world())
+
+
+def plane_grid_mesh(
+    depth_arr: npt.NDArray[npt.Shape["*, *"], npt.Number],
+    z_max: float = MOLD_Z_MAX,
+    grid_resolution: int = 135,
+) -> MeshArrays:
+    """the mesh of ``load_obj.depth_map2plane`` (object-local coordinates) built with array operations
+
+    The ``(grid_resolution + 2)^2`` vertices are ordered row by row (x major) and every lattice cell
+    becomes a quad.
+    """
+    num: int = grid_resolution + 2
+    xs, ys, heights = plane_lattice_heights(depth_arr, num_x=num, num_y=num, z_max=z_max)
+    x, y = np.meshgrid(xs, ys, indexing="ij")
+    vertices = np.stack([x, y, heights], axis=-1).reshape(-1, 3)
+
+    idx = np.arange(num * num).reshape(num, num)
+    # counter-clockwise seen from +z
+    faces = np.stack([idx[:-1, :-1], idx[1:, :-1], idx[1:, 1:], idx[:-1, 1:]], axis=-1).reshape(-1, 4)
+    return MeshArrays.from_faces(vertices, faces)
@@ -0,0 +1,253 @@
+"""Coarse-to-fine deformation of a subdivided template
+
+``TemplateHierarchy`` subdivides the template ``levels`` times. Every subdivision keeps the vertices of the previous
+level (with the same indices) and adds the midpoint of every edge and the center of every face that is not a
+triangle, so a vertex of level ``l`` has up to ``P`` parents in level ``l - 1`` (itself for an old vertex).
+
+``deform_coarse_to_fine`` searches the full molds only with the rays of level 0. The rays of the new vertices of a
+finer level are tested only against the mold polygons near the hits of their parents (and only if the neighborhood
+covers a foreground pixel of the mask). A vertex whose parents all missed is not searched at all, so a subtree
+in the background costs nothing. The result is an approximation of deforming the finest level with a full search:
+a hit that none of the parents' neighborhoods contains is missed.
+"""
+
+# Standard Library
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+# Local Library
+from . import profiling
+from .intersection import FarthestHits
+from .template_cache import unit_ray_directions
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+FindHits = t.Callable[[npt.NDArray[npt.Shape["*, 3"], npt.Float]], FarthestHits]
+# (targets, box_min, box_max): hits of the polygons near the box of each ray
+FindHitsNear = t.Callable[
+    [
+        npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    ],
+    FarthestHits,
+]
+
+
+def subdivide(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    loop_vertices: npt.NDArray[npt.Shape["*"], npt.Int],
+    loop_total: npt.NDArray[npt.Shape["*"], npt.Int],
+) -> t.Tuple[
+    npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    npt.NDArray[npt.Shape["*"], npt.Int],
+    npt.NDArray[npt.Shape["*"], npt.Int],
+    npt.NDArray[npt.Shape["*, *"], npt.Int],
+]:
+    """Midpoint subdivision: a triangle into 4 triangles, a face of ``K != 3`` vertices into ``K`` quads
+
+    The faces keep their orientation and the faces of one original face are consecutive.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray, np.ndarray): vertices, loop_vertices, loop_total and ``(V', P)``
+            parents (indices into ``vertices``, padded with the first parent)
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    loop_vertices = np.asarray(loop_vertices, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+    num_vertices: int = len(vertices)
+    num_faces: int = len(loop_total)
+    loop_start = np.cumsum(loop_total) - loop_total
+    face_ids = np.repeat(np.arange(num_faces), loop_total)
+    corner = np.arange(len(loop_vertices)) - loop_start[face_ids]
+    next_vertices = loop_vertices[loop_start[face_ids] + (corner + 1) % loop_total[face_ids]]
+
+    # one midpoint per undirected edge; the midpoint of the edge starting at loop i is edge_vertices[i]
+    edge_keys = np.minimum(loop_vertices, next_vertices) * num_vertices + np.maximum(loop_vertices, next_vertices)
+    unique_keys, edge_ids = np.unique(edge_keys, return_inverse=True)
+    edge_vertices = num_vertices + edge_ids.reshape(-1)
+    num_edges: int = len(unique_keys)
+    # the center of every face that is not a triangle
+    is_polygon = loop_total != 3
+    center_vertices = np.full(num_faces, -1, dtype=np.int64)
+    center_vertices[is_polygon] = num_vertices + num_edges + np.arange(int(np.count_nonzero(is_polygon)))
+
+    max_parents: int = max(2, int(loop_total[is_polygon].max())) if is_polygon.any() else 2
+    parents = np.empty((num_vertices + num_edges + int(np.count_nonzero(is_polygon)), max_parents), dtype=np.int64)
+    parents[:num_vertices] = np.arange(num_vertices)[:, np.newaxis]
+    edge_parents = np.stack([unique_keys // num_vertices, unique_keys % num_vertices], axis=1)
+    parents[num_vertices : num_vertices + num_edges] = edge_parents[:, [0] + [1] * (max_parents - 1)]
+    polygon_loops = np.flatnonzero(is_polygon[face_ids])
+    rows = center_vertices[face_ids[polygon_loops]]
+    parents[num_vertices + num_edges :] = loop_vertices[loop_start[is_polygon]][:, np.newaxis]  # padding
+    parents[rows, corner[polygon_loops]] = loop_vertices[polygon_loops]
+
+    new_vertices = np.concatenate(
+        [
+            vertices,
+            vertices[edge_parents].mean(axis=1),
+            np.add.reduceat(vertices[loop_vertices], loop_start, axis=0)[is_polygon]
+            / loop_total[is_polygon, np.newaxis],
+        ]
+    )
+
+    # (face, sub face, corner) padded to 4 corners; -1 for the missing 4th corner of the triangles
+    previous_loops = loop_start[face_ids] + (corner - 1) % loop_total[face_ids]
+    sub_faces = np.full((len(loop_vertices), 4), -1, dtype=np.int64)
+    # corner i of a face: (v_i, m_i, m_{i-1}) for a triangle, (v_i, m_i, center, m_{i-1}) otherwise
+    sub_faces[:, 0] = loop_vertices
+    sub_faces[:, 1] = edge_vertices
+    tri = ~is_polygon[face_ids]
+    sub_faces[tri, 2] = edge_vertices[previous_loops[tri]]
+    sub_faces[~tri, 2] = center_vertices[face_ids[~tri]]
+    sub_faces[~tri, 3] = edge_vertices[previous_loops[~tri]]
+    # the middle triangle (m_0, m_1, m_2) of every triangle after its 3 corners
+    triangle_starts = loop_start[~is_polygon]
+    middle = np.full((len(triangle_starts), 4), -1, dtype=np.int64)
+    middle[:, :3] = edge_vertices[triangle_starts[:, np.newaxis] + np.arange(3)]
+    order = np.argsort(
+        np.concatenate([face_ids, np.flatnonzero(~is_polygon)]), kind="stable"
+    )  # the faces of one original face are consecutive
+    sub_faces = np.concatenate([sub_faces, middle])[order]
+
+    new_loop_total = np.count_nonzero(sub_faces >= 0, axis=1)
+    new_loop_vertices = sub_faces[sub_faces >= 0]
+    return new_vertices, new_loop_vertices, new_loop_total, parents
+
+
+@dataclass
+class TemplateHierarchy:
+    """The template (level 0) and ``len(vertices) - 1`` levels of ``subdivide``"""
+
+    vertices: t.List[npt.NDArray[npt.Shape["*, 3"], npt.Float]]  # object-local, per level
+    loop_vertices: t.List[npt.NDArray[npt.Shape["*"], npt.Int]]
+    loop_total: t.List[npt.NDArray[npt.Shape["*"], npt.Int]]
+    parents: t.List[npt.NDArray[npt.Shape["*, *"], npt.Int]]  # level l -> level l - 1 (level 0: none)
+
+    @classmethod
+    def build(
+        cls,
+        vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        loop_vertices: npt.NDArray[npt.Shape["*"], npt.Int],
+        loop_total: npt.NDArray[npt.Shape["*"], npt.Int],
+        levels: int,
+    ) -> "TemplateHierarchy":
+        if levels < 0:
+            raise ValueError(f"{levels=} not supported!")
+        hierarchy = cls(
+            vertices=[np.asarray(vertices, dtype=np.float64)],
+            loop_vertices=[np.asarray(loop_vertices, dtype=np.int64)],
+            loop_total=[np.asarray(loop_total, dtype=np.int64)],
+            parents=[np.zeros((len(vertices), 0), dtype=np.int64)],
+        )
+        for _ in range(levels):
+            new_vertices, new_loop_vertices, new_loop_total, parents = subdivide(
+                hierarchy.vertices[-1], hierarchy.loop_vertices[-1], hierarchy.loop_total[-1]
+            )
+            hierarchy.vertices.append(new_vertices)
+            hierarchy.loop_vertices.append(new_loop_vertices)
+            hierarchy.loop_total.append(new_loop_total)
+            hierarchy.parents.append(parents)
+        return hierarchy
+
+    @property
+    def levels(self) -> int:
+        return len(self.vertices) - 1
+
+    @property
+    def faces(self) -> t.List[t.List[int]]:
+        """the faces of the finest level"""
+        return [face.tolist() for face in np.split(self.loop_vertices[-1], np.cumsum(self.loop_total[-1])[:-1])]
+
+
+def _find_subset(
+    find_hits: t.Callable[..., FarthestHits],
+    num_rays: int,
+    ray_ids: npt.NDArray[npt.Shape["*"], npt.Int],
+    *args: npt.NDArray[npt.Shape["*, ..."], npt.Float],
+) -> FarthestHits:
+    """``find_hits(*(a[ray_ids] for a in args))`` scattered back into ``num_rays`` rays"""
+    hits = FarthestHits.empty(num_rays)
+    if len(ray_ids) == 0:
+        return hits
+    subset = find_hits(*(a[ray_ids] for a in args))
+    hits.points[ray_ids] = subset.points
+    hits.lengths[ray_ids] = subset.lengths
+    hits.polygon_ids[ray_ids] = subset.polygon_ids
+    return hits
+
+
+def deform_coarse_to_fine(
+    hierarchy: TemplateHierarchy,
+    matrix_world: npt.NDArray[npt.Shape["4, 4"], npt.Float],
+    find_base: FindHits,
+    find_sub: FindHits,
+    find_base_near: t.Optional[FindHitsNear] = None,
+    search_margin: float = 2.0,
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """``processing.deform_template`` of the finest level of ``hierarchy``, level by level
+
+    The base mold is searched with ``find_base`` at level 0 and with ``find_base_near`` at the finer levels
+    (``find_base`` for the rays of the new vertices if it is None). The neighborhood of a new vertex is the box of
+    the base hits of its parents, expanded by ``search_margin`` times the largest distance between the hit of
+    a parent and the ray of the vertex at that distance. The sub mold is small and searched with ``find_sub``
+    by every new vertex one of whose parents hit either mold.
+
+    Returns:
+        np.ndarray: ``(V, 3)`` moved vertices of the finest level in world coordinates
+    """
+    matrix_world = np.asarray(matrix_world, dtype=np.float64)
+    world_vertices = hierarchy.vertices[0] @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+    directions = unit_ray_directions(world_vertices)
+    with profiling.stage("move_vertices[level0]"):
+        base = find_base(directions)
+        sub = find_sub(directions)
+    found_base = base.found
+    base_points = base.points
+    found_any = found_base | sub.found
+    moved = np.where(
+        sub.found[:, np.newaxis], sub.points, np.where(found_base[:, np.newaxis], base_points, world_vertices)
+    )
+
+    for level in range(1, hierarchy.levels + 1):
+        num_old: int = len(moved)
+        world_vertices = hierarchy.vertices[level][num_old:] @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+        new_directions = unit_ray_directions(world_vertices)
+        parents = hierarchy.parents[level][num_old:]
+        num_new: int = len(parents)
+        with profiling.stage(f"move_vertices[level{level}]"):
+            parent_hit = found_base[parents]
+            base_rays = np.flatnonzero(parent_hit.any(axis=1))
+            profiling.count("rays_skipped", num_new - len(base_rays))
+            if find_base_near is None:
+                base = _find_subset(find_base, num_new, base_rays, new_directions)
+            else:
+                points = np.where(parent_hit[..., np.newaxis], base_points[parents], np.nan)
+                # the distance between the hit of a parent and the ray of the child, at the distance of the hit
+                spread = np.linalg.norm(points, axis=2) * np.linalg.norm(
+                    directions[parents] - new_directions[:, np.newaxis, :], axis=2
+                )
+                margin = search_margin * np.nanmax(np.where(parent_hit, spread, np.nan)[base_rays], axis=1)
+                box_min = np.full((num_new, 3), np.nan)
+                box_max = np.full((num_new, 3), np.nan)
+                box_min[base_rays] = np.nanmin(points[base_rays], axis=1) - margin[:, np.newaxis]
+                box_max[base_rays] = np.nanmax(points[base_rays], axis=1) + margin[:, np.newaxis]
+                base = _find_subset(find_base_near, num_new, base_rays, new_directions, box_min, box_max)
+            sub_rays = np.flatnonzero(found_any[parents].any(axis=1))
+            sub = _find_subset(find_sub, num_new, sub_rays, new_directions)
+
+        moved_new = np.where(base.found[:, np.newaxis], base.points, world_vertices)
+        moved_new = np.where(sub.found[:, np.newaxis], sub.points, moved_new)
+        moved = np.concatenate([moved, moved_new])
+        found_base = np.concatenate([found_base, base.found])
+        base_points = np.concatenate([base_points, base.points])
+        found_any = np.concatenate([found_any, base.found | sub.found])
+        directions = np.concatenate([directions, new_directions])
+    return t.cast(npt.NDArray[npt.Shape["*, 3"], npt.Float], moved)
@@ -0,0 +1,345 @@
+"""Blender-free version of scripts/processing-template/main.py
+
+$ python -m lib3d.processing config=config/main.yml input.depth_image_path=./data/00_depth0001.png \
+    output_filepath_obj=./output/template_out.obj debug_mode=False
+"""
+
+# Standard Library
+import functools
+import logging
+import sys
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+import PIL
+import PIL.Image
+from omegaconf import OmegaConf
+
+# Local Library
+from . import profiling
+from .bvh import BVH
+from .depth import read_depth_image
+from .geometry import MeshArrays
+from .heightfield import HeightField
+from .intersection import FarthestHits
+from .intersection import MaskFrame
+from .intersection import build_polygon_bvh
+from .intersection import find_farthest_intersections
+from .intersection import find_farthest_intersections_bvh
+from .intersection import find_farthest_intersections_near
+from .mask import create_mask
+from .mold import mold_matrix_world
+from .mold import plane_grid_mesh
+from .mold import sub_plane_mesh
+from .multires import FindHits
+from .multires import FindHitsNear
+from .multires import TemplateHierarchy
+from .multires import deform_coarse_to_fine
+from .quadtree import adaptive_plane_mesh
+from .template_cache import TemplateCache
+from .template_cache import load_template_cache
+from .template_cache import template_matrix_world
+from .types import ConfigModel
+from .types import DeformationConfig
+from .types import MoldConfig
+from .vertex_store import VertexStoreWriter
+from .vertex_store import key_from_depth_image_path
+from .wavefront import ObjMesh
+from .wavefront import blender_to_obj_axes
+from .wavefront import write_obj
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+
+def get_args(argv: t.Optional[t.List[str]] = None) -> ConfigModel:
+    """same arguments as ``main.py`` (the ``--`` separator for Blender is optional)"""
+    args: t.List[str] = sys.argv[1:] if argv is None else argv
+    if "--" in args:
+        args = args[args.index("--") + 1 :]
+
+    conf = OmegaConf.from_dotlist(args)
+
+    config: ConfigModel = t.cast(
+        ConfigModel,
+        OmegaConf.merge(
+            OmegaConf.structured(ConfigModel),
+            OmegaConf.load(conf.config),
+            conf,
+        ),
+    )
+    return config
+
+
+def build_mold_mesh(depth_arr: npt.NDArray[npt.Shape["*, *"], npt.Number], mold_config: MoldConfig) -> MeshArrays:
+    """mold_obj_base in world coordinates
+
+    There is no DECIMATE modifier outside Blender: the "subdivide" and "array" builders give the full grid.
+    """
+    if mold_config.builder in ("subdivide", "array"):
+        if mold_config.decimate_ratio < 1.0:
+            logger.warning(f"{mold_config.decimate_ratio=} is ignored without Blender")
+        mesh = plane_grid_mesh(depth_arr=depth_arr, grid_resolution=mold_config.grid_resolution)
+    elif mold_config.builder == "quadtree":
+        mesh = adaptive_plane_mesh(
+            depth_arr=depth_arr,
+            error_tolerance=mold_config.error_tolerance,
+            max_faces=mold_config.max_faces,
+        )
+    else:
+        raise ValueError(f"{mold_config.builder=} not supported!")
+    return mesh.transformed(mold_matrix_world())
+
+
+def move_vertices(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    find_hits: t.Callable[[npt.NDArray[npt.Shape["*, 3"], npt.Float]], FarthestHits],
+    ray_directions: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None,
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    hits = find_hits(vertices if ray_directions is None else ray_directions)
+    # 条件に適合する交点がなかったらスキップ
+    return t.cast(npt.NDArray[npt.Shape["*, 3"], npt.Float], np.where(hits.found[:, np.newaxis], hits.points, vertices))
+
+
+@dataclass
+class MoldSearch:
+    """the intersection searches of the molds of one depth image (``FarthestHits`` of the rays through targets)"""
+
+    base: FindHits
+    sub: FindHits
+    base_near: t.Optional[FindHitsNear] = None  # None: not supported by the engine (heightfield)
+
+
+def build_mold_search(
+    depth_image: npt.NDArray[npt.Shape["*, *"], npt.Int],
+    deformation_config: DeformationConfig = DeformationConfig(),
+    mold_config: MoldConfig = MoldConfig(),
+    mask_image: t.Optional[npt.NDArray[npt.Shape["*, *"], npt.Int]] = None,
+) -> MoldSearch:
+    """build the molds of a depth image
+
+    Args:
+        depth_image (np.ndarray): rendered depth image (background is 255)
+        mask_image (np.ndarray, optional): ``create_mask(depth_image, background=255)`` if not given
+    """
+    if mask_image is None:
+        mask_image = create_mask(depth_image, background=255)
+    mask_array = mask_image[:, ::-1]  # horizontal flip
+    depth_arr = 255 - depth_image
+    chunk_size: int = deformation_config.chunk_size
+    inside_test: str = deformation_config.inside_test
+
+    sub_mesh = sub_plane_mesh()
+    if deformation_config.engine == "heightfield":
+        with profiling.stage("build_heightfield"):
+            height_field = HeightField.from_depth_arr(
+                depth_arr=depth_arr, grid_resolution=deformation_config.heightfield_resolution
+            )
+        mask_frame = MaskFrame(mask_array, *height_field.bounding_box_yz())
+        base: FindHits = functools.partial(
+            height_field.find_farthest_intersections, mask_frame=mask_frame, chunk_size=chunk_size
+        )
+        base_near: t.Optional[FindHitsNear] = None
+    elif deformation_config.engine in ("numpy", "bvh"):
+        with profiling.stage("build_mold_mesh"):
+            mesh = build_mold_mesh(depth_arr, mold_config)
+        y_min, z_min = mesh.vertices[:, 1:].min(axis=0)
+        y_max, z_max = mesh.vertices[:, 1:].max(axis=0)
+        mask_frame = MaskFrame(mask_array, y_min=y_min, z_min=z_min, y_max=y_max, z_max=z_max)
+        bvh: t.Optional[BVH] = None
+
+        def polygon_bvh() -> BVH:
+            """built once, by the first search which needs it"""
+            nonlocal bvh
+            if bvh is None:
+                with profiling.stage("build_polygon_bvh"):
+                    bvh = build_polygon_bvh(mesh)
+            return bvh
+
+        def find_base(v: npt.NDArray[npt.Shape["*, 3"], npt.Float]) -> FarthestHits:
+            if deformation_config.engine == "bvh":
+                return find_farthest_intersections_bvh(
+                    v, mesh, mask_frame, bvh=polygon_bvh(), chunk_size=chunk_size, inside_test=inside_test
+                )
+            return find_farthest_intersections(v, mesh, mask_frame, chunk_size=chunk_size, inside_test=inside_test)
+
+        def find_near(
+            v: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+            box_min: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+            box_max: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        ) -> FarthestHits:
+            return find_farthest_intersections_near(
+                v, mesh, mask_frame, box_min, box_max, bvh=polygon_bvh(), chunk_size=chunk_size, inside_test=inside_test
+            )
+
+        base = find_base
+        base_near = find_near
+    else:
+        raise ValueError(f"{deformation_config.engine=} not supported without Blender!")
+
+    return MoldSearch(
+        base=base,
+        sub=functools.partial(
+            find_farthest_intersections,
+            mesh=sub_mesh,
+            mask_frame=mask_frame,
+            chunk_size=chunk_size,
+            inside_test=inside_test,
+        ),
+        base_near=base_near,
+    )
+
+
+def deform_template(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    depth_image: npt.NDArray[npt.Shape["*, *"], npt.Int],
+    deformation_config: DeformationConfig = DeformationConfig(),
+    mold_config: MoldConfig = MoldConfig(),
+    mask_image: t.Optional[npt.NDArray[npt.Shape["*, *"], npt.Int]] = None,
+    ray_directions: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None,
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """move template vertices onto the molds built from a depth image
+
+    Args:
+        vertices (np.ndarray): ``(V, 3)`` template vertices in world coordinates
+        depth_image (np.ndarray): rendered depth image (background is 255)
+        mask_image (np.ndarray, optional): ``create_mask(depth_image, background=255)`` if not given
+        ray_directions (np.ndarray, optional): unit directions of the rays through ``vertices``
+            (``TemplateCache.ray_directions``). The hits are found for them instead of ``vertices``.
+
+    Returns:
+        np.ndarray: ``(V, 3)`` moved vertices in world coordinates
+    """
+    search = build_mold_search(depth_image, deformation_config, mold_config, mask_image=mask_image)
+    with profiling.stage("move_vertices[base]"):
+        vertices = move_vertices(vertices, search.base, ray_directions=ray_directions)
+    with profiling.stage("move_vertices[sub]"):
+        return move_vertices(vertices, search.sub, ray_directions=ray_directions)
+
+
+def deform_template_multires(
+    hierarchy: TemplateHierarchy,
+    matrix_world: npt.NDArray[npt.Shape["4, 4"], npt.Float],
+    depth_image: npt.NDArray[npt.Shape["*, *"], npt.Int],
+    deformation_config: DeformationConfig = DeformationConfig(),
+    mold_config: MoldConfig = MoldConfig(),
+    mask_image: t.Optional[npt.NDArray[npt.Shape["*, *"], npt.Int]] = None,
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """``deform_template`` of the finest level of ``hierarchy`` with the coarse-to-fine search (``lib3d.multires``)
+
+    Returns:
+        np.ndarray: ``(V, 3)`` moved vertices of the finest level in world coordinates
+    """
+    search = build_mold_search(depth_image, deformation_config, mold_config, mask_image=mask_image)
+    return deform_coarse_to_fine(
+        hierarchy,
+        matrix_world,
+        find_base=search.base,
+        find_sub=search.sub,
+        find_base_near=search.base_near,
+        search_margin=deformation_config.multires_margin,
+    )
+
+
+def process(config: ConfigModel) -> ObjMesh:
+    """load the template and the depth image, deform the template and export it as ``config.output_filepath_obj``
+    (or append it to ``config.vertex_store.store_dir``)
+
+    The job is profiled into ``config.profile.output_path`` (see ``lib3d.profiling``).
+    """
+    with profiling.job(config.profile.output_path, name=str(config.input.depth_image_path)):
+        obj_info = config.input.objects[-1]  # the last object is the template (see load_obj.load_obj)
+        matrix = template_matrix_world(obj_info.location)
+        with profiling.stage("load_template"):
+            if config.input.use_template_cache:
+                template = load_template_cache(
+                    obj_info.obj_filepath, matrix_world=matrix, cache_path=config.input.template_cache_path
+                )
+            else:
+                template = TemplateCache.build(obj_info.obj_filepath, matrix_world=matrix)
+
+        with profiling.stage("read_depth_image"):
+            depth_image = read_depth_image(config.input.depth_image_path)
+        assert depth_image.ndim == 2, f"{depth_image.ndim=}"
+        with profiling.stage("create_mask"):
+            mask_image = create_mask(depth_image, background=255, size=config.deformation.mask_size)
+        if config.debug_mode:
+            filepath: Path = Path(config.debug.mask_image_path)
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            PIL.Image.fromarray((mask_image * 255).astype(np.uint8)).save(filepath)
+
+        faces: t.List[t.List[int]] = template.faces
+        if config.deformation.multires_levels > 0:
+            with profiling.stage("build_template_hierarchy"):
+                hierarchy = TemplateHierarchy.build(
+                    template.vertices, template.loop_vertices, template.loop_total, config.deformation.multires_levels
+                )
+            with profiling.stage("deform_template"):
+                world_vertices = deform_template_multires(
+                    hierarchy,
+                    matrix,
+                    depth_image,
+                    deformation_config=config.deformation,
+                    mold_config=config.mold,
+                    mask_image=mask_image,
+                )
+            faces = hierarchy.faces
+        else:
+            world_vertices = template.vertices @ matrix[:3, :3].T + matrix[:3, 3]
+            with profiling.stage("deform_template"):
+                world_vertices = deform_template(
+                    world_vertices,
+                    depth_image,
+                    deformation_config=config.deformation,
+                    mold_config=config.mold,
+                    mask_image=mask_image,
+                    ray_directions=template.ray_directions,
+                )
+        inverted = np.linalg.inv(matrix)
+        result = ObjMesh(
+            vertices=world_vertices @ inverted[:3, :3].T + inverted[:3, 3],
+            faces=faces,
+            name=obj_info.obj_name,
+        )
+        if config.vertex_store.store_dir is not None:
+            with profiling.stage("append_vertex_store"):
+                loops = MeshArrays.from_faces(result.vertices, result.faces)
+                store_writer = VertexStoreWriter(
+                    Path(config.vertex_store.store_dir).expanduser(),
+                    loops.loop_vertices,
+                    loops.loop_start,
+                    loops.loop_total,
+                    num_vertices=len(result.vertices),
+                    shard_capacity=config.vertex_store.shard_capacity,
+                )
+                with store_writer:  # vertex_store.FRAME (world coordinates; result.vertices are template-local)
+                    store_writer.append(
+                        key_from_depth_image_path(config.input.depth_image_path), blender_to_obj_axes(world_vertices)
+                    )
+        else:
+            with profiling.stage("write_obj"):
+                write_obj(config.output_filepath_obj, result)
+    return result
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    logging.basicConfig(
+        format="[%(asctime)s][%(levelname)s][%(filename)s:%(lineno)d] - %(message)s",
+        level=logging.WARNING,
+    )
+
+    profiling.start_job()
+    with profiling.stage("parse_config"):
+        config: ConfigModel = get_args(argv)
+    logger.info(f"{OmegaConf.to_yaml(config)=}")
+    process(config)
+
+
+if __name__ == "__main__":
+    main()
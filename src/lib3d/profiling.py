@@ -0,0 +1,192 @@
+"""Per-stage timing and counters of a job, written as one JSON line per job
+
+    profiling.start_job("00_depth0001")
+    with profiling.stage("load_obj"):
+        ...
+    profiling.count("rays", len(targets))
+    profiling.finish_job("output/profile.jsonl")
+
+``stage`` and ``count`` do nothing outside ``start_job`` / ``finish_job``. Nested stages are named with their
+parents (``load_obj/depth_map2plane``). A record looks like::
+
+    {"job": ..., "pid": ..., "start_time": ..., "total": seconds, "ok": true,
+     "stages": [{"name": ..., "seconds": ...}, ...], "counters": {"rays": ..., ...}, "meta": {...}}
+
+Summary of a whole run::
+
+    $ python -m lib3d.profiling output/profile.jsonl
+"""
+
+# Standard Library
+import argparse
+import contextlib
+import json
+import os
+import time
+import typing as t
+from collections import defaultdict
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+# Third Party Library
+import numpy as np
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_PathLike = t.Union[str, Path]
+
+
+class JobProfile:
+    def __init__(self, job: str = "", **meta: t.Any) -> None:
+        self.job = job
+        self.meta: t.Dict[str, t.Any] = dict(meta)
+        self.start_time: float = time.time()
+        self._start: float = time.perf_counter()
+        self.stages: t.List[t.Tuple[str, float]] = []
+        self.counters: t.Dict[str, int] = defaultdict(int)
+        self._stack: t.List[str] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> t.Iterator[None]:
+        self._stack.append(name)
+        full_name: str = "/".join(self._stack)
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((full_name, time.perf_counter() - start))
+            self._stack.pop()
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += int(n)
+
+    def to_dict(self, ok: bool = True) -> t.Dict[str, t.Any]:
+        return {
+            "job": self.job,
+            "pid": os.getpid(),
+            "start_time": self.start_time,
+            "total": time.perf_counter() - self._start,
+            "ok": ok,
+            "stages": [{"name": name, "seconds": seconds} for name, seconds in self.stages],
+            "counters": dict(self.counters),
+            "meta": self.meta,
+        }
+
+    def write(self, filepath: _PathLike, ok: bool = True) -> None:
+        """append one JSON line (a single ``write`` on an O_APPEND file, so parallel jobs can share the file)"""
+        filepath = Path(filepath)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        line: bytes = (json.dumps(self.to_dict(ok=ok)) + "\n").encode("utf-8")
+        fd = os.open(filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+_current: t.Optional[JobProfile] = None
+
+
+def start_job(job: str = "", **meta: t.Any) -> JobProfile:
+    global _current
+    _current = JobProfile(job, **meta)
+    return _current
+
+
+def current_job() -> t.Optional[JobProfile]:
+    return _current
+
+
+def finish_job(filepath: t.Optional[_PathLike], ok: bool = True, **meta: t.Any) -> t.Optional[JobProfile]:
+    """end the current job and append its record to ``filepath`` (nothing is written if it is None)"""
+    global _current
+    profile, _current = _current, None
+    if profile is None:
+        return None
+    profile.meta.update(meta)
+    if filepath is not None:
+        profile.write(filepath, ok=ok)
+    return profile
+
+
+@contextlib.contextmanager
+def job(filepath: t.Optional[_PathLike], name: str = "", **meta: t.Any) -> t.Iterator[JobProfile]:
+    """profile a job (continuing the one already started, e.g. before parsing the config) and write it at the end
+
+    The record has ``"ok": false`` if the job raised.
+    """
+    profile = _current if _current is not None else start_job()
+    profile.job = name
+    profile.meta.update(meta)
+    ok: bool = False
+    try:
+        yield profile
+        ok = True
+    finally:
+        finish_job(filepath, ok=ok)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> t.Iterator[None]:
+    if _current is None:
+        yield
+        return
+    with _current.stage(name):
+        yield
+
+
+def count(name: str, n: int = 1) -> None:
+    if _current is not None:
+        _current.count(name, n)
+
+
+def load_records(filepath: _PathLike) -> t.List[t.Dict[str, t.Any]]:
+    records: t.List[t.Dict[str, t.Any]] = []
+    with open(filepath, mode="rt") as f:
+        line: str
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def summarize(records: t.List[t.Dict[str, t.Any]], top: int = 5) -> str:
+    """per-stage statistics and the slowest jobs"""
+    seconds_per_stage: t.Dict[str, t.List[float]] = defaultdict(list)
+    counters: t.Dict[str, int] = defaultdict(int)
+    for record in records:
+        for s in record["stages"]:
+            seconds_per_stage[s["name"]].append(s["seconds"])
+        for name, n in record["counters"].items():
+            counters[name] += n
+
+    lines: t.List[str] = [
+        f"{len(records)} jobs ({sum(not record['ok'] for record in records)} failed)",
+        f"{'stage':<48} {'count':>7} {'total[s]':>10} {'mean[s]':>9} {'p95[s]':>9} {'max[s]':>9}",
+    ]
+    for name, seconds in sorted(seconds_per_stage.items(), key=lambda item: -sum(item[1])):
+        arr = np.array(seconds)
+        lines.append(
+            f"{name:<48} {len(arr):>7} {arr.sum():>10.2f} {arr.mean():>9.4f} "
+            f"{np.percentile(arr, 95):>9.4f} {arr.max():>9.4f}"
+        )
+    if counters:
+        lines.append("counters: " + ", ".join(f"{name}={n}" for name, n in sorted(counters.items())))
+    lines.append(f"slowest {top} jobs:")
+    for record in sorted(records, key=lambda record: -record["total"])[:top]:
+        lines.append(f"  {record['total']:>9.2f}s {record['job']}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="summarize a profile JSONL file")
+    parser.add_argument("filepath", type=lambda x: Path(x).expanduser())
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+    print(summarize(load_records(args.filepath), top=args.top))
+
+
+if __name__ == "__main__":
+    main()
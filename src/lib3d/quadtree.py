@@ -0,0 +1,131 @@
+# Standard Library
+import heapq
+import typing as t
+from logging import NullHandler
+from logging import getLogger
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+# Local Library
+from .geometry import MeshArrays
+from .mold import MOLD_Z_MAX
+from .mold import plane_lattice_heights
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+# (i0, i1, j0, j1): lattice index range of a cell, both ends included
+_Cell = t.Tuple[int, int, int, int]
+
+
+def bilinear_error(heights: npt.NDArray[npt.Shape["*, *"], npt.Float], cell: _Cell) -> float:
+    """max deviation of the lattice heights in the cell from the bilinear patch over its corners"""
+    i0, i1, j0, j1 = cell
+    block = heights[i0 : i1 + 1, j0 : j1 + 1]
+    u = np.linspace(0.0, 1.0, i1 - i0 + 1)[:, np.newaxis]
+    v = np.linspace(0.0, 1.0, j1 - j0 + 1)[np.newaxis, :]
+    patch = (
+        block[0, 0] * (1 - u) * (1 - v)
+        + block[-1, 0] * u * (1 - v)
+        + block[0, -1] * (1 - u) * v
+        + block[-1, -1] * u * v
+    )
+    return float(np.abs(block - patch).max())
+
+
+def split_cell(cell: _Cell) -> t.List[_Cell]:
+    i0, i1, j0, j1 = cell
+    i_ranges = [(i0, (i0 + i1) // 2), ((i0 + i1) // 2, i1)] if i1 - i0 > 1 else [(i0, i1)]
+    j_ranges = [(j0, (j0 + j1) // 2), ((j0 + j1) // 2, j1)] if j1 - j0 > 1 else [(j0, j1)]
+    return [(a, b, c, d) for (a, b) in i_ranges for (c, d) in j_ranges]
+
+
+def build_quadtree(
+    heights: npt.NDArray[npt.Shape["*, *"], npt.Float],
+    error_tolerance: float,
+    max_cells: int,
+) -> t.List[_Cell]:
+    """split the cell with the largest error first until every cell is within the tolerance or the budget is used"""
+    root: _Cell = (0, heights.shape[0] - 1, 0, heights.shape[1] - 1)
+    heap: t.List[t.Tuple[float, _Cell]] = [(-bilinear_error(heights, root), root)]
+    leaves: t.List[_Cell] = []
+    while heap:
+        neg_error, cell = heapq.heappop(heap)
+        children = split_cell(cell)
+        if -neg_error <= error_tolerance or len(children) == 1 or len(heap) + len(leaves) + 4 > max_cells:
+            leaves.append(cell)
+            continue
+        for child in children:
+            heapq.heappush(heap, (-bilinear_error(heights, child), child))
+    return leaves
+
+
+def adaptive_plane_mesh(
+    depth_arr: npt.NDArray[npt.Shape["*, *"], npt.Number],
+    z_max: float = MOLD_Z_MAX,
+    error_tolerance: float = 0.01,
+    max_faces: int = 20000,
+) -> MeshArrays:
+    """Mold mesh (object-local coordinates) tessellated with a quadtree over the depth image
+
+    The lattice is one cell per pixel (see ``heightfield.HeightField.from_depth_arr``). Cells are
+    split while the heights deviate from the bilinear patch over the cell corners by more than
+    ``error_tolerance``. Flat regions stay as a few large quads.
+
+    A cell whose edges carry corners of smaller neighbours (T-junctions) is emitted as a triangle fan
+    around its center instead of a quad, so the mesh has no cracks.
+
+    ``max_faces`` is a soft budget: the number of cells is capped at ``max_faces // 3`` since a cell
+    becomes one quad or a fan of usually 5 to 8 triangles.
+    """
+    im_h, im_w = depth_arr.shape[:2]
+    xs, ys, heights = plane_lattice_heights(depth_arr, num_x=im_h + 1, num_y=im_w + 1, z_max=z_max)
+    leaves = build_quadtree(heights, error_tolerance=error_tolerance, max_cells=max(1, max_faces // 3))
+
+    num_x, num_y = heights.shape
+    is_corner = np.zeros((num_x, num_y), dtype=bool)
+    for i0, i1, j0, j1 in leaves:
+        is_corner[[i0, i0, i1, i1], [j0, j1, j0, j1]] = True
+    # lattice vertices first (index i * num_y + j), fan centers are appended
+    x, y = np.meshgrid(xs, ys, indexing="ij")
+    vertices: t.List[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = [np.stack([x, y, heights], axis=-1).reshape(-1, 3)]
+    num_vertices: int = num_x * num_y
+
+    faces: t.List[t.List[int]] = []
+    for i0, i1, j0, j1 in leaves:
+        # boundary vertices counter-clockwise seen from +z, starting at (i0, j0)
+        boundary: t.List[t.Tuple[int, int]] = (
+            [(i, j0) for i in range(i0, i1) if is_corner[i, j0]]
+            + [(i1, j) for j in range(j0, j1) if is_corner[i1, j]]
+            + [(i, j1) for i in range(i1, i0, -1) if is_corner[i, j1]]
+            + [(i0, j) for j in range(j1, j0, -1) if is_corner[i0, j]]
+        )
+        boundary_ids = [i * num_y + j for (i, j) in boundary]
+        if len(boundary_ids) == 4:
+            faces.append(boundary_ids)
+            continue
+        center = np.array(
+            [
+                [
+                    (xs[i0] + xs[i1]) / 2,
+                    (ys[j0] + ys[j1]) / 2,
+                    (heights[i0, j0] + heights[i1, j0] + heights[i0, j1] + heights[i1, j1]) / 4,
+                ]
+            ]
+        )
+        vertices.append(center)
+        faces += [
+            [num_vertices, boundary_ids[k], boundary_ids[(k + 1) % len(boundary_ids)]] for k in range(len(boundary_ids))
+        ]
+        num_vertices += 1
+
+    # drop lattice vertices which are not used by any face
+    all_vertices = np.concatenate(vertices, axis=0)
+    used = np.zeros(len(all_vertices), dtype=bool)
+    used[[v for face in faces for v in face]] = True
+    new_index = np.cumsum(used) - 1
+    faces = [[int(new_index[v]) for v in face] for face in faces]
+    logger.info(f"{len(leaves)=}, {len(faces)=}, {int(used.sum())=}")
+    return MeshArrays.from_faces(all_vertices[used], faces)
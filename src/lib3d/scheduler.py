@@ -0,0 +1,177 @@
+"""asyncio scheduler for one-process-per-job commands (e.g. one Blender run per job)
+
+The child processes are awaited directly by the event loop, so no extra Python process is needed per job.
+
+- at most ``concurrency`` jobs run at once
+- a job running longer than ``timeout`` seconds is killed (with its process group)
+- a non-zero exit code is a failure; failed jobs are retried up to ``retries`` times with exponential backoff
+- stdout and stderr of each job go to its own log file (``log_dir/<job name>.log``, attempts are appended)
+"""
+
+# Standard Library
+import asyncio
+import os
+import re
+import signal
+import time
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+
+@dataclass
+class ScheduledJob:
+    name: str
+    cmd: t.List[str]
+    env: t.Optional[t.Dict[str, str]] = None  # added to the environment of this process
+
+
+@dataclass
+class ScheduledResult:
+    job: ScheduledJob
+    ok: bool
+    returncode: t.Optional[int]  # None if killed by the timeout
+    attempts: int
+    duration: float  # seconds, of the last attempt
+    error: t.Optional[str] = None
+    log_path: t.Optional[Path] = None
+
+
+def log_filename(name: str) -> str:
+    """a file name for a job name like "04530566/ffffe224/00_depth0001" """
+    return re.sub(r"[^0-9A-Za-z._-]+", "_", name).strip("_") + ".log"
+
+
+class Scheduler:
+    def __init__(
+        self,
+        concurrency: int,
+        timeout: t.Optional[float] = None,
+        retries: int = 0,
+        backoff: float = 5.0,
+        log_dir: t.Optional[Path] = None,
+        max_pending: t.Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            concurrency (int): the maximum number of jobs running at once
+            timeout (float, optional): wall-clock limit of one attempt in seconds (None: no limit)
+            retries (int): the number of retries of a failed job
+            backoff (float): seconds to wait before the first retry, doubled for every further retry
+            log_dir (Path, optional): directory of the per-job log files (None: inherit stdout and stderr)
+            max_pending (int, optional): the maximum number of jobs taken from ``jobs`` but not finished yet
+                (running or waiting for a retry; None: 2 * concurrency). The other jobs are not read yet.
+        """
+        if concurrency < 1:
+            raise ValueError(f"{concurrency=} not supported!")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.log_dir = log_dir
+        self.max_pending = 2 * concurrency if max_pending is None else max_pending
+        if self.max_pending < concurrency:
+            raise ValueError(f"{max_pending=} not supported!")
+
+    async def _attempt(self, job: ScheduledJob, log_file: t.Optional[t.TextIO]) -> t.Tuple[t.Optional[int], str]:
+        """run the command once
+
+        Returns:
+            (int | None, str): exit code (None on timeout) and an error message ("" on success)
+        """
+        process = await asyncio.create_subprocess_exec(
+            *job.cmd,
+            env=None if job.env is None else {**os.environ, **job.env},
+            stdout=log_file,
+            stderr=asyncio.subprocess.STDOUT if log_file is not None else None,
+            start_new_session=True,  # the whole process group is killed on timeout
+        )
+        try:
+            returncode = await asyncio.wait_for(process.wait(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            return None, f"killed after {self.timeout}s"
+        if returncode != 0:
+            return returncode, f"exited with {returncode=}"
+        return returncode, ""
+
+    async def _run_job(self, job: ScheduledJob, semaphore: asyncio.Semaphore) -> ScheduledResult:
+        log_path: t.Optional[Path] = None if self.log_dir is None else self.log_dir / log_filename(job.name)
+        returncode: t.Optional[int] = None
+        error: str = ""
+        duration: float = 0.0
+        attempt: int = 0
+        for attempt in range(1, self.retries + 2):
+            if attempt > 1:
+                delay: float = self.backoff * 2 ** (attempt - 2)
+                logger.warning(f"retry {job.name} in {delay:.1f}s ({attempt - 1}/{self.retries}): {error}")
+                await asyncio.sleep(delay)
+            async with semaphore:
+                start: float = time.perf_counter()
+                if log_path is None:
+                    returncode, error = await self._attempt(job, None)
+                else:
+                    log_path.parent.mkdir(parents=True, exist_ok=True)
+                    with open(log_path, mode="at") as log_file:
+                        log_file.write(f"##### attempt {attempt}: {' '.join(job.cmd)}\n")
+                        log_file.flush()
+                        returncode, error = await self._attempt(job, log_file)
+                duration = time.perf_counter() - start
+            if not error:
+                break
+        return ScheduledResult(
+            job=job,
+            ok=not error,
+            returncode=returncode,
+            attempts=attempt,
+            duration=duration,
+            error=error or None,
+            log_path=log_path,
+        )
+
+    async def _run(
+        self,
+        jobs: t.Iterable[ScheduledJob],
+        on_result: t.Optional[t.Callable[[ScheduledResult], None]],
+    ) -> t.List[ScheduledResult]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results: t.List[ScheduledResult] = []
+        pending: t.Set["asyncio.Task[ScheduledResult]"] = set()
+
+        async def collect() -> None:
+            nonlocal pending
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if on_result is not None:
+                    on_result(result)
+                results.append(result)
+
+        # only max_pending tasks at a time, however many jobs there are
+        for job in jobs:
+            if len(pending) >= self.max_pending:
+                await collect()
+            pending.add(asyncio.ensure_future(self._run_job(job, semaphore)))
+        while pending:
+            await collect()
+        return results
+
+    def run(
+        self,
+        jobs: t.Iterable[ScheduledJob],
+        on_result: t.Optional[t.Callable[[ScheduledResult], None]] = None,
+    ) -> t.List[ScheduledResult]:
+        """run all jobs; ``on_result`` is called as soon as each job has finished (results in completion order)
+
+        ``jobs`` is read lazily (e.g. a generator), ``max_pending`` jobs ahead of the finished ones.
+        """
+        return asyncio.run(self._run(jobs, on_result))
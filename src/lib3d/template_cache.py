@@ -0,0 +1,206 @@
+"""Precomputed template asset cache
+
+The template OBJ is parsed once and stored as a ``.npz`` file next to it::
+
+    $ python -m lib3d.template_cache template/template_ellipsoid.obj
+
+The cache holds the vertices (object-local, i.e. the OBJ coordinates), the faces, the unit directions of the rays
+from the origin through the world-space vertices, the bounding box and the SHA-256 of the OBJ file.
+``load_template_cache`` rebuilds it when the OBJ file has changed.
+
+A template vertex is only ever moved along its own ray, so the ray directions stay valid through every
+deformation pass and every depth image.
+"""
+
+# Standard Library
+import argparse
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+# Local Library
+from .fileio import atomic_write
+from .geometry import MeshArrays
+from .manifest import hash_file
+from .wavefront import OBJ_TO_BLENDER
+from .wavefront import read_obj
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_PathLike = t.Union[str, Path]
+
+CACHE_VERSION: int = 1
+
+
+def template_matrix_world(location: t.Sequence[float] = (0.0, 0.0, 0.0)) -> npt.NDArray[npt.Shape["4, 4"], npt.Float]:
+    """``matrix_world`` of a template imported with ``bpy.ops.import_scene.obj`` and moved to ``location``"""
+    matrix = OBJ_TO_BLENDER.copy()
+    matrix[:3, 3] = location
+    return matrix
+
+
+def default_cache_path(obj_filepath: _PathLike) -> Path:
+    """``template/template_ellipsoid.obj`` -> ``template/template_ellipsoid.cache.npz``"""
+    obj_filepath = Path(obj_filepath)
+    return obj_filepath.with_name(f"{obj_filepath.stem}.cache.npz")
+
+
+def unit_ray_directions(
+    world_vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """unit directions of the rays from the origin through the vertices (zero for a vertex at the origin)"""
+    lengths = np.linalg.norm(world_vertices, axis=1, keepdims=True)
+    return t.cast(
+        npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        np.divide(world_vertices, lengths, out=np.zeros_like(world_vertices), where=lengths > 0),
+    )
+
+
+@dataclass
+class TemplateCache:
+    source_hash: str  # SHA-256 of the OBJ file
+    name: str
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]  # object-local (OBJ file) coordinates
+    loop_vertices: npt.NDArray[npt.Shape["*"], npt.Int]  # faces, flattened
+    loop_total: npt.NDArray[npt.Shape["*"], npt.Int]  # the number of vertices of each face
+    matrix_world: npt.NDArray[npt.Shape["4, 4"], npt.Float]  # the matrix the ray directions are computed with
+    ray_directions: npt.NDArray[npt.Shape["*, 3"], npt.Float]  # world coordinates
+    bbox_min: npt.NDArray[npt.Shape["3"], npt.Float]  # object-local
+    bbox_max: npt.NDArray[npt.Shape["3"], npt.Float]
+
+    @classmethod
+    def build(
+        cls,
+        obj_filepath: _PathLike,
+        matrix_world: t.Optional[npt.NDArray[npt.Shape["4, 4"], npt.Float]] = None,
+    ) -> "TemplateCache":
+        obj_mesh = read_obj(obj_filepath)
+        if matrix_world is None:
+            matrix_world = template_matrix_world()
+        vertices = obj_mesh.vertices
+        return cls(
+            source_hash=hash_file(obj_filepath),
+            name=obj_mesh.name,
+            vertices=vertices,
+            loop_vertices=np.array([v for face in obj_mesh.faces for v in face], dtype=np.int64),
+            loop_total=np.array([len(face) for face in obj_mesh.faces], dtype=np.int64),
+            matrix_world=np.asarray(matrix_world, dtype=np.float64),
+            ray_directions=unit_ray_directions(vertices @ matrix_world[:3, :3].T + matrix_world[:3, 3]),
+            bbox_min=vertices.min(axis=0) if len(vertices) else np.zeros(3),
+            bbox_max=vertices.max(axis=0) if len(vertices) else np.zeros(3),
+        )
+
+    @property
+    def faces(self) -> t.List[t.List[int]]:
+        return [face.tolist() for face in np.split(self.loop_vertices, np.cumsum(self.loop_total)[:-1])]
+
+    def world_vertices(self) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+        return t.cast(
+            npt.NDArray[npt.Shape["*, 3"], npt.Float],
+            self.vertices @ self.matrix_world[:3, :3].T + self.matrix_world[:3, 3],
+        )
+
+    def mesh_arrays(self) -> MeshArrays:
+        """the template mesh in object-local coordinates"""
+        return MeshArrays.from_faces(self.vertices, self.faces)
+
+    def with_matrix_world(self, matrix_world: npt.NDArray[npt.Shape["4, 4"], npt.Float]) -> "TemplateCache":
+        """the same cache with the ray directions for another ``matrix_world``"""
+        if np.array_equal(matrix_world, self.matrix_world):
+            return self
+        matrix_world = np.asarray(matrix_world, dtype=np.float64)
+        return TemplateCache(
+            source_hash=self.source_hash,
+            name=self.name,
+            vertices=self.vertices,
+            loop_vertices=self.loop_vertices,
+            loop_total=self.loop_total,
+            matrix_world=matrix_world,
+            ray_directions=unit_ray_directions(self.vertices @ matrix_world[:3, :3].T + matrix_world[:3, 3]),
+            bbox_min=self.bbox_min,
+            bbox_max=self.bbox_max,
+        )
+
+    def save(self, filepath: _PathLike) -> None:
+        """write atomically (parallel workers may build the same cache)"""
+        with atomic_write(filepath) as f:
+            np.savez(
+                f,
+                version=np.array(CACHE_VERSION),
+                source_hash=np.array(self.source_hash),
+                name=np.array(self.name),
+                vertices=self.vertices,
+                loop_vertices=self.loop_vertices,
+                loop_total=self.loop_total,
+                matrix_world=self.matrix_world,
+                ray_directions=self.ray_directions,
+                bbox_min=self.bbox_min,
+                bbox_max=self.bbox_max,
+            )
+
+    @classmethod
+    def load(cls, filepath: _PathLike) -> "TemplateCache":
+        with np.load(filepath) as data:
+            if int(data["version"]) != CACHE_VERSION:
+                raise ValueError(f"{int(data['version'])=} not supported!")
+            return cls(
+                source_hash=str(data["source_hash"]),
+                name=str(data["name"]),
+                vertices=data["vertices"],
+                loop_vertices=data["loop_vertices"],
+                loop_total=data["loop_total"],
+                matrix_world=data["matrix_world"],
+                ray_directions=data["ray_directions"],
+                bbox_min=data["bbox_min"],
+                bbox_max=data["bbox_max"],
+            )
+
+
+def load_template_cache(
+    obj_filepath: _PathLike,
+    matrix_world: t.Optional[npt.NDArray[npt.Shape["4, 4"], npt.Float]] = None,
+    cache_path: t.Optional[_PathLike] = None,
+) -> TemplateCache:
+    """load the cache of the OBJ file, (re)building it if it is missing, broken or older than the OBJ file"""
+    if matrix_world is None:
+        matrix_world = template_matrix_world()
+    cache_path = default_cache_path(obj_filepath) if cache_path is None else Path(cache_path)
+
+    source_hash: str = hash_file(obj_filepath)
+    if cache_path.exists():
+        try:
+            cache = TemplateCache.load(cache_path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"rebuild {cache_path}: {e}")
+        else:
+            if cache.source_hash == source_hash:
+                return cache.with_matrix_world(matrix_world)
+            logger.info(f"rebuild {cache_path}: {obj_filepath} has changed")
+
+    cache = TemplateCache.build(obj_filepath, matrix_world=matrix_world)
+    cache.save(cache_path)
+    return cache
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="build the template asset cache")
+    parser.add_argument("obj_filepath", type=lambda x: Path(x).expanduser())
+    parser.add_argument("--cache_path", type=lambda x: Path(x).expanduser(), default=None)
+    parser.add_argument("--location", type=float, nargs=3, default=[0.0, 0.0, 0.0])
+    args = parser.parse_args()
+
+    cache_path: Path = default_cache_path(args.obj_filepath) if args.cache_path is None else args.cache_path
+    cache = TemplateCache.build(args.obj_filepath, matrix_world=template_matrix_world(args.location))
+    cache.save(cache_path)
+    print(f"{cache_path}: {len(cache.vertices)} vertices, {len(cache.loop_total)} faces")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,12 @@ import typing as t
 from dataclasses import dataclass
 from dataclasses import field
 
-# Third Party Library
-import bpy.types
+if t.TYPE_CHECKING:
+    # Third Party Library
+    import bpy.types
+
+    # Local Library
+    from .template_cache import TemplateCache
 
 
 @dataclass
@@ -18,14 +22,22 @@ class BpyContextSceneRenderConfig:
     # Blender internal engine for rendering
     # E.g. CYCLES, BLENDER_EEVEE, ...'
     engine: str = "BLENDER_EEVEE"
-    image_settings: BpyContextSceneRenderImageConfig = BpyContextSceneRenderImageConfig()
+    image_settings: BpyContextSceneRenderImageConfig = field(default_factory=BpyContextSceneRenderImageConfig)
     resolution_x: int = 600
     resolution_y: int = 600
 
 
+@dataclass
+class BpyContextSceneViewSettingsConfig:
+    # color management of the saved images. "Raw": none, so the 8-bit depth PNG holds the mapped depth as it is
+    # (lib3d.depth.depth_to_image); "Standard" and "Filmic" (Blender's default) bend it
+    view_transform: str = "Raw"
+
+
 @dataclass
 class BpyContextSceneConfig:
     render: BpyContextSceneRenderConfig
+    view_settings: BpyContextSceneViewSettingsConfig = field(default_factory=BpyContextSceneViewSettingsConfig)
 
 
 @dataclass
@@ -49,6 +61,9 @@ class InputObjectConfig:
 class InputConfig:
     objects: t.List[InputObjectConfig]
     depth_image_path: str  # "data/depth.png"
+    # load the template (the last object) from lib3d.template_cache instead of importing the OBJ file
+    use_template_cache: bool = False
+    template_cache_path: t.Optional[str] = None  # None: "<obj stem>.cache.npz" next to the OBJ file
 
 
 @dataclass
@@ -58,6 +73,71 @@ class DebugConfig:
     blend_filepath: str
 
 
+@dataclass
+class DeformationConfig:
+    # "python": the original per-vertex, per-polygon loop
+    # "numpy": batched intersection engine (lib3d.intersection)
+    # "bvh": "numpy" + a bounding volume hierarchy over the mold polygons (lib3d.bvh)
+    # "heightfield": intersect the depth image directly without mold meshes (lib3d.heightfield)
+    engine: str = "numpy"
+    chunk_size: int = 262144  # max (vertex, polygon) pairs processed at once by the numpy engine
+    # the number of cuts of the heightfield lattice. None: one cell per pixel
+    heightfield_resolution: t.Optional[int] = None
+    # square kernel of the mask dilation (odd, 1: no dilation)
+    mask_size: int = 5
+    # point-in-polygon test of the numpy, bvh engines and the sub mold
+    # "angle_sum": the test of the original loop (also accepts some points just outside the polygon)
+    # "edge_function": exact winding-number test (lib3d.geometry.inside_polygon_edge_function)
+    inside_test: str = "angle_sum"
+    # coarse-to-fine deformation of the template subdivided multires_levels times (lib3d.multires, no Blender)
+    multires_levels: int = 0  # 0: the template as it is
+    multires_margin: float = 2.0  # neighborhood of the parents' hits (relative to the spacing of the rays)
+
+
+@dataclass
+class MoldConfig:
+    # "subdivide": bmesh subdivision and a per-vertex loop (load_obj.depth_map2plane)
+    # "array": vertex grid computed with NumPy and written in bulk (load_obj.depth_map2plane_array)
+    # "quadtree": adaptive tessellation of the depth image without decimation (lib3d.quadtree)
+    builder: str = "subdivide"
+    grid_resolution: int = 135  # the number of cuts; (grid_resolution + 2)^2 vertices
+    decimate_ratio: float = 0.1  # ratio of the DECIMATE modifier (1.0: no decimation)
+    error_tolerance: float = 0.01  # quadtree: max height error of a cell (z_max = 1.0)
+    max_faces: int = 20000  # quadtree: face budget
+
+
+@dataclass
+class BatchConfig:
+    # process many depth images in one process (scripts/processing-template/main.py)
+    # list file: one "<depth_image_path> <output_filepath_obj>" pair per line (tab separated if a path has spaces)
+    list_filepath: t.Optional[str] = None
+    # or every depth image matching the glob under root_dir ("**/depth_pack.npy": every view of the depth packs).
+    # The output is "<output_dir>/<relative dir>/<stem>.obj" (same layout as main_parallel.py)
+    root_dir: t.Optional[str] = None
+    glob: str = "**/*_depth0001.png"
+    output_dir: t.Optional[str] = None
+    # or every view of one model ("<category>/<model>/rendering", lib3d.depth.model_depth_views).
+    # The output is "<output_dir>/<view>_depth0001.obj"
+    model_dir: t.Optional[str] = None
+    depth_format: str = "png"  # of model_dir: "png", "npy" or "pack"
+    views: t.List[str] = field(default_factory=list)  # of model_dir: only these views (empty: all)
+    metadata_filepath: t.Optional[str] = None  # the viewports (default: "<model_dir>/rendering_metadata.txt")
+
+
+@dataclass
+class ProfileConfig:
+    # append per-stage timings and counters of every job as one JSON line (lib3d.profiling). None: disabled
+    output_path: t.Optional[str] = None
+
+
+@dataclass
+class VertexStoreConfig:
+    # append the deformed template vertices to a sharded store (lib3d.vertex_store) instead of writing
+    # output_filepath_obj. The key is (category, model, view) of the depth image path. None: disabled
+    store_dir: t.Optional[str] = None
+    shard_capacity: int = 65536  # rows per shard file
+
+
 @dataclass
 class ConfigModel:
     config: str  # default config filepath
@@ -68,13 +148,20 @@ class ConfigModel:
     output_filepath_obj: str  # ./sample_output.obj
     debug_mode: bool = True
     # debug: DebugConfig = DebugConfig()
+    deformation: DeformationConfig = field(default_factory=DeformationConfig)
+    mold: MoldConfig = field(default_factory=MoldConfig)
+    batch: BatchConfig = field(default_factory=BatchConfig)
+    profile: ProfileConfig = field(default_factory=ProfileConfig)
+    vertex_store: VertexStoreConfig = field(default_factory=VertexStoreConfig)
 
 
 @dataclass
 class BlenderMainReturn:
-    template_obj: bpy.types.Object
-    mold_obj_base: bpy.types.Object
-    mold_obj_sub: bpy.types.Object
+    template_obj: "bpy.types.Object"
+    # None if the molds are not needed (deformation.engine == "heightfield")
+    mold_obj_base: t.Optional["bpy.types.Object"]
+    mold_obj_sub: t.Optional["bpy.types.Object"]
+    template_cache: t.Optional["TemplateCache"] = None  # if input.use_template_cache
 
 
 @dataclass
@@ -94,6 +181,15 @@ class DebugRenderRGBConfig:
     blend_filepath: str
 
 
+@dataclass
+class DepthOutputConfig:
+    # "png": 8-bit depth mapped to 0-255 ("<view>_depth0001.png")
+    # "npy": raw linear float depth without quantization ("<view>_depth0001.npy", see lib3d.depth)
+    # "pack": the raw depth of every view of a model in one array ("depth_pack.npy" and "depth_pack.json")
+    formats: t.List[str] = field(default_factory=lambda: ["png"])
+    dtype: str = "float32"  # of "npy" and "pack": "float32" or "float16"
+
+
 @dataclass
 class RenderRGBDConfig:
     bpy: BpyConfig
@@ -105,3 +201,10 @@ class RenderRGBDConfig:
 
     debug_mode: bool
     debug: t.Optional[DebugRenderRGBConfig] = None
+    # render several models in one session (metadata_filepath is used if both are empty)
+    metadata_filepaths: t.List[str] = field(default_factory=list)
+    metadata_list_filepath: t.Optional[str] = None  # one metadata filepath per line
+    profile: ProfileConfig = field(default_factory=ProfileConfig)
+    # binary cache of the imported model.obj files (lib3d.model_cache). None: always import the OBJ file
+    model_cache_dir: t.Optional[str] = None
+    depth_output: DepthOutputConfig = field(default_factory=DepthOutputConfig)
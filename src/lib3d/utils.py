@@ -5,15 +5,26 @@ import typing as t
 from logging import NullHandler
 from logging import getLogger
 from math import pi
+from pathlib import Path
 
 # Third Party Library
 import bmesh  # type: ignore # no stub file
 import bpy
 import mathutils
+import nptyping as npt
 import numpy as np
-from sympy.geometry.line import Line3D
-from sympy.geometry.plane import Plane
-from sympy.geometry.point import Point3D
+
+# Local Library
+from .geometry import MeshArrays
+from .geometry import close_vertex_pairs
+from .geometry import project_points_on_plane
+from .geometry import weld_vertices
+from .model_cache import CachedMesh
+from .model_cache import ModelCache
+from .types import VertexStoreConfig
+from .vertex_store import VertexStoreWriter
+from .wavefront import ObjWriter
+from .wavefront import blender_to_obj_axes
 
 logger = getLogger(__name__)
 logger.addHandler(NullHandler())
@@ -31,15 +42,13 @@ def get_randomint_point(
     return mathutils.Vector((random.randint(0, 100), random.randint(0, 100), random.randint(0, 100)))
 
 
-def sampling_on_plane(p1: Point3D, normal_vector: Point3D) -> t.Tuple[float, float, float]:
-    plane: Plane = t.cast(Plane, Plane(p1, normal_vector))  # type: ignore # error: Call to untyped function
-    n: Point3D = t.cast(Point3D, plane.normal_vector)
-    # sample_x = Point3D(np.random.randint(3, 50, size=3))
-    sample_x: Point3D = Point3D(np.random.rand(3))  # type: ignore # error: Call to untyped function
-    # TODO: tkitou
-    line: Line3D = Line3D(sample_x, sample_x + 2 * Point3D(n))  # type: ignore # error: Call to untyped function
-    intersection: Point3D = t.cast(Point3D, plane.intersection(line)[0])  # type: ignore # error: Call to untyped function
-    return (float(intersection.x), float(intersection.y), float(intersection.z))
+def sampling_on_plane(p1: t.Sequence[float], normal_vector: t.Sequence[float]) -> t.Tuple[float, float, float]:
+    """a random point of the unit cube (``np.random.rand``) projected onto the plane through ``p1``
+
+    ``geometry.sample_points_on_plane`` returns many points at once with a seedable generator.
+    """
+    (x, y, z) = project_points_on_plane(np.random.rand(1, 3), p1, normal_vector)[0]
+    return (float(x), float(y), float(z))
 
 
 _LocationLike = t.TypeVar("_LocationLike", t.List[int], t.Tuple[float, float, float], mathutils.Vector)
@@ -59,21 +68,32 @@ def create_mesh_object(
     edges: t.Optional[t.List[t.Tuple[int, int]]] = None,
     faces: t.Optional[t.List[t.Sequence[int]]] = None,
     scene_collection_name: str = "Collection",
+    weld: bool = False,
+    merge_distance: float = 0.001,
 ) -> None:
+    """create an object from vertex, edge and face lists
+
+    Vertices closer than ``merge_distance`` are found with a hashed grid (``geometry.close_vertex_pairs``).
+    If ``weld`` they are merged and the edges and faces are remapped (``geometry.weld_vertices``);
+    otherwise no object is created.
+    """
     if edges is None:
         edges = []
     if faces is None:
         faces = []
+    coords = np.array([tuple(v) for v in vertices], dtype=np.float64).reshape(-1, 3)
+    if weld:
+        coords, edges, faces = weld_vertices(coords, edges, faces, tolerance=merge_distance)
+    else:
+        pairs = close_vertex_pairs(coords, tolerance=merge_distance)
+        if len(pairs) > 0:
+            i, j = pairs[0].tolist()
+            err_msg: str = f"index {i=}, {j=} are same"
+            logger.error(err_msg)
+            # raise ValueError(err_msg)
+            return
     new_mesh = bpy.data.meshes.new(f"{name}_mesh")
-    for i in range(0, len(vertices) - 1):
-        for j in range(i + 1, len(vertices)):
-            diff: mathutils.Vector = vertices[i] - vertices[j]
-            if diff.length < 0.001:
-                err_msg: str = f"index {i=}, {j=} are same"
-                logger.error(err_msg)
-                # raise ValueError(err_msg)
-                return
-    new_mesh.from_pydata(vertices, edges, faces)
+    new_mesh.from_pydata(coords.tolist(), edges, faces)
     # new_mesh.update()
 
     new_object = bpy.data.objects.new(f"{name}_object", new_mesh)
@@ -132,3 +152,310 @@ def subdivide_obj(obj: bpy.types.Object, num_cuts: int = 1) -> None:
     bmesh.ops.subdivide_edges(bm, edges=bm.edges, cuts=num_cuts, use_grid_fill=True)
     bm.to_mesh(obj.data)
     obj.update_from_editmode()
+
+
+def get_vertices_array(obj: bpy.types.Object) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """object-local vertex coordinates as an ``(N, 3)`` array"""
+    co = np.empty(len(obj.data.vertices) * 3, dtype=np.float32)
+    obj.data.vertices.foreach_get("co", co)
+    return t.cast(npt.NDArray[npt.Shape["*, 3"], npt.Float], co.reshape(-1, 3).astype(np.float64))
+
+
+def set_vertices_array(obj: bpy.types.Object, vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]) -> None:
+    """overwrite object-local vertex coordinates with an ``(N, 3)`` array"""
+    obj.data.vertices.foreach_set("co", np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1))
+    obj.data.update()
+
+
+def get_matrix_world_array(obj: bpy.types.Object) -> npt.NDArray[npt.Shape["4, 4"], npt.Float]:
+    return t.cast(npt.NDArray[npt.Shape["4, 4"], npt.Float], np.array(obj.matrix_world, dtype=np.float64))
+
+
+def get_mesh_arrays(obj: bpy.types.Object) -> MeshArrays:
+    """polygons of the object in world coordinates"""
+    mesh: bpy.types.Mesh = obj.data
+    num_polygons: int = len(mesh.polygons)
+    loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vertices)
+    loop_start = np.empty(num_polygons, dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", loop_start)
+    loop_total = np.empty(num_polygons, dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_total)
+    normals = np.empty(num_polygons * 3, dtype=np.float32)
+    mesh.polygons.foreach_get("normal", normals)
+    normals_arr = normals.reshape(-1, 3).astype(np.float64)
+
+    return MeshArrays(
+        vertices=get_vertices_array(obj),
+        loop_vertices=loop_vertices.astype(np.int64),
+        loop_start=loop_start.astype(np.int64),
+        loop_total=loop_total.astype(np.int64),
+        world_normals=normals_arr,
+        local_normals=normals_arr.copy(),
+    ).transformed(get_matrix_world_array(obj))
+
+
+def get_obj_file_vertices(obj: bpy.types.Object) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """vertices in the coordinates ``bpy.ops.export_scene.obj`` writes (world coordinates, Y up)"""
+    matrix = get_matrix_world_array(obj)
+    return blender_to_obj_axes(get_vertices_array(obj) @ matrix[:3, :3].T + matrix[:3, 3])
+
+
+def get_loop_arrays(
+    obj: bpy.types.Object,
+) -> t.Tuple[
+    npt.NDArray[npt.Shape["*"], npt.Int], npt.NDArray[npt.Shape["*"], npt.Int], npt.NDArray[npt.Shape["*"], npt.Int]
+]:
+    """(loop_vertices, loop_start, loop_total) of the object's mesh (see ``geometry.MeshArrays``)"""
+    mesh: bpy.types.Mesh = obj.data
+    loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vertices)
+    loop_start = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", loop_start)
+    loop_total = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_total)
+    return loop_vertices, loop_start, loop_total
+
+
+def new_obj_writer(obj: bpy.types.Object) -> ObjWriter:
+    """an OBJ writer with the faces of the object (for objects whose vertices move but whose topology does not)"""
+    return ObjWriter.from_loops(*get_loop_arrays(obj), name=obj.name)
+
+
+def new_vertex_store_writer(obj: bpy.types.Object, store_config: VertexStoreConfig) -> VertexStoreWriter:
+    """a writer of ``lib3d.vertex_store`` with the faces of the object"""
+    assert store_config.store_dir is not None
+    return VertexStoreWriter(
+        Path(store_config.store_dir).expanduser(),
+        *get_loop_arrays(obj),
+        num_vertices=len(obj.data.vertices),
+        shard_capacity=store_config.shard_capacity,
+    )
+
+
+def new_mesh_object(
+    name: str,
+    mesh: MeshArrays,
+    collection: t.Optional[bpy.types.Collection] = None,
+) -> bpy.types.Object:
+    """create an object from mesh arrays with bulk ``foreach_set`` calls
+
+    ``mesh.vertices`` are used as object-local coordinates.
+    The object is linked to ``collection`` (default: the active collection) and made active.
+    """
+    new_mesh: bpy.types.Mesh = bpy.data.meshes.new(f"{name}_mesh")
+    new_mesh.vertices.add(len(mesh.vertices))
+    new_mesh.vertices.foreach_set("co", np.ascontiguousarray(mesh.vertices, dtype=np.float32).reshape(-1))
+    new_mesh.loops.add(len(mesh.loop_vertices))
+    new_mesh.loops.foreach_set("vertex_index", mesh.loop_vertices.astype(np.int32))
+    new_mesh.polygons.add(mesh.num_polygons)
+    new_mesh.polygons.foreach_set("loop_start", mesh.loop_start.astype(np.int32))
+    new_mesh.polygons.foreach_set("loop_total", mesh.loop_total.astype(np.int32))
+    new_mesh.update(calc_edges=True)
+
+    new_object: bpy.types.Object = bpy.data.objects.new(name, new_mesh)
+    if collection is None:
+        collection = bpy.context.collection
+    collection.objects.link(new_object)
+    bpy.ops.object.select_all(action="DESELECT")
+    new_object.select_set(True)
+    bpy.context.view_layer.objects.active = new_object
+    return new_object
+
+
+# settings of ``PrincipledBSDFWrapper`` (the wrapper ``bpy.ops.import_scene.obj`` sets up materials with)
+_MATERIAL_VALUES: t.Tuple[str, ...] = (
+    "base_color",
+    "specular",
+    "specular_tint",
+    "roughness",
+    "metallic",
+    "ior",
+    "transmission",
+    "alpha",
+    "emission_color",
+    "emission_strength",
+    "normalmap_strength",
+)
+_MATERIAL_TEXTURES: t.Tuple[str, ...] = (
+    "base_color_texture",
+    "specular_texture",
+    "roughness_texture",
+    "metallic_texture",
+    "ior_texture",
+    "transmission_texture",
+    "alpha_texture",
+    "emission_color_texture",
+    "emission_strength_texture",
+    "normalmap_texture",
+)
+
+
+def get_material_settings(material: bpy.types.Material) -> t.Dict[str, t.Any]:
+    """the settings of the material's Principled BSDF and its image textures (JSON serializable)"""
+    # Third Party Library
+    from bpy_extras import node_shader_utils
+
+    wrapper = node_shader_utils.PrincipledBSDFWrapper(material, is_readonly=True)
+    settings: t.Dict[str, t.Any] = {
+        "blend_method": material.blend_method,
+        "use_backface_culling": material.use_backface_culling,
+        "diffuse_color": list(material.diffuse_color),
+        "values": {},
+        "textures": {},
+    }
+    for name in _MATERIAL_VALUES:
+        if hasattr(wrapper, name):
+            value = getattr(wrapper, name)
+            settings["values"][name] = list(value) if hasattr(value, "__len__") else float(value)
+    for name in _MATERIAL_TEXTURES:
+        texture = getattr(wrapper, name, None)
+        if texture is None or texture.image is None:
+            continue
+        settings["textures"][name] = {
+            "filepath": bpy.path.abspath(texture.image.filepath, library=texture.image.library),
+            "extension": texture.extension,
+            "translation": list(texture.translation),
+            "scale": list(texture.scale),
+        }
+    return settings
+
+
+def new_material(name: str, settings: t.Dict[str, t.Any]) -> bpy.types.Material:
+    """a material from ``get_material_settings``"""
+    # Third Party Library
+    from bpy_extras import node_shader_utils
+
+    material: bpy.types.Material = bpy.data.materials.new(name)
+    material.blend_method = settings["blend_method"]
+    material.use_backface_culling = settings["use_backface_culling"]
+    material.diffuse_color = settings["diffuse_color"]
+    wrapper = node_shader_utils.PrincipledBSDFWrapper(material, is_readonly=False)
+    for key, value in settings["values"].items():
+        if hasattr(wrapper, key):
+            setattr(wrapper, key, value)
+    for key, texture_settings in settings["textures"].items():
+        try:
+            image = bpy.data.images.load(texture_settings["filepath"], check_existing=True)
+        except RuntimeError as e:  # the importer also goes on without a missing image
+            logger.warning(f"{material.name=}: {e}")
+            continue
+        texture = getattr(wrapper, key)
+        texture.image = image
+        texture.texcoords = "UV"
+        texture.extension = texture_settings["extension"]
+        texture.translation = texture_settings["translation"]
+        texture.scale = texture_settings["scale"]
+    return material
+
+
+def model_cache_from_objects(objects: t.Sequence[bpy.types.Object], source_signature: str) -> ModelCache:
+    """the arrays of imported mesh objects and the settings of their materials"""
+    cache = ModelCache(source_signature=source_signature)
+    for obj in objects:
+        if obj.type != "MESH":
+            continue
+        mesh: bpy.types.Mesh = obj.data
+        num_loops: int = len(mesh.loops)
+        num_polygons: int = len(mesh.polygons)
+
+        loop_vertices = np.empty(num_loops, dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertices)
+        loop_start = np.empty(num_polygons, dtype=np.int32)
+        mesh.polygons.foreach_get("loop_start", loop_start)
+        loop_total = np.empty(num_polygons, dtype=np.int32)
+        mesh.polygons.foreach_get("loop_total", loop_total)
+        use_smooth = np.empty(num_polygons, dtype=bool)
+        mesh.polygons.foreach_get("use_smooth", use_smooth)
+        material_index = np.empty(num_polygons, dtype=np.int32)
+        mesh.polygons.foreach_get("material_index", material_index)
+
+        uvs: t.Optional[npt.NDArray[npt.Shape["*, 2"], npt.Float]] = None
+        if mesh.uv_layers.active is not None:
+            uvs = np.empty(num_loops * 2, dtype=np.float32)
+            mesh.uv_layers.active.data.foreach_get("uv", uvs)
+            uvs = uvs.reshape(-1, 2)
+        loop_normals: t.Optional[npt.NDArray[npt.Shape["*, 3"], npt.Float]] = None
+        if mesh.has_custom_normals:
+            mesh.calc_normals_split()
+            loop_normals = np.empty(num_loops * 3, dtype=np.float32)
+            mesh.loops.foreach_get("normal", loop_normals)
+            loop_normals = loop_normals.reshape(-1, 3)
+
+        material_names: t.List[str] = []
+        for material in mesh.materials:
+            if material is not None and material.name not in cache.materials:
+                cache.materials[material.name] = get_material_settings(material)
+            material_names.append("" if material is None else material.name)
+
+        cache.meshes.append(
+            CachedMesh(
+                name=obj.name,
+                matrix_world=get_matrix_world_array(obj),
+                vertices=get_vertices_array(obj).astype(np.float32),
+                loop_vertices=loop_vertices,
+                loop_start=loop_start,
+                loop_total=loop_total,
+                use_smooth=use_smooth,
+                material_index=material_index,
+                material_names=material_names,
+                uvs=uvs,
+                loop_normals=loop_normals,
+            )
+        )
+    return cache
+
+
+def new_objects_from_model_cache(
+    cache: ModelCache,
+    collection: t.Optional[bpy.types.Collection] = None,
+) -> t.List[bpy.types.Object]:
+    """create the objects of ``model_cache_from_objects`` with bulk ``foreach_set`` calls (they are selected)"""
+    if collection is None:
+        collection = bpy.context.collection
+    materials: t.Dict[str, bpy.types.Material] = {
+        name: new_material(name, settings) for name, settings in cache.materials.items()
+    }
+
+    bpy.ops.object.select_all(action="DESELECT")
+    objects: t.List[bpy.types.Object] = []
+    for cached in cache.meshes:
+        mesh: bpy.types.Mesh = bpy.data.meshes.new(cached.name)
+        mesh.vertices.add(len(cached.vertices))
+        mesh.vertices.foreach_set("co", np.ascontiguousarray(cached.vertices, dtype=np.float32).reshape(-1))
+        mesh.loops.add(len(cached.loop_vertices))
+        mesh.loops.foreach_set("vertex_index", cached.loop_vertices.astype(np.int32))
+        mesh.polygons.add(len(cached.loop_start))
+        mesh.polygons.foreach_set("loop_start", cached.loop_start.astype(np.int32))
+        mesh.polygons.foreach_set("loop_total", cached.loop_total.astype(np.int32))
+        mesh.polygons.foreach_set("use_smooth", cached.use_smooth.astype(bool))
+        mesh.polygons.foreach_set("material_index", cached.material_index.astype(np.int32))
+        for material_name in cached.material_names:
+            mesh.materials.append(materials.get(material_name))
+        if cached.uvs is not None:
+            mesh.uv_layers.new(name="UVMap").data.foreach_set(
+                "uv", np.ascontiguousarray(cached.uvs, dtype=np.float32).reshape(-1)
+            )
+        mesh.update(calc_edges=True)
+        if cached.loop_normals is not None:
+            mesh.create_normals_split()
+            mesh.normals_split_custom_set(cached.loop_normals)
+            mesh.use_auto_smooth = True
+
+        obj: bpy.types.Object = bpy.data.objects.new(cached.name, mesh)
+        obj.matrix_world = mathutils.Matrix(cached.matrix_world.tolist())
+        collection.objects.link(obj)
+        obj.select_set(True)
+        objects.append(obj)
+    if objects:
+        bpy.context.view_layer.objects.active = objects[0]
+    return objects
+
+
+def reset_scene() -> None:
+    """bring the file back to the factory startup scene (default cube, camera and light)
+
+    Used by long-lived workers between jobs. Unlike ``bpy.ops.wm.read_factory_settings`` the preferences
+    and the registered addons are kept.
+    """
+    bpy.ops.wm.read_homefile(use_factory_startup=True, use_empty=False)
@@ -0,0 +1,345 @@
+"""Sharded store of deformed template vertices
+
+Every output of processing-template has the topology of the template, so only the vertices are stored::
+
+    <store_dir>/
+        meta.json                   # the number of vertices, the shard capacity, the coordinate frame
+        faces.npz                   # the faces (loop_vertices, loop_start, loop_total), stored once
+        shards/<id>.npy             # float32 (shard_capacity, V, 3), memory-mappable
+        shards/<id>.index.jsonl     # {"key": [category, model, view], "row": ..., "time": unix time} per written row
+
+Parallel writers are safe: a writer holds an exclusive ``flock`` on the shard it appends to, so each shard has
+one writer at a time. A row is written with ``pwrite`` before its index line is appended, so an index line
+always points to a complete row. A shard that is not full is continued by the next writer (the lock is released
+when the writer closes or dies). The last record of a key wins.
+
+The vertices are in the frame ``FRAME`` (recorded in meta.json): world coordinates in the axes of the OBJ files,
+i.e. what ``bpy.ops.export_scene.obj`` writes for the deformed template (``utils.get_obj_file_vertices``,
+``wavefront.blender_to_obj_axes``). Both processing backends write this frame, wherever the template is placed.
+
+``compact`` copies every indexed row into one shard, which a data loader opens as a single memory map::
+
+    $ python -m lib3d.vertex_store compact output/vertex_store output/vertex_store_compact
+"""
+
+# Standard Library
+import argparse
+import fcntl
+import json
+import os
+import time
+import typing as t
+import uuid
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+# Local Library
+from .depth import split_depth_pack_path
+from .fileio import atomic_write
+from .wavefront import ObjMesh
+from .wavefront import ObjWriter
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_PathLike = t.Union[str, Path]
+Key = t.Tuple[str, str, str]  # (category, model, view)
+
+STORE_VERSION: int = 1
+FRAME: str = "obj_world"  # world coordinates, OBJ axes (Y up)
+DTYPE: np.dtype = np.dtype("<f4")
+
+
+def key_from_depth_image_path(depth_image_path: _PathLike) -> Key:
+    """``<category>/<model>/rendering/00_depth0001.png`` (the renderer's layout) -> ("<category>", "<model>", "00")
+
+    A view of a depth pack (``<category>/<model>/rendering/depth_pack.npy#00``) has the same key.
+    """
+    depth_image_path = Path(depth_image_path)
+    pack_view = split_depth_pack_path(depth_image_path)
+    view: str = depth_image_path.stem.split("_depth", 1)[0] if pack_view is None else pack_view[1]
+    return (depth_image_path.parents[2].name, depth_image_path.parents[1].name, view)
+
+
+def _read_last_line(filepath: Path, block_size: int = 4096) -> t.Optional[str]:
+    """the last complete line of a file (None if there is none)"""
+    with open(filepath, mode="rb") as f:
+        size: int = f.seek(0, os.SEEK_END)
+        read_size: int = min(size, block_size)
+        while True:
+            f.seek(size - read_size)
+            lines: t.List[bytes] = f.read(read_size).split(b"\n")
+            # the first line may be cut by the block boundary, the last one is "" (or cut by a crash)
+            complete = [line for line in lines[(1 if read_size < size else 0) : -1] if line.strip()]
+            if complete:
+                return complete[-1].decode("utf-8")
+            if read_size >= size:
+                return None
+            read_size = min(size, 2 * read_size)
+
+
+class _Shard:
+    def __init__(self, path: Path, fd: int, num_rows: int, capacity: int, row_nbytes: int, data_offset: int) -> None:
+        self.path = path
+        self.fd = fd  # holds the lock
+        self.num_rows = num_rows
+        self.capacity = capacity
+        self.row_nbytes = row_nbytes
+        self.data_offset = data_offset
+
+    @property
+    def index_path(self) -> Path:
+        return self.path.with_suffix(".index.jsonl")
+
+
+class VertexStoreWriter:
+    def __init__(
+        self,
+        store_dir: _PathLike,
+        loop_vertices: npt.NDArray[npt.Shape["*"], npt.Int],
+        loop_start: npt.NDArray[npt.Shape["*"], npt.Int],
+        loop_total: npt.NDArray[npt.Shape["*"], npt.Int],
+        num_vertices: int,
+        shard_capacity: int = 65536,
+    ) -> None:
+        """
+        Args:
+            loop_vertices, loop_start, loop_total: the faces of the template (see ``geometry.MeshArrays``)
+            shard_capacity (int): rows per shard (used when the store is created)
+
+        Raises:
+            ValueError: the store holds another topology
+        """
+        self.store_dir = Path(store_dir)
+        (self.store_dir / "shards").mkdir(parents=True, exist_ok=True)
+        faces: t.Dict[str, npt.NDArray[npt.Shape["*"], npt.Int]] = {
+            "loop_vertices": np.asarray(loop_vertices, dtype=np.int64),
+            "loop_start": np.asarray(loop_start, dtype=np.int64),
+            "loop_total": np.asarray(loop_total, dtype=np.int64),
+        }
+        meta: t.Dict[str, t.Any] = {
+            "version": STORE_VERSION,
+            "num_vertices": int(num_vertices),
+            "shard_capacity": int(shard_capacity),
+            "dtype": DTYPE.str,
+            "frame": FRAME,
+        }
+        if not (self.store_dir / "meta.json").exists():  # meta.json is written last
+            # the first writer wins
+            with atomic_write(self.store_dir / "faces.npz", overwrite=False) as f:
+                np.savez(f, **faces)
+            with atomic_write(self.store_dir / "meta.json", overwrite=False) as f:
+                f.write(json.dumps(meta).encode("utf-8"))
+
+        self.meta: t.Dict[str, t.Any] = json.loads((self.store_dir / "meta.json").read_text())
+        if self.meta["version"] != STORE_VERSION:
+            raise ValueError(f"{self.meta['version']=} not supported!")
+        if self.meta.get("frame", FRAME) != FRAME:  # the stores written before the frame was recorded are FRAME
+            raise ValueError(f"{self.meta['frame']=} not supported!")
+        with np.load(self.store_dir / "faces.npz") as data:
+            same_faces: bool = all(np.array_equal(data[name], value) for name, value in faces.items())
+        if self.meta["num_vertices"] != num_vertices or not same_faces:
+            raise ValueError(f"{self.store_dir} holds another topology than the template ({num_vertices=})!")
+        self._shard: t.Optional[_Shard] = None
+
+    def _claim_shard(self) -> _Shard:
+        """lock a shard that is not full or create a new one"""
+        capacity: int = self.meta["shard_capacity"]
+        row_shape: t.Tuple[int, int] = (self.meta["num_vertices"], 3)
+        for path in sorted((self.store_dir / "shards").glob("*.npy")):
+            fd = os.open(path, os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:  # another writer appends to it
+                os.close(fd)
+                continue
+            shard = self._open_shard(path, fd, row_shape)
+            if shard.num_rows < shard.capacity:
+                return shard
+            os.close(fd)
+
+        path = self.store_dir / "shards" / f"{uuid.uuid4().hex}.npy"
+        # create the file under another name so that no writer opens it before the header is complete
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        np.lib.format.open_memmap(tmp_path, mode="w+", dtype=DTYPE, shape=(capacity, *row_shape)).flush()
+        fd = os.open(tmp_path, os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.rename(tmp_path, path)
+        return self._open_shard(path, fd, row_shape)
+
+    @staticmethod
+    def _open_shard(path: Path, fd: int, row_shape: t.Tuple[int, int]) -> _Shard:
+        array = np.load(path, mmap_mode="r")  # only for the header
+        shape, dtype, data_offset = array.shape, array.dtype, int(array.offset)
+        del array
+        if tuple(shape[1:]) != row_shape or dtype != DTYPE:
+            raise ValueError(f"{path}: {shape=} {dtype=} not supported!")
+        shard = _Shard(path, fd, 0, shape[0], int(np.prod(row_shape)) * DTYPE.itemsize, data_offset)
+        if shard.index_path.exists():
+            last_line = _read_last_line(shard.index_path)
+            if last_line is not None:
+                shard.num_rows = int(json.loads(last_line)["row"]) + 1
+        return shard
+
+    def append(self, key: Key, vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]) -> None:
+        """store the vertices (in ``FRAME``) of (category, model, view)"""
+        row = np.ascontiguousarray(vertices, dtype=DTYPE)
+        if row.shape != (self.meta["num_vertices"], 3):
+            raise ValueError(f"{row.shape=} not supported!")
+        if self._shard is None or self._shard.num_rows >= self._shard.capacity:
+            self._release()
+            self._shard = self._claim_shard()
+        shard = self._shard
+        os.pwrite(shard.fd, row.tobytes(), shard.data_offset + shard.num_rows * shard.row_nbytes)
+        record: t.Dict[str, t.Any] = {"key": list(key), "row": shard.num_rows, "time": time.time()}
+        line: bytes = (json.dumps(record) + "\n").encode("utf-8")
+        index_fd = os.open(shard.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(index_fd, line)
+        finally:
+            os.close(index_fd)
+        shard.num_rows += 1
+
+    def _release(self) -> None:
+        if self._shard is not None:
+            os.close(self._shard.fd)  # releases the lock
+            self._shard = None
+
+    def close(self) -> None:
+        self._release()
+
+    def __enter__(self) -> "VertexStoreWriter":
+        return self
+
+    def __exit__(self, *args: t.Any) -> None:
+        self.close()
+
+
+def written_keys(store_dir: _PathLike, since: float) -> t.Set[Key]:
+    """the keys of the rows appended at or after the unix time ``since`` (e.g. by one job)"""
+    keys: t.Set[Key] = set()
+    for index_path in (Path(store_dir) / "shards").glob("*.index.jsonl"):
+        if index_path.stat().st_mtime < since - 1.0:  # not appended to since (the margin: coarse file times)
+            continue
+        with open(index_path, mode="rt") as f:
+            line: str
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # a line cut by a crash
+                    continue
+                if record.get("time", -1.0) >= since:
+                    keys.add(tuple(record["key"]))  # type: ignore
+    return keys
+
+
+class VertexStore:
+    """read-only view of a store (every shard is opened as a memory map)"""
+
+    def __init__(self, store_dir: _PathLike) -> None:
+        self.store_dir = Path(store_dir)
+        self.meta: t.Dict[str, t.Any] = json.loads((self.store_dir / "meta.json").read_text())
+        if self.meta["version"] != STORE_VERSION:
+            raise ValueError(f"{self.meta['version']=} not supported!")
+        with np.load(self.store_dir / "faces.npz") as data:
+            self.loop_vertices = data["loop_vertices"]
+            self.loop_start = data["loop_start"]
+            self.loop_total = data["loop_total"]
+
+        self.shards: t.List[np.memmap] = []
+        self.index: t.Dict[Key, t.Tuple[int, int]] = {}  # key -> (shard, row)
+        for path in sorted((self.store_dir / "shards").glob("*.npy")):
+            shard_id: int = len(self.shards)
+            self.shards.append(np.load(path, mmap_mode="r"))
+            index_path = path.with_suffix(".index.jsonl")
+            if not index_path.exists():
+                continue
+            with open(index_path, mode="rt") as f:
+                line: str
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # a line cut by a crash
+                        continue
+                    self.index[tuple(record["key"])] = (shard_id, int(record["row"]))  # type: ignore
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: Key) -> bool:
+        return tuple(key) in self.index
+
+    def keys(self) -> t.List[Key]:
+        return sorted(self.index)
+
+    def __getitem__(self, key: Key) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+        shard_id, row = self.index[tuple(key)]  # type: ignore
+        return t.cast(npt.NDArray[npt.Shape["*, 3"], npt.Float], self.shards[shard_id][row])
+
+    @property
+    def faces(self) -> t.List[t.List[int]]:
+        return [
+            self.loop_vertices[start : start + total].tolist() for start, total in zip(self.loop_start, self.loop_total)
+        ]
+
+    def obj_mesh(self, key: Key) -> ObjMesh:
+        return ObjMesh(vertices=np.asarray(self[key], dtype=np.float64), faces=self.faces, name="_".join(key))
+
+
+def compact(store_dir: _PathLike, output_dir: _PathLike) -> int:
+    """copy the indexed rows of a store (sorted by key) into a new store with exactly one shard
+
+    ``np.load(<output_dir>/shards/<id>.npy, mmap_mode="r")`` then gives every entry as one ``(N, V, 3)`` array.
+
+    Returns:
+        int: the number of entries
+    """
+    store = VertexStore(store_dir)
+    keys: t.List[Key] = store.keys()
+    writer = VertexStoreWriter(
+        output_dir,
+        store.loop_vertices,
+        store.loop_start,
+        store.loop_total,
+        num_vertices=store.meta["num_vertices"],
+        shard_capacity=max(1, len(keys)),
+    )
+    with writer:
+        for key in keys:
+            writer.append(key, store[key])
+    return len(keys)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="inspect and compact a vertex store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info_parser = subparsers.add_parser("info")
+    info_parser.add_argument("store_dir", type=lambda x: Path(x).expanduser())
+    compact_parser = subparsers.add_parser("compact")
+    compact_parser.add_argument("store_dir", type=lambda x: Path(x).expanduser())
+    compact_parser.add_argument("output_dir", type=lambda x: Path(x).expanduser())
+    export_parser = subparsers.add_parser("export", help="write one entry as an OBJ file")
+    export_parser.add_argument("store_dir", type=lambda x: Path(x).expanduser())
+    export_parser.add_argument("key", nargs=3, metavar=("CATEGORY", "MODEL", "VIEW"))
+    export_parser.add_argument("output_filepath", type=lambda x: Path(x).expanduser())
+    args = parser.parse_args()
+
+    if args.command == "info":
+        store = VertexStore(args.store_dir)
+        print(f"{len(store)} entries, {len(store.shards)} shards, {store.meta['num_vertices']} vertices per entry")
+    elif args.command == "compact":
+        num_entries: int = compact(args.store_dir, args.output_dir)
+        print(f"{num_entries} entries -> {args.output_dir}")
+    elif args.command == "export":
+        store = VertexStore(args.store_dir)
+        mesh = store.obj_mesh(tuple(args.key))  # type: ignore
+        ObjWriter(mesh.faces, name=mesh.name).write(args.output_filepath, mesh.vertices)
+
+
+if __name__ == "__main__":
+    main()
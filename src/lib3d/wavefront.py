@@ -0,0 +1,159 @@
+# Standard Library
+import gzip
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+from pathlib import Path
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+
+# Local Library
+from .fileio import atomic_write
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_PathLike = t.Union[str, Path]
+
+# ``bpy.ops.import_scene.obj`` (axis_forward="-Z", axis_up="Y") sets this rotation as the object's matrix_world
+# and ``bpy.ops.export_scene.obj`` applies its inverse: blender (x, y, z) = obj (x, -z, y)
+OBJ_TO_BLENDER: npt.NDArray[npt.Shape["4, 4"], npt.Float] = np.array(
+    [
+        [1.0, 0.0, 0.0, 0.0],
+        [0.0, 0.0, -1.0, 0.0],
+        [0.0, 1.0, 0.0, 0.0],
+        [0.0, 0.0, 0.0, 1.0],
+    ]
+)
+
+
+def blender_to_obj_axes(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """blender (x, y, z) -> obj (x, z, -y), the inverse of ``OBJ_TO_BLENDER`` (e.g. world coordinates as
+    ``bpy.ops.export_scene.obj`` writes them)"""
+    return t.cast(npt.NDArray[npt.Shape["*, 3"], npt.Float], np.asarray(vertices) @ OBJ_TO_BLENDER[:3, :3])
+
+
+@dataclass
+class ObjMesh:
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+    faces: t.List[t.List[int]]  # 0-based vertex indices
+    name: str = ""
+
+
+def read_obj(filepath: _PathLike) -> ObjMesh:
+    """Minimal Wavefront OBJ reader
+
+    Only ``v``, ``f`` and the first ``o`` line are read. Texture coordinates and normals
+    (``f v/vt/vn``) are dropped. Negative (relative) indices are supported. ``*.gz`` files are decompressed.
+    """
+    vertices: t.List[t.Tuple[float, float, float]] = []
+    faces: t.List[t.List[int]] = []
+    name: str = ""
+    with (gzip.open(filepath, mode="rt") if Path(filepath).suffix == ".gz" else open(filepath, mode="rt")) as f:
+        line: str
+        for line in f:
+            tokens = line.split()
+            if not tokens:
+                continue
+            if tokens[0] == "v":
+                vertices.append((float(tokens[1]), float(tokens[2]), float(tokens[3])))
+            elif tokens[0] == "f":
+                face: t.List[int] = []
+                for token in tokens[1:]:
+                    idx = int(token.split("/", 1)[0])
+                    face.append(idx - 1 if idx > 0 else len(vertices) + idx)
+                faces.append(face)
+            elif tokens[0] == "o" and not name and len(tokens) > 1:
+                name = tokens[1]
+    return ObjMesh(vertices=np.array(vertices, dtype=np.float64).reshape(-1, 3), faces=faces, name=name)
+
+
+class ObjWriter:
+    """Wavefront OBJ writer for meshes whose topology is fixed (e.g. a deformed template)
+
+    The ``o`` and ``f`` lines are formatted once. ``write`` only formats the vertex array, in blocks of
+    ``chunk_size`` vertices, and streams it to the file (gzip compressed for ``*.gz`` or ``compress=True``).
+    """
+
+    def __init__(
+        self,
+        faces: t.Sequence[t.Sequence[int]],
+        name: str = "",
+        chunk_size: int = 65536,
+    ) -> None:
+        """
+        Args:
+            faces: 0-based vertex indices of every face
+        """
+        self.chunk_size = chunk_size
+        self._header: bytes = f"o {name}\n".encode("utf-8") if name else b""
+        self._faces: bytes = self._format_faces(faces)
+
+    @classmethod
+    def from_loops(
+        cls,
+        loop_vertices: npt.NDArray[npt.Shape["*"], npt.Int],
+        loop_start: npt.NDArray[npt.Shape["*"], npt.Int],
+        loop_total: npt.NDArray[npt.Shape["*"], npt.Int],
+        name: str = "",
+    ) -> "ObjWriter":
+        """faces stored like ``bpy.types.Mesh`` (see ``geometry.MeshArrays``)"""
+        loop_vertices = np.asarray(loop_vertices)
+        return cls(
+            [loop_vertices[start : start + total].tolist() for start, total in zip(loop_start, loop_total)],
+            name=name,
+        )
+
+    @staticmethod
+    def _format_faces(faces: t.Sequence[t.Sequence[int]]) -> bytes:
+        if len(faces) == 0:
+            return b""
+        sizes = {len(face) for face in faces}
+        if len(sizes) == 1:  # one formatting call for the whole block
+            (size,) = sizes
+            indices = (np.asarray(faces, dtype=np.int64).reshape(-1) + 1).tolist()
+            return (("f" + " %d" * size + "\n") * len(faces) % tuple(indices)).encode("ascii")
+        return "".join("f " + " ".join(str(v + 1) for v in face) + "\n" for face in faces).encode("ascii")
+
+    def _vertex_blocks(self, vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]) -> t.Iterator[bytes]:
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        for start in range(0, len(vertices), self.chunk_size):
+            chunk = vertices[start : start + self.chunk_size]
+            yield ("v %.6f %.6f %.6f\n" * len(chunk) % tuple(chunk.reshape(-1).tolist())).encode("ascii")
+
+    def _write_to(self, f: t.BinaryIO, vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float]) -> None:
+        f.write(self._header)
+        for block in self._vertex_blocks(vertices):
+            f.write(block)
+        f.write(self._faces)
+
+    def write(
+        self,
+        filepath: _PathLike,
+        vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        compress: t.Optional[bool] = None,
+    ) -> None:
+        """write the mesh with ``vertices`` (atomically, through a temporary file in the same directory)
+
+        Args:
+            compress (bool, optional): gzip the file. Default: if the file name ends with ".gz"
+        """
+        filepath = Path(filepath)
+        if compress is None:
+            compress = filepath.suffix == ".gz"
+        with atomic_write(filepath) as f:
+            if compress:
+                with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6, mtime=0) as gz:
+                    self._write_to(gz, vertices)
+            else:
+                self._write_to(f, vertices)
+
+
+def write_obj(filepath: _PathLike, mesh: ObjMesh) -> None:
+    """Minimal Wavefront OBJ writer (``o``, ``v`` and ``f`` lines only; gzip compressed for ``*.gz``)"""
+    ObjWriter(mesh.faces, name=mesh.name).write(filepath, mesh.vertices)
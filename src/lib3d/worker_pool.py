@@ -0,0 +1,265 @@
+"""Pool of long-lived Blender workers
+
+Starting Blender for every job pays the interpreter startup, the addon registration, the factory scene
+creation and the imports of the script. ``BlenderWorkerPool`` starts ``num_workers`` Blender processes
+once and sends them jobs over pipes.
+
+Driver side::
+
+    pool = BlenderWorkerPool(cmd=[blender, "--background", "--python", script], num_workers=4)
+    for result in pool.run(jobs):
+        ...
+
+Worker side (the end of ``script``)::
+
+    if worker_pool.is_worker():
+        worker_pool.serve(handle_job, reset=utils.reset_scene)
+    else:
+        main()
+
+Protocol: one JSON object per line. The driver writes ``{"id": int, "args": [str, ...]}`` to the job pipe
+and the worker answers ``{"id": int, "ok": bool, "error": str | null, "duration": float, "rss_mb": float}``
+on the result pipe (stdout is left to Blender's own logging). Closing the job pipe stops the worker.
+
+This module does not import bpy.
+"""
+
+# Standard Library
+import json
+import os
+import queue
+import resource
+import select
+import subprocess
+import threading
+import time
+import traceback
+import typing as t
+from dataclasses import dataclass
+from logging import NullHandler
+from logging import getLogger
+
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+
+JOB_FD_ENV: str = "LIB3D_WORKER_JOB_FD"
+RESULT_FD_ENV: str = "LIB3D_WORKER_RESULT_FD"
+
+
+@dataclass
+class Job:
+    args: t.List[str]  # the arguments after "--" of a one-shot run
+    name: str = ""
+
+
+@dataclass
+class JobResult:
+    job: Job
+    ok: bool
+    error: t.Optional[str] = None
+    duration: float = 0.0  # seconds, measured in the worker
+    worker_pid: t.Optional[int] = None
+
+
+def current_rss_mb() -> float:
+    """resident set size of this process (peak RSS if /proc is not available)"""
+    try:
+        with open("/proc/self/statm", mode="rt") as f:
+            num_pages = int(f.read().split()[1])
+        return num_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10  # KiB on Linux
+
+
+###############
+# Worker side #
+###############
+
+
+def is_worker() -> bool:
+    return JOB_FD_ENV in os.environ and RESULT_FD_ENV in os.environ
+
+
+def serve(
+    handle_job: t.Callable[[t.List[str]], None],
+    reset: t.Optional[t.Callable[[], None]] = None,
+) -> None:
+    """process jobs until the job pipe is closed
+
+    Args:
+        handle_job: runs one job with the given arguments (the same arguments as after "--" of a one-shot run)
+        reset: called before every job but the first one to bring the scene back to the startup state
+    """
+    job_file = os.fdopen(int(os.environ[JOB_FD_ENV]), mode="rt")
+    result_file = os.fdopen(int(os.environ[RESULT_FD_ENV]), mode="wt")
+    num_jobs: int = 0
+    line: str
+    for line in job_file:
+        if not line.strip():
+            continue
+        request: t.Dict[str, t.Any] = json.loads(line)
+        start: float = time.perf_counter()
+        error: t.Optional[str] = None
+        try:
+            if reset is not None and num_jobs > 0:
+                reset()
+            handle_job(list(request["args"]))
+        except Exception:
+            error = traceback.format_exc()
+            logger.error(error)
+        num_jobs += 1
+        response = {
+            "id": request["id"],
+            "ok": error is None,
+            "error": error,
+            "duration": time.perf_counter() - start,
+            "rss_mb": current_rss_mb(),
+        }
+        result_file.write(json.dumps(response) + "\n")
+        result_file.flush()
+    result_file.close()
+
+
+###############
+# Driver side #
+###############
+
+
+class _Worker:
+    def __init__(self, cmd: t.List[str], env: t.Optional[t.Dict[str, str]] = None) -> None:
+        job_read, self._job_write = os.pipe()
+        self._result_read, result_write = os.pipe()
+        worker_env = dict(os.environ if env is None else env)
+        worker_env[JOB_FD_ENV] = str(job_read)
+        worker_env[RESULT_FD_ENV] = str(result_write)
+        self.process = subprocess.Popen(cmd, env=worker_env, pass_fds=(job_read, result_write))
+        # the child holds its own copies
+        os.close(job_read)
+        os.close(result_write)
+        self._job_file = os.fdopen(self._job_write, mode="wt")
+        self._result_file = os.fdopen(self._result_read, mode="rt")
+        self.num_jobs: int = 0
+        self.rss_mb: float = 0.0
+
+    def request(self, job_id: int, job: Job, timeout: t.Optional[float] = None) -> t.Dict[str, t.Any]:
+        """send a job and wait for its result (the worker is killed after ``timeout`` seconds)"""
+        try:
+            self._job_file.write(json.dumps({"id": job_id, "args": job.args}) + "\n")
+            self._job_file.flush()
+        except BrokenPipeError:
+            return self._died()
+        # one request, one line: nothing is left in the buffer of _result_file between requests
+        readable, _, _ = select.select([self._result_read], [], [], timeout)
+        if not readable:
+            self.process.kill()
+            self.process.wait()
+            return {"ok": False, "error": f"worker {self.process.pid} killed after {timeout}s", "duration": timeout}
+        line = self._result_file.readline()
+        if not line:
+            return self._died()
+        response: t.Dict[str, t.Any] = json.loads(line)
+        self.num_jobs += 1
+        self.rss_mb = float(response["rss_mb"])
+        return response
+
+    def _died(self) -> t.Dict[str, t.Any]:
+        returncode = self.process.wait()
+        return {"ok": False, "error": f"worker {self.process.pid} exited with {returncode=}", "duration": 0.0}
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stop(self) -> None:
+        for f in (self._job_file, self._result_file):
+            try:
+                f.close()
+            except BrokenPipeError:
+                pass
+        self.process.wait()
+
+
+class BlenderWorkerPool:
+    """run jobs on ``num_workers`` long-lived Blender processes
+
+    A worker is replaced by a new one after ``max_jobs_per_worker`` jobs, when its RSS exceeds
+    ``max_rss_mb`` or when it dies.
+    """
+
+    def __init__(
+        self,
+        cmd: t.List[str],
+        num_workers: int,
+        max_jobs_per_worker: int = 100,
+        max_rss_mb: t.Optional[float] = None,
+        env: t.Optional[t.Dict[str, str]] = None,
+        timeout: t.Optional[float] = None,
+    ) -> None:
+        if num_workers < 1:
+            raise ValueError(f"{num_workers=} not supported!")
+        self.cmd = cmd
+        self.num_workers = num_workers
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.env = env
+        self.timeout = timeout  # seconds per job; a hung worker is killed and replaced
+
+    def _needs_recycle(self, worker: _Worker) -> bool:
+        if not worker.alive or worker.num_jobs >= self.max_jobs_per_worker:
+            return True
+        return self.max_rss_mb is not None and worker.rss_mb > self.max_rss_mb
+
+    def _work(
+        self,
+        jobs: "queue.Queue[t.Optional[t.Tuple[int, Job]]]",
+        results: "queue.Queue[t.Optional[JobResult]]",
+    ) -> None:
+        worker: t.Optional[_Worker] = None
+        try:
+            while (item := jobs.get()) is not None:
+                job_id, job = item
+                if worker is None:
+                    worker = _Worker(self.cmd, env=self.env)
+                response = worker.request(job_id, job, timeout=self.timeout)
+                results.put(
+                    JobResult(
+                        job=job,
+                        ok=bool(response["ok"]),
+                        error=response["error"],
+                        duration=float(response["duration"]),
+                        worker_pid=worker.process.pid,
+                    )
+                )
+                if self._needs_recycle(worker):
+                    logger.info(f"recycle worker {worker.process.pid}: {worker.num_jobs=}, {worker.rss_mb=:.1f}")
+                    worker.stop()
+                    worker = None
+        finally:
+            if worker is not None:
+                worker.stop()
+            results.put(None)
+
+    def run(self, jobs: t.Iterable[Job]) -> t.Iterator[JobResult]:
+        """run all jobs and yield their results in the order of completion"""
+        job_queue: "queue.Queue[t.Optional[t.Tuple[int, Job]]]" = queue.Queue()
+        result_queue: "queue.Queue[t.Optional[JobResult]]" = queue.Queue()
+        for job_id, job in enumerate(jobs):
+            job_queue.put((job_id, job))
+        for _ in range(self.num_workers):
+            job_queue.put(None)
+
+        threads = [
+            threading.Thread(target=self._work, args=(job_queue, result_queue), daemon=True)
+            for _ in range(self.num_workers)
+        ]
+        for thread in threads:
+            thread.start()
+        num_running: int = len(threads)
+        while num_running > 0:
+            result = result_queue.get()
+            if result is None:
+                num_running -= 1
+                continue
+            yield result
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,35 @@
+# Standard Library
+import typing as t
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+import pytest
+
+# First Party Library
+from lib3d.geometry import MeshArrays
+from lib3d.intersection import MaskFrame
+from lib3d.mask import create_mask
+from lib3d.processing import build_mold_mesh
+from lib3d.types import MoldConfig
+
+
+def synthetic_depth(size: int) -> npt.NDArray[npt.Shape["*, *"], npt.UInt8]:
+    """an ellipse of varying depth (0-254) on the background 255"""
+    yy, xx = np.mgrid[-1.0 : 1.0 : size * 1j, -1.0 : 1.0 : size * 1j]
+    r2 = (xx / 0.6) ** 2 + (yy / 0.8) ** 2
+    depth = np.full((size, size), 255, dtype=np.uint8)
+    inside = r2 < 1.0
+    depth[inside] = (64 + 128 * r2[inside] + 16 * np.sin(8 * xx[inside])).astype(np.uint8)
+    return depth
+
+
+@pytest.fixture
+def mold() -> t.Tuple[MeshArrays, MaskFrame]:
+    """the base mold and the mask frame of ``processing.build_mold_search`` for ``synthetic_depth(48)``"""
+    depth = synthetic_depth(48)
+    mesh = build_mold_mesh(255 - depth, MoldConfig(builder="array", grid_resolution=8))
+    y_min, z_min = mesh.vertices[:, 1:].min(axis=0)
+    y_max, z_max = mesh.vertices[:, 1:].max(axis=0)
+    mask_array = create_mask(depth, background=255)[:, ::-1]
+    return mesh, MaskFrame(mask_array, y_min=y_min, z_min=z_min, y_max=y_max, z_max=z_max)
@@ -0,0 +1,106 @@
+# Standard Library
+import typing as t
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+import pytest
+
+# First Party Library
+from lib3d.geometry import close_vertex_pairs
+from lib3d.geometry import inside_polygon_angle_sum
+from lib3d.geometry import inside_polygon_edge_function
+from lib3d.geometry import plane_basis
+from lib3d.geometry import sample_points_on_plane
+
+
+def brute_force_close_pairs(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float], tolerance: float
+) -> npt.NDArray[npt.Shape["*, 2"], npt.Int]:
+    i, j = np.triu_indices(len(vertices), k=1)
+    ok = np.linalg.norm(vertices[i] - vertices[j], axis=1) < tolerance
+    return np.stack([i[ok], j[ok]], axis=1)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("tolerance", [0.001, 0.05])
+def test_close_vertex_pairs_matches_brute_force(seed: int, tolerance: float) -> None:
+    rng = np.random.default_rng(seed)
+    vertices = rng.uniform(-1.0, 1.0, size=(400, 3))
+    # clusters of near-duplicates around some vertices, also across the cell borders
+    centers = vertices[rng.integers(len(vertices), size=40)]
+    duplicates = centers + rng.normal(scale=tolerance / 3, size=centers.shape)
+    vertices = np.concatenate([vertices, duplicates, duplicates[:10]])
+    rng.shuffle(vertices)
+
+    expected = brute_force_close_pairs(vertices, tolerance)
+    assert len(expected) > 0
+    np.testing.assert_array_equal(close_vertex_pairs(vertices, tolerance=tolerance), expected)
+
+
+def test_close_vertex_pairs_of_few_vertices() -> None:
+    assert close_vertex_pairs(np.zeros((1, 3))).shape == (0, 2)
+    np.testing.assert_array_equal(close_vertex_pairs(np.zeros((3, 3))), [[0, 1], [0, 2], [1, 2]])
+    with pytest.raises(ValueError):
+        close_vertex_pairs(np.zeros((3, 3)), tolerance=0.0)
+
+
+def star_polygon(num_points: int = 5) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """a non-convex star on the plane ``x + 2y + 3z = 0`` (edges shorter than 2)"""
+    angles = np.linspace(0.0, 2 * np.pi, 2 * num_points, endpoint=False)
+    radii = np.where(np.arange(2 * num_points) % 2 == 0, 1.6, 0.7)
+    u, v = plane_basis(np.array([1.0, 2.0, 3.0]))
+    return (radii * np.cos(angles))[:, np.newaxis] * u + (radii * np.sin(angles))[:, np.newaxis] * v
+
+
+def distance_to_polygon_edges(
+    polygon: npt.NDArray[npt.Shape["*, 3"], npt.Float], points: npt.NDArray[npt.Shape["*, 3"], npt.Float]
+) -> npt.NDArray[npt.Shape["*"], npt.Float]:
+    a = polygon[np.newaxis]
+    edges = np.roll(polygon, shift=-1, axis=0)[np.newaxis] - a
+    offsets = points[:, np.newaxis] - a
+    s = np.clip(np.einsum("nki,nki->nk", offsets, edges) / np.einsum("nki,nki->nk", edges, edges), 0.0, 1.0)
+    return t.cast(
+        npt.NDArray[npt.Shape["*"], npt.Float], np.linalg.norm(offsets - s[..., np.newaxis] * edges, axis=2).min(axis=1)
+    )
+
+
+def test_inside_polygon_edge_function_matches_angle_sum_on_non_convex_polygon() -> None:
+    polygon = star_polygon()
+    normal = np.array([1.0, 2.0, 3.0]) / np.sqrt(14.0)
+    points = sample_points_on_plane(np.zeros(3), normal, num_samples=4000, half_size=2.0, rng=0)
+    points = points[distance_to_polygon_edges(polygon, points) > 0.2]  # away from the edge tolerance of angle_sum
+    polygons = np.broadcast_to(polygon, (len(points), *polygon.shape))
+    normals = np.broadcast_to(normal, points.shape)
+
+    expected = inside_polygon_angle_sum(polygons, points, normals)
+    assert 0 < np.count_nonzero(expected) < len(points)
+    inside, on_edge = inside_polygon_edge_function(polygons, points, normals)
+    np.testing.assert_array_equal(inside, expected)
+    assert not on_edge.any()
+
+    # the points on the edges (and the vertices) are inside for both tests
+    s = np.linspace(0.0, 1.0, 7)[:, np.newaxis, np.newaxis]
+    edge_points = (polygon + s * (np.roll(polygon, shift=-1, axis=0) - polygon)).reshape(-1, 3)
+    polygons = np.broadcast_to(polygon, (len(edge_points), *polygon.shape))
+    normals = np.broadcast_to(normal, edge_points.shape)
+    assert inside_polygon_angle_sum(polygons, edge_points, normals).all()
+    inside, on_edge = inside_polygon_edge_function(polygons, edge_points, normals)
+    assert inside.all() and on_edge.all()
+
+
+@pytest.mark.parametrize("half_size", [None, 0.5])
+def test_sample_points_on_plane(half_size: t.Optional[float]) -> None:
+    point = np.array([0.3, -1.0, 2.0])
+    normal = np.array([0.0, 3.0, 4.0])
+    points = sample_points_on_plane(point, normal, num_samples=1000, half_size=half_size, rng=0)
+    assert points.shape == (1000, 3)
+    np.testing.assert_allclose((points - point) @ normal, 0.0, atol=1e-12)
+    if half_size is not None:
+        u, v = plane_basis(normal / 5.0)
+        uv = np.stack([(points - point) @ u, (points - point) @ v], axis=1)
+        assert np.all(np.abs(uv) <= half_size) and np.all(np.abs(uv).max(axis=0) > 0.9 * half_size)
+    # the same seed gives the same points
+    np.testing.assert_array_equal(sample_points_on_plane(point, normal, 1000, half_size=half_size, rng=0), points)
+    with pytest.raises(ValueError):
+        sample_points_on_plane(point, np.zeros(3), num_samples=1)
@@ -0,0 +1,113 @@
+# Standard Library
+import math
+import typing as t
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+import pytest
+
+# First Party Library
+from lib3d.geometry import FLT_EPSILON
+from lib3d.geometry import MeshArrays
+from lib3d.intersection import MaskFrame
+from lib3d.intersection import build_polygon_bvh
+from lib3d.intersection import find_farthest_intersections
+from lib3d.intersection import find_farthest_intersections_bvh
+
+
+def sphere_vertices(num_segments: int, num_rings: int) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """the vertices of a unit UV sphere (the template is only used through the rays through its vertices)"""
+    theta = np.linspace(0.0, np.pi, num_rings + 1)[1:-1]
+    phi = np.linspace(0.0, 2 * np.pi, num_segments, endpoint=False)
+    theta_grid, phi_grid = np.meshgrid(theta, phi, indexing="ij")
+    ring_vertices = np.stack(
+        [np.sin(theta_grid) * np.cos(phi_grid), np.sin(theta_grid) * np.sin(phi_grid), np.cos(theta_grid)], axis=-1
+    ).reshape(-1, 3)
+    return np.concatenate([[[0.0, 0.0, 1.0]], ring_vertices, [[0.0, 0.0, -1.0]]])
+
+
+def whether_intersection_is_inside_polygon(
+    vertices: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    intersection: npt.NDArray[npt.Shape["3"], npt.Float],
+    normal: npt.NDArray[npt.Shape["3"], npt.Float],
+) -> bool:
+    """``utils.whether_intersection_is_inside_polygon`` of the original code without ``mathutils``"""
+    angle_sum: float = 0.0
+    for k in range(len(vertices)):
+        tmp1 = vertices[k] - intersection
+        tmp2 = vertices[(k + 1) % len(vertices)] - intersection
+        len1, len2 = float(np.linalg.norm(tmp1)), float(np.linalg.norm(tmp2))
+        if abs(len1 + len2 - float(np.linalg.norm(tmp2 - tmp1))) < 0.01:
+            return True
+        angle_degree = math.degrees(math.acos(max(-1.0, min(1.0, float(tmp1 @ tmp2) / (len1 * len2)))))
+        if float(np.cross(tmp1, tmp2) @ normal) < 0:
+            angle_degree *= -1
+        angle_sum += angle_degree
+    return abs(angle_sum / 360) >= 0.1
+
+
+def reference_farthest_points(
+    targets: npt.NDArray[npt.Shape["*, 3"], npt.Float], mesh: MeshArrays, mask_frame: MaskFrame
+) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    """the loop of ``move_mesh_vertices_with_mask`` of the original code, one (vertex, polygon) pair at a time
+
+    Returns:
+        np.ndarray: the farthest accepted intersection of every ray (zero if there is none)
+    """
+    im_height, im_width = mask_frame.mask_array.shape[:2]
+    y_min, z_min, y_max, z_max = mask_frame.y_min, mask_frame.z_min, mask_frame.y_max, mask_frame.z_max
+    result = np.zeros_like(targets)
+    for i, target in enumerate(targets):
+        best = np.zeros(3)
+        for polygon in range(mesh.num_polygons):
+            loop = mesh.loop_vertices[mesh.loop_start[polygon] : mesh.loop_start[polygon] + mesh.loop_total[polygon]]
+            normal = mesh.world_normals[polygon]
+            dot = float(normal @ target)
+            if abs(dot) <= FLT_EPSILON:
+                continue
+            intersection = target * float(normal @ mesh.vertices[loop[0]]) / dot
+            y, z = intersection[1], intersection[2]
+            if y < y_min or y > y_max or z < z_min or z > z_max:
+                continue
+            w = int(im_width * (1 - (y - (y_min - 1)) / (y_max - (y_min - 1))))
+            h = int(im_height * (1 - (z - (z_min - 1)) / (z_max - (z_min - 1))))
+            if mask_frame.mask_array[min(h, im_height - 1), min(w, im_width - 1)] == 0:
+                continue
+            if float(target @ intersection) < 0:
+                continue
+            if whether_intersection_is_inside_polygon(
+                mesh.vertices[loop], intersection, mesh.local_normals[polygon]
+            ) and np.linalg.norm(intersection) > np.linalg.norm(best):
+                best = intersection
+        result[i] = best
+    return result
+
+
+@pytest.mark.parametrize("chunk_size", [1, 97, 1 << 18])
+def test_find_farthest_intersections_matches_reference_loop(
+    mold: t.Tuple[MeshArrays, MaskFrame], chunk_size: int
+) -> None:
+    mesh, mask_frame = mold
+    targets = sphere_vertices(num_segments=16, num_rings=8)
+    expected = reference_farthest_points(targets, mesh, mask_frame)
+    assert 0 < np.count_nonzero(expected.any(axis=1)) < len(targets)  # some rays miss the foreground
+
+    hits = find_farthest_intersections(targets, mesh, mask_frame, chunk_size=chunk_size)
+    np.testing.assert_array_equal(hits.found, expected.any(axis=1))
+    np.testing.assert_allclose(hits.points[hits.found], expected[hits.found], rtol=0.0, atol=1e-9)
+
+
+@pytest.mark.parametrize("prebuilt", [False, True])
+@pytest.mark.parametrize("chunk_size", [64, 1 << 18])
+def test_find_farthest_intersections_bvh_matches_reference_loop(
+    mold: t.Tuple[MeshArrays, MaskFrame], prebuilt: bool, chunk_size: int
+) -> None:
+    mesh, mask_frame = mold
+    targets = sphere_vertices(num_segments=16, num_rings=8)
+    expected = reference_farthest_points(targets, mesh, mask_frame)
+
+    bvh = build_polygon_bvh(mesh, leaf_size=4) if prebuilt else None
+    hits = find_farthest_intersections_bvh(targets, mesh, mask_frame, bvh=bvh, chunk_size=chunk_size)
+    np.testing.assert_array_equal(hits.found, expected.any(axis=1))
+    np.testing.assert_allclose(hits.points[hits.found], expected[hits.found], rtol=0.0, atol=1e-9)
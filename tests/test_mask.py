@@ -0,0 +1,44 @@
+# Third Party Library
+import nptyping as npt
+import numpy as np
+import pytest
+
+# First Party Library
+from lib3d.mask import MaskIndex
+from lib3d.mask import create_mask
+from lib3d.mask import dilate
+
+
+def random_depth_image(seed: int, height: int = 37, width: int = 53) -> npt.NDArray[npt.Shape["*, *"], npt.UInt8]:
+    """blobs of random depth (0-254) on the background 255, touching the image border"""
+    rng = np.random.default_rng(seed)
+    im = np.full((height, width), 255, dtype=np.uint8)
+    foreground = rng.random((height, width)) < 0.04
+    foreground[0, rng.integers(width)] = True
+    foreground = dilate(foreground.astype(np.uint8), size=3) != 0
+    im[foreground] = rng.integers(0, 255, size=int(np.count_nonzero(foreground)))
+    return im
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("size", [1, 3, 5, 7])
+def test_mask_index_matches_create_mask(seed: int, size: int) -> None:
+    im = random_depth_image(seed)
+    index = MaskIndex.build(im, background=255)
+    np.testing.assert_array_equal(index.mask(size), create_mask(im, background=255, size=size).astype(np.uint8))
+
+
+def test_mask_index_of_empty_and_full_images() -> None:
+    for im in (np.full((8, 9), 255, dtype=np.uint8), np.zeros((8, 9), dtype=np.uint8)):
+        index = MaskIndex.build(im, background=255)
+        for size in (1, 5):
+            np.testing.assert_array_equal(index.mask(size), create_mask(im, background=255, size=size))
+
+
+@pytest.mark.parametrize("size", [0, 2, 4])
+def test_even_mask_sizes_are_rejected(size: int) -> None:
+    im = random_depth_image(0)
+    with pytest.raises(ValueError):
+        MaskIndex.build(im, background=255).mask(size)
+    with pytest.raises(ValueError):
+        create_mask(im, background=255, size=size)
@@ -0,0 +1,76 @@
+# Standard Library
+import typing as t
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+import pytest
+
+# First Party Library
+from lib3d.geometry import MeshArrays
+from lib3d.intersection import FarthestHits
+from lib3d.intersection import MaskFrame
+from lib3d.intersection import build_polygon_bvh
+from lib3d.intersection import find_farthest_intersections
+from lib3d.intersection import find_farthest_intersections_near
+from lib3d.multires import TemplateHierarchy
+from lib3d.multires import deform_coarse_to_fine
+from lib3d.template_cache import unit_ray_directions
+
+OCTAHEDRON_VERTICES = np.array([[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]], dtype=np.float64)
+OCTAHEDRON_FACES = np.array([[0, 2, 4], [2, 1, 4], [1, 3, 4], [3, 0, 4], [2, 0, 5], [1, 2, 5], [3, 1, 5], [0, 3, 5]])
+
+
+def octahedron_hierarchy(levels: int) -> TemplateHierarchy:
+    return TemplateHierarchy.build(
+        OCTAHEDRON_VERTICES, OCTAHEDRON_FACES.ravel(), np.full(len(OCTAHEDRON_FACES), 3), levels=levels
+    )
+
+
+def test_subdivision_keeps_the_old_vertices() -> None:
+    hierarchy = octahedron_hierarchy(levels=2)
+    assert [len(v) for v in hierarchy.vertices] == [6, 18, 66]
+    assert [len(total) for total in hierarchy.loop_total] == [8, 32, 128]
+    for level in range(1, hierarchy.levels + 1):
+        coarse, fine = hierarchy.vertices[level - 1], hierarchy.vertices[level]
+        np.testing.assert_array_equal(fine[: len(coarse)], coarse)
+        # every vertex is the mean of its parents (an old vertex is its own parent, a new one an edge midpoint)
+        np.testing.assert_allclose(fine, coarse[hierarchy.parents[level]].mean(axis=1), atol=1e-12)
+    assert len(hierarchy.faces) == 128 and all(len(face) == 3 for face in hierarchy.faces)
+    with pytest.raises(ValueError):
+        octahedron_hierarchy(levels=-1)
+
+
+@pytest.mark.parametrize("use_near", [False, True])
+def test_deform_coarse_to_fine_matches_full_search(mold: t.Tuple[MeshArrays, MaskFrame], use_near: bool) -> None:
+    mesh, mask_frame = mold
+    bvh = build_polygon_bvh(mesh)
+    hierarchy = octahedron_hierarchy(levels=3)
+
+    def find_base(targets: npt.NDArray[npt.Shape["*, 3"], npt.Float]) -> FarthestHits:
+        return find_farthest_intersections(targets, mesh, mask_frame)
+
+    def find_base_near(
+        targets: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        box_min: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+        box_max: npt.NDArray[npt.Shape["*, 3"], npt.Float],
+    ) -> FarthestHits:
+        return find_farthest_intersections_near(targets, mesh, mask_frame, box_min, box_max, bvh=bvh)
+
+    def find_sub(targets: npt.NDArray[npt.Shape["*, 3"], npt.Float]) -> FarthestHits:
+        return FarthestHits.empty(len(targets))
+
+    moved = deform_coarse_to_fine(
+        hierarchy, np.eye(4), find_base, find_sub, find_base_near=find_base_near if use_near else None
+    )
+
+    # deform_template of the finest level with the full search
+    fine = hierarchy.vertices[-1]
+    hits = find_base(unit_ray_directions(fine))
+    expected = np.where(hits.found[:, np.newaxis], hits.points, fine)
+    same = np.all(np.abs(moved - expected) <= 1e-9, axis=1)
+    assert np.count_nonzero(hits.found) > len(fine) // 2
+    # level 0 is searched fully; a finer vertex can only miss a hit that none of its parents' neighborhoods has
+    assert same[: len(OCTAHEDRON_VERTICES)].all()
+    np.testing.assert_array_equal(moved[~same], fine[~same])
+    assert np.count_nonzero(~same) <= 0.02 * len(fine)
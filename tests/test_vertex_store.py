@@ -0,0 +1,89 @@
+# Standard Library
+import json
+import multiprocessing
+import time
+import typing as t
+from pathlib import Path
+
+# Third Party Library
+import nptyping as npt
+import numpy as np
+import pytest
+
+# First Party Library
+from lib3d.vertex_store import FRAME
+from lib3d.vertex_store import Key
+from lib3d.vertex_store import VertexStore
+from lib3d.vertex_store import VertexStoreWriter
+from lib3d.vertex_store import compact
+from lib3d.vertex_store import written_keys
+
+# a quad and a triangle on 5 vertices
+LOOP_VERTICES = np.array([0, 1, 2, 3, 1, 4, 2])
+LOOP_START = np.array([0, 4])
+LOOP_TOTAL = np.array([4, 3])
+NUM_VERTICES: int = 5
+SHARD_CAPACITY: int = 7  # small, so that the writers fill shards and continue each other's shards
+NUM_WRITERS: int = 4
+ROWS_PER_WRITER: int = 30
+
+
+def key_of(writer_id: int, i: int) -> Key:
+    return (f"{writer_id:02d}", f"{i:04d}", "00")
+
+
+def vertices_of(key: Key) -> npt.NDArray[npt.Shape["*, 3"], npt.Float]:
+    return np.arange(NUM_VERTICES * 3, dtype=np.float32).reshape(NUM_VERTICES, 3) + 1000 * int(key[0]) + int(key[1])
+
+
+def append_rows(store_dir: Path, writer_id: int) -> None:
+    with VertexStoreWriter(
+        store_dir, LOOP_VERTICES, LOOP_START, LOOP_TOTAL, num_vertices=NUM_VERTICES, shard_capacity=SHARD_CAPACITY
+    ) as writer:
+        for i in range(ROWS_PER_WRITER):
+            key = key_of(writer_id, i)
+            writer.append(key, vertices_of(key))
+            if i % 10 == 9:  # let the other writers take over the shard
+                writer.close()
+
+
+def test_concurrent_appends(tmp_path: Path) -> None:
+    store_dir = tmp_path / "vertex_store"
+    started = time.time()
+    processes = [
+        multiprocessing.Process(target=append_rows, args=(store_dir, writer_id)) for writer_id in range(NUM_WRITERS)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    expected_keys = sorted(key_of(writer_id, i) for writer_id in range(NUM_WRITERS) for i in range(ROWS_PER_WRITER))
+    store = VertexStore(store_dir)
+    assert store.meta["frame"] == FRAME == "obj_world"
+    assert store.keys() == expected_keys
+    for key in expected_keys:
+        np.testing.assert_array_equal(store[key], vertices_of(key))
+    assert store.faces == [[0, 1, 2, 3], [1, 4, 2]]
+    # every row is used once, no shard is over its capacity
+    rows: t.List[t.Tuple[int, int]] = sorted(store.index.values())
+    assert len(set(rows)) == len(rows)
+    assert all(row < SHARD_CAPACITY for _, row in rows)
+    assert written_keys(store_dir, since=started) == set(expected_keys)
+    assert written_keys(store_dir, since=time.time() + 10.0) == set()
+
+    assert compact(store_dir, tmp_path / "compact") == len(expected_keys)
+    compacted = VertexStore(tmp_path / "compact")
+    assert len(compacted.shards) == 1 and compacted.keys() == expected_keys
+    np.testing.assert_array_equal(compacted[expected_keys[-1]], vertices_of(expected_keys[-1]))
+
+
+def test_writer_rejects_another_topology_and_frame(tmp_path: Path) -> None:
+    append_rows(tmp_path, 0)
+    with pytest.raises(ValueError):
+        VertexStoreWriter(tmp_path, LOOP_VERTICES, LOOP_START, LOOP_TOTAL, num_vertices=NUM_VERTICES + 1)
+    meta = json.loads((tmp_path / "meta.json").read_text())
+    (tmp_path / "meta.json").write_text(json.dumps({**meta, "frame": "blender_local"}))
+    with pytest.raises(ValueError):
+        VertexStoreWriter(tmp_path, LOOP_VERTICES, LOOP_START, LOOP_TOTAL, num_vertices=NUM_VERTICES)